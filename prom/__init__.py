@@ -9,7 +9,7 @@ from .config import DsnConnection, \
     ObjectField, \
     JsonField, \
     Index
-from .query import Query, CacheQuery
+from .query import Query, CacheQuery, SharedCacheQuery, RowCacheQuery
 from . import decorators
 from .model import Orm
 from .interface import get_interface, \
@@ -17,7 +17,7 @@ from .interface import get_interface, \
     get_interfaces, \
     configure, \
     configure_environ
-from .exception import InterfaceError, Error, UniqueError
+from .exception import InterfaceError, Error, UniqueError, NPlusOneError
 from . import utils
 
 
@@ -17,6 +17,7 @@ from prom.interface import get_interface
 from prom.cli.generate import main_generate
 from prom.cli.dump import main_dump
 from prom.cli.dump import main_restore
+from prom.cli.top import main_top
 
 
 if __name__ == "__main__":
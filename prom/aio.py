@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""
+Awaitable versions of the Query and Orm methods for asyncio code
+
+    o = await Foo.query.is_bar(1).aget_one()
+    await o.asave()
+    async for o in Foo.query.aall():
+        pass
+
+The calls run on a thread pool that belongs to the interface, the pool has one
+worker for each connection the interface can hand out at the same time (see
+Interface.concurrency()) so the workers never wait on each other for a connection,
+set the aio_workers dsn option to change it.
+
+Postgres interfaces can also run get, get_one, and count on psycopg2 asynchronous
+connections that are polled by the event loop instead of using a thread, set the
+aio_native dsn option to turn it on. Those connections belong to the event loop
+that first used them. Everything else (writes, transactions, queries that hit a
+cache) still uses the thread pool, and if a native query fails it is run again on
+the thread pool so it gets the interface's normal error handling (creating missing
+tables, reconnecting).
+
+This module uses the asyncio api (no async syntax) so prom still installs on
+python 2, it is only imported by the a* methods.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import Rows
+from .compat import *
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    from .interface.postgres import PostgreSQL, BYTEA
+except ImportError:
+    psycopg2 = None
+    PostgreSQL = None
+
+
+logger = logging.getLogger(__name__)
+
+
+runners = {}
+runners_lock = threading.Lock()
+
+
+def get_runner(interface):
+    """return the Runner for interface, creating it the first time"""
+    runner = runners.get(interface)
+    if runner is None:
+        with runners_lock:
+            runner = runners.get(interface)
+            if runner is None:
+                options = interface.connection_config.options
+                runner_class = Runner
+                if PostgreSQL and isinstance(interface, PostgreSQL) and int(options.get("aio_native", 0)):
+                    runner_class = PostgresRunner
+                runner = runner_class(interface, int(options.get("aio_workers", 0)))
+                runners[interface] = runner
+    return runner
+
+
+def close_runners():
+    """shut down every runner's threads and native connections"""
+    with runners_lock:
+        for runner in runners.values():
+            runner.close()
+        runners.clear()
+
+
+def run(interface, callback, *args, **kwargs):
+    """run callback(*args, **kwargs) on interface's thread pool
+
+    return -- asyncio.Future -- resolves to what callback returns
+    """
+    return get_runner(interface).submit(callback, *args, **kwargs)
+
+
+def then(future, callback):
+    """return a future that resolves to callback(future.result()), exceptions from
+    either future or callback are passed along"""
+    ret = asyncio.get_event_loop().create_future()
+
+    def done(f):
+        if ret.done(): return
+        if f.cancelled():
+            ret.cancel()
+            return
+
+        try:
+            ret.set_result(callback(f.result()))
+        except Exception as e:
+            ret.set_exception(e)
+
+    future.add_done_callback(done)
+    return ret
+
+
+def resolve(future, result=None, exception=None):
+    """set the result or exception of future unless it was already cancelled"""
+    if not future.done():
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+
+class Runner(object):
+    """Runs prom calls for one interface on a thread pool
+
+    interface -- Interface -- the interface every call uses
+    max_workers -- int -- how many calls can run at the same time, defaults to
+        interface.concurrency()
+    """
+    def __init__(self, interface, max_workers=0):
+        self.interface = interface
+        self.max_workers = max_workers or interface.concurrency()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, callback, *args, **kwargs):
+        # the worker runs the call in the caller's context so it sees the
+        # caller's context variables, like tags.request_id()
+        return asyncio.wrap_future(self.executor.submit(
+            copy_context().run,
+            callback,
+            *args,
+            **kwargs
+        ))
+
+    def query(self, query, method_name, *args, **kwargs):
+        """run query.method_name(*args, **kwargs)"""
+        return self.submit(getattr(query, method_name), *args, **kwargs)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class PostgresRunner(Runner):
+    """Runs get, get_one, and count on psycopg2 asynchronous connections and
+    everything else on the thread pool
+
+    http://initd.org/psycopg/docs/advanced.html#asynchronous-support
+    """
+    native_methods = set(["get", "get_one", "count", "get_pk", "get_pks"])
+
+    def __init__(self, interface, max_workers=0):
+        super(PostgresRunner, self).__init__(interface, max_workers)
+        self.maxconn = self.max_workers
+        self.size = 0
+        self.idle = []
+        self.waiters = collections.deque()
+
+    def query(self, query, method_name, *args, **kwargs):
+        if method_name in self.native_methods and self.is_native(query, method_name):
+            return getattr(self, "_{}".format(method_name))(query, *args, **kwargs)
+        return super(PostgresRunner, self).query(query, method_name, *args, **kwargs)
+
+    def is_native(self, query, method_name):
+        """native queries skip Query._query(), so any query class that overrides it
+        or method_name (the cache queries for example) or the interface's query
+        methods has to go through the thread pool, and so do reads that go to read
+        replicas or shards and the reads of an interface with hooks or SQL comments"""
+        from .query import Query
+        query_class = type(query)
+        return (
+            query.can_get
+            and query_class._query == Query._query
+            and getattr(query_class, method_name) == getattr(Query, method_name)
+            and query_class._interface_query == Query._interface_query
+            and not (query.replica_methods and self.interface.get_replicas())
+            and not query.shards
+            and not self.interface.hooks
+            and not self.interface.query_tags
+        )
+
+    def _get(self, query, limit=None, page=None):
+        limit_paginate = query._get_prepare(limit, page)
+        query_str, query_args = self.interface.get_SQL(query.schema, query)
+        def finish(rows):
+            if not query.tuple_rows:
+                rows = rows.dicts()
+            return query._get_iterator(rows, limit_paginate)
+        return self.fallback(self.execute(query_str, query_args), finish, query, "get", limit, page)
+
+    def _get_one(self, query):
+        query.default_val = None
+        query_str, query_args = self.interface.get_SQL(query.schema, query, one_query=True)
+        def finish(rows):
+            return query.orm_class(rows.row_dict(rows[0]), hydrate=True) if rows else None
+        return self.fallback(self.execute(query_str, query_args), finish, query, "get_one")
+
+    def _get_pk(self, query, field_val):
+        return self._get_one(query.copy().is_field(query.schema.pk.name, field_val))
+
+    def _get_pks(self, query, field_vals):
+        return self._get(query.copy().in_field(query.schema.pk.name, field_vals))
+
+    def _count(self, query):
+        # count queries shouldn't care about sorting
+        q = query.copy()
+        q.fields_sort = q.fields_sort_class()
+        query_str, query_args = self.interface.get_SQL(q.schema, q, count_query=True)
+        def finish(rows):
+            return int(rows[0][0]) if rows else 0
+        return self.fallback(self.execute(query_str, query_args), finish, query, "count")
+
+    def fallback(self, future, callback, query, method_name, *args, **kwargs):
+        """resolve to callback(future.result()), or run query.method_name() on the
+        thread pool if the native query failed"""
+        ret = asyncio.get_event_loop().create_future()
+
+        def retried(f):
+            if f.cancelled():
+                ret.cancel()
+            elif f.exception() is None:
+                resolve(ret, f.result())
+            else:
+                resolve(ret, exception=f.exception())
+
+        def done(f):
+            if ret.done(): return
+            if f.cancelled():
+                ret.cancel()
+                return
+
+            e = f.exception()
+            if e is None:
+                try:
+                    resolve(ret, callback(f.result()))
+                except Exception as e:
+                    resolve(ret, exception=e)
+
+            else:
+                logger.debug("native {} failed, running it on the thread pool: {}".format(method_name, e))
+                r = super(PostgresRunner, self).query(query, method_name, *args, **kwargs)
+                r.add_done_callback(retried)
+
+        future.add_done_callback(done)
+        return ret
+
+    def execute(self, query_str, query_args):
+        """run the query on a native connection
+
+        return -- asyncio.Future -- resolves to utils.Rows
+        """
+        ret = asyncio.get_event_loop().create_future()
+
+        def executed(f, connection, cursor):
+            e = f.exception()
+            if e is None:
+                try:
+                    rows = Rows([d[0] for d in cursor.description], cursor.fetchall())
+                except Exception as e:
+                    self.putconn(connection)
+                    resolve(ret, exception=e)
+                else:
+                    self.putconn(connection)
+                    resolve(ret, rows)
+
+            else:
+                self.putconn(connection)
+                resolve(ret, exception=e)
+
+        def connected(f):
+            e = f.exception()
+            if e is not None:
+                resolve(ret, exception=e)
+                return
+
+            connection = f.result()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query_str, query_args)
+            except Exception as e:
+                self.putconn(connection)
+                resolve(ret, exception=e)
+            else:
+                w = self.wait(connection)
+                w.add_done_callback(lambda f: executed(f, connection, cursor))
+
+        self.getconn().add_done_callback(connected)
+        return ret
+
+    def getconn(self):
+        """return -- asyncio.Future -- resolves to an idle native connection, if
+        maxconn connections are open this waits for one to be returned"""
+        ret = asyncio.get_event_loop().create_future()
+        if self.idle:
+            ret.set_result(self.idle.pop())
+
+        elif self.size < self.maxconn:
+            self.connect(ret)
+
+        else:
+            self.waiters.append(ret)
+
+        return ret
+
+    def putconn(self, connection):
+        if connection.closed:
+            self.size -= 1
+            while self.waiters:
+                waiter = self.waiters.popleft()
+                if not waiter.done():
+                    self.connect(waiter)
+                    break
+            return
+
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(connection)
+                return
+
+        self.idle.append(connection)
+
+    def connect(self, future):
+        """open a new native connection and resolve future with it"""
+        config = self.interface.connection_config
+        self.size += 1
+
+        def connected(f):
+            e = f.exception()
+            if e is None:
+                psycopg2.extensions.register_type(BYTEA, connection)
+                if future.done():
+                    self.putconn(connection)
+                else:
+                    future.set_result(connection)
+
+            else:
+                self.size -= 1
+                resolve(future, exception=e)
+
+        try:
+            connection = psycopg2.connect(
+                dbname=config.database,
+                user=config.username,
+                password=config.password,
+                host=config.host,
+                port=config.port or 5432,
+                async_=1
+            )
+
+        except Exception as e:
+            self.size -= 1
+            resolve(future, exception=e)
+
+        else:
+            self.wait(connection).add_done_callback(connected)
+
+    def wait(self, connection):
+        """poll connection from the event loop until it is ready
+
+        return -- asyncio.Future -- resolves once the connection's current operation
+            finishes
+        """
+        loop = asyncio.get_event_loop()
+        ret = loop.create_future()
+        fd = connection.fileno()
+
+        def poll():
+            loop.remove_reader(fd)
+            loop.remove_writer(fd)
+            try:
+                state = connection.poll()
+            except Exception as e:
+                resolve(ret, exception=e)
+                return
+
+            if state == psycopg2.extensions.POLL_OK:
+                resolve(ret, connection)
+            elif state == psycopg2.extensions.POLL_READ:
+                loop.add_reader(fd, poll)
+            elif state == psycopg2.extensions.POLL_WRITE:
+                loop.add_writer(fd, poll)
+            else:
+                resolve(ret, exception=psycopg2.OperationalError("bad poll state {}".format(state)))
+
+        poll()
+        return ret
+
+    def close(self):
+        super(PostgresRunner, self).close()
+        while self.idle:
+            self.idle.pop().close()
+            self.size -= 1
+
+
+class AllIterator(object):
+    """Async iterator over every result of query.all(), the results are pulled
+    off the thread pool chunk results at a time
+
+    example --
+        async for o in AllIterator(Foo.query.is_bar(1)):
+            pass
+    """
+    def __init__(self, query, chunk=1000):
+        self.query = query
+        self.chunk = chunk
+        self.runner = get_runner(query.interface)
+        self.iterator = None
+        self.buffer = collections.deque()
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if self.buffer:
+            ret = asyncio.get_event_loop().create_future()
+            ret.set_result(self.buffer.popleft())
+            return ret
+
+        if self.done:
+            ret = asyncio.get_event_loop().create_future()
+            ret.set_exception(StopAsyncIteration())
+            return ret
+
+        return then(self.runner.submit(self.fill), self.next)
+
+    def fill(self):
+        """runs on the thread pool"""
+        if self.iterator is None:
+            self.iterator = self.query.all()
+
+        # iter() would reset the iterator so next() is called directly
+        ret = []
+        try:
+            while len(ret) < self.chunk:
+                ret.append(next(self.iterator))
+        except StopIteration:
+            pass
+        return ret
+
+    def next(self, results):
+        if not results:
+            self.done = True
+            raise StopAsyncIteration()
+
+        self.buffer.extend(results)
+        return self.buffer.popleft()
+
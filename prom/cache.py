@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends for query caching that can be shared between processes
+
+The idea is that every cached value is namespaced by a per table generation
+number, so invalidating a table is just incrementing that table's generation,
+every process that checks the cache afterwards will compute a new key and miss,
+and the stale values will fall out of the backend when their ttl expires
+
+RowCache is different, it is an in process LRU of rows keyed by primary key
+
+see -- query.SharedCacheQuery, query.RowCacheQuery
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import time
+import zlib
+import socket
+import sqlite3
+import threading
+import logging
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .compat import *
+from .utils import Pool, Rows
+
+
+logger = logging.getLogger(__name__)
+
+
+class Serializer(object):
+    """Converts query results to and from compact bytes
+
+    query results are usually a list of dict rows that all have the same keys, so
+    rather than pickle every key for every row we pull the keys out once and just
+    store the values of each row as a tuple
+    """
+    protocol = 2
+    """pickle protocol, 2 is the highest version that both python 2 and 3 can read"""
+
+    compress_size = 1024
+    """serialized values bigger than this many bytes will be zlib compressed"""
+
+    def dumps(self, result):
+        if isinstance(result, Rows):
+            val = ("tuples", result.columns, list(result))
+
+        elif isinstance(result, list) and result and all(self.is_row(r) for r in result):
+            columns = list(result[0].keys())
+            rows = [tuple(r[c] for c in columns) for r in result]
+            val = ("rows", columns, rows)
+
+        elif self.is_row(result):
+            columns = list(result.keys())
+            val = ("row", columns, tuple(result[c] for c in columns))
+
+        else:
+            val = ("val", None, result)
+
+        body = pickle.dumps(val, self.protocol)
+        if len(body) > self.compress_size:
+            ret = b"z" + zlib.compress(body)
+        else:
+            ret = b"p" + body
+        return ret
+
+    def loads(self, body):
+        body = bytes(body)
+        flag, body = body[:1], body[1:]
+        if flag == b"z":
+            body = zlib.decompress(body)
+
+        kind, columns, val = pickle.loads(body)
+        if kind == "tuples":
+            ret = Rows(columns, val)
+        elif kind == "rows":
+            ret = [dict(zip(columns, row)) for row in val]
+        elif kind == "row":
+            ret = dict(zip(columns, val))
+        else:
+            ret = val
+        return ret
+
+    def is_row(self, v):
+        # sqlite3.Row has keys() but isn't a Mapping so we duck type
+        return hasattr(v, "keys") and not isinstance(v, type)
+
+
+class Backend(object):
+    """The interface a SharedCacheQuery uses to talk to its storage
+
+    Child classes need to implement get, set, and incr, everything else is built
+    on top of those
+    """
+    serializer_class = Serializer
+
+    prefix = "prom"
+    """all keys will be prefixed with this value"""
+
+    def __init__(self, prefix=None):
+        if prefix is not None:
+            self.prefix = prefix
+        self.serializer = self.serializer_class()
+
+    def get(self, key):
+        """return the raw bytes stored at key, or None if key doesn't exist"""
+        raise NotImplementedError()
+
+    def set(self, key, val, ttl=0):
+        """store raw bytes val at key for ttl seconds, 0 means forever"""
+        raise NotImplementedError()
+
+    def incr(self, key):
+        """atomically increment the integer at key, creating it if it doesn't exist,
+        and return the new value"""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def generation_key(self, table_name):
+        return "{}:gen:{}".format(self.prefix, table_name)
+
+    def generation(self, table_name):
+        """return the current generation of table_name"""
+        v = self.get(self.generation_key(table_name))
+        return int(v) if v else 0
+
+    def invalidate(self, table_name):
+        """invalidate every cached value of table_name across all processes"""
+        return self.incr(self.generation_key(table_name))
+
+    def value_key(self, table_name, key):
+        """return the key of the value of key in the current generation of table_name
+
+        a lookup should get this once and use it for both get_value() and
+        set_value(), if a miss got the generation again when it set the value then
+        rows fetched before an invalidate() would be cached in the new generation
+        """
+        return "{}:{}:{}:{}".format(self.prefix, table_name, self.generation(table_name), key)
+
+    def get_value(self, value_key):
+        """return a tuple (result, cache_hit) for a key from value_key()"""
+        body = self.get(value_key)
+        if body is None:
+            return None, False
+        return self.serializer.loads(body), True
+
+    def set_value(self, value_key, result, ttl=0):
+        self.set(value_key, self.serializer.dumps(result), ttl)
+
+    def get_result(self, table_name, key):
+        """return a tuple (result, cache_hit)"""
+        return self.get_value(self.value_key(table_name, key))
+
+    def set_result(self, table_name, key, result, ttl=0):
+        """this gets the generation again, so use set_value() with the key the
+        result was looked up with if the result came from the db"""
+        self.set_value(self.value_key(table_name, key), result, ttl)
+
+
+class MemoryBackend(Backend):
+    """Stores everything in a dict, this can't be shared between processes but is
+    handy for testing and for single process apps that still want generations"""
+    def __init__(self, *args, **kwargs):
+        super(MemoryBackend, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get(self, key):
+        v = self.values.get(key, None)
+        if v:
+            val, expires = v
+            if not expires or expires > time.time():
+                return val
+        return None
+
+    def set(self, key, val, ttl=0):
+        expires = time.time() + ttl if ttl else 0
+        self.values[key] = (val, expires)
+
+    def incr(self, key):
+        with self.lock:
+            v = int(self.get(key) or 0) + 1
+            self.set(key, str(v).encode("ascii"))
+        return v
+
+
+class SQLiteBackend(Backend):
+    """Stores cached values in a local SQLite file so every process on the host
+    can share them
+
+    the file is opened in WAL mode so readers don't block the writer, and the OS
+    page cache (and mmap) means warm reads never really touch the disk
+    """
+    def __init__(self, path, mmap_size=64 * 1024 * 1024, timeout=5.0, **kwargs):
+        super(SQLiteBackend, self).__init__(**kwargs)
+        self.path = path
+        self.mmap_size = int(mmap_size)
+        self.timeout = float(timeout)
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # connections can't cross a fork or a thread so we key them by both
+        pid = os.getpid()
+        conn = getattr(self.local, "connection", None)
+        if conn is None or self.local.pid != pid:
+            conn = self.connect()
+            self.local.connection = conn
+            self.local.pid = pid
+        return conn
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA mmap_size = {}".format(self.mmap_size))
+        conn.execute(" ".join([
+            "CREATE TABLE IF NOT EXISTS prom_cache (",
+            "key TEXT PRIMARY KEY,",
+            "val BLOB,",
+            "expires REAL NOT NULL DEFAULT 0",
+            ")",
+        ]))
+        return conn
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT val, expires FROM prom_cache WHERE key = ?",
+            [key]
+        ).fetchone()
+        if row:
+            val, expires = row
+            if not expires or expires > time.time():
+                return bytes(val)
+        return None
+
+    def set(self, key, val, ttl=0):
+        expires = time.time() + ttl if ttl else 0
+        self.connection.execute(
+            "INSERT OR REPLACE INTO prom_cache (key, val, expires) VALUES (?, ?, ?)",
+            [key, sqlite3.Binary(val), expires]
+        )
+
+    def incr(self, key):
+        conn = self.connection
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            v = int(self.get(key) or 0) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO prom_cache (key, val, expires) VALUES (?, ?, 0)",
+                [key, sqlite3.Binary(str(v).encode("ascii"))]
+            )
+            conn.execute("COMMIT")
+
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return v
+
+    def purge(self):
+        """remove all the expired values"""
+        self.connection.execute(
+            "DELETE FROM prom_cache WHERE expires > 0 AND expires < ?",
+            [time.time()]
+        )
+
+    def close(self):
+        conn = getattr(self.local, "connection", None)
+        if conn is not None:
+            conn.close()
+            self.local.connection = None
+
+
+class MemcacheBackend(Backend):
+    """A minimal client for the memcached text protocol, this means it will work
+    with memcached itself and anything else that speaks the protocol (eg, mcrouter
+    or twemproxy)
+
+    https://github.com/memcached/memcached/blob/master/doc/protocol.txt
+    """
+    def __init__(self, host="127.0.0.1", port=11211, timeout=1.0, **kwargs):
+        super(MemcacheBackend, self).__init__(**kwargs)
+        self.host = host
+        self.port = int(port)
+        self.timeout = float(timeout)
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        pid = os.getpid()
+        conn = getattr(self.local, "connection", None)
+        if conn is None or self.local.pid != pid:
+            conn = socket.create_connection((self.host, self.port), self.timeout)
+            self.local.connection = conn
+            self.local.pid = pid
+            self.local.buf = b""
+        return conn
+
+    def readline(self):
+        buf = self.local.buf
+        while b"\r\n" not in buf:
+            data = self.connection.recv(4096)
+            if not data:
+                raise IOError("memcache connection closed")
+            buf += data
+        line, self.local.buf = buf.split(b"\r\n", 1)
+        return line
+
+    def read(self, size):
+        buf = self.local.buf
+        while len(buf) < size + 2:
+            data = self.connection.recv(max(4096, size + 2 - len(buf)))
+            if not data:
+                raise IOError("memcache connection closed")
+            buf += data
+        val, self.local.buf = buf[:size], buf[size + 2:]
+        return val
+
+    def command(self, line, body=None):
+        conn = self.connection
+        try:
+            data = line.encode("utf-8") + b"\r\n"
+            if body is not None:
+                data += body + b"\r\n"
+            conn.sendall(data)
+            return self.readline()
+
+        except (IOError, socket.error):
+            # the connection is in an unknown state, so dump it and let the
+            # next command reconnect
+            self.close()
+            raise
+
+    def get(self, key):
+        line = self.command("get {}".format(key))
+        val = None
+        if line.startswith(b"VALUE"):
+            size = int(line.split()[3])
+            val = self.read(size)
+            line = self.readline()
+
+        if line != b"END":
+            raise ValueError("unexpected memcache response: {}".format(line))
+        return val
+
+    def set(self, key, val, ttl=0):
+        line = self.command("set {} 0 {} {}".format(key, int(ttl), len(val)), val)
+        if line != b"STORED":
+            raise ValueError("unexpected memcache response: {}".format(line))
+
+    def incr(self, key):
+        line = self.command("incr {} 1".format(key))
+        if line == b"NOT_FOUND":
+            # add only succeeds for the first process, anyone who loses the race
+            # will just increment what the winner set
+            line = self.command("add {} 0 0 1".format(key), b"1")
+            if line == b"STORED":
+                return 1
+            line = self.command("incr {} 1".format(key))
+
+        return int(line)
+
+    def close(self):
+        conn = getattr(self.local, "connection", None)
+        if conn is not None:
+            try:
+                conn.close()
+            except (IOError, socket.error):
+                pass
+            self.local.connection = None
+
+
+class RowCache(Pool):
+    """An in process LRU of rows keyed by primary key, a row of None means we know
+    there isn't a row with that primary key (negative caching)
+
+    every write bumps the version, so a reader that fetched rows from the db can
+    pass in the version it saw before the fetch and its rows will be ignored if
+    anything was written while it was waiting on the db, this keeps a slow reader
+    from putting stale rows back into the cache
+
+    see -- query.RowCacheQuery
+    """
+    def __init__(self, size=0, ttl=0, missing_ttl=60):
+        """
+        size -- int -- how many rows to keep, 0 for unbounded
+        ttl -- int -- how many seconds a row is good for, 0 for forever
+        missing_ttl -- int -- how many seconds a missing pk is remembered, 0 for forever
+        """
+        super(RowCache, self).__init__(size=size)
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.lock = threading.RLock()
+        self.version = 0
+
+    def create_value(self, pk):
+        raise KeyError(pk)
+
+    def get_row(self, pk):
+        """return a tuple (row, cache_hit), (None, True) means pk is known missing"""
+        with self.lock:
+            if pk in self:
+                row, expires = self[pk]
+                if not expires or expires > time.time():
+                    return (dict(row) if row is not None else None), True
+                self.remove(pk)
+        return None, False
+
+    def set_row(self, pk, row, version=None):
+        """cache row at pk, if version is passed in and a write has happened since
+        then the row is ignored"""
+        with self.lock:
+            if version is None or version == self.version:
+                ttl = self.ttl if row is not None else self.missing_ttl
+                expires = time.time() + ttl if ttl else 0
+                self[pk] = (dict(row) if row is not None else None, expires)
+
+    def set_missing(self, pk, version=None):
+        self.set_row(pk, None, version)
+
+    def update_row(self, pk, fields):
+        """write fields through to the cached row at pk, if it's cached"""
+        with self.lock:
+            self.version += 1
+            if pk in self:
+                row, expires = self[pk]
+                if row is not None:
+                    row = dict(row)
+                    row.update(fields)
+                    self[pk] = (row, expires)
+
+                else:
+                    self.remove(pk)
+
+    def delete_row(self, pk):
+        """the row at pk was deleted, so remember it as missing"""
+        with self.lock:
+            self.version += 1
+            self.set_missing(pk)
+
+    def remove(self, pk):
+        with self.lock:
+            self.version += 1
+            if pk in self.pq:
+                self.pq.remove(pk)
+            self.pop(pk, None)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            super(RowCache, self).clear()
+            self.pq = type(self.pq)(self.pq.size)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+import re
+
+from captain import exit as console, echo
+from captain.decorators import arg
+
+from ..compat import *
+from ..interface import get_interface
+from .dump import get_orm_classes
+
+
+comment_regex = re.compile(r"/\*.*?\*/", re.S)
+"""sql comments, like the ones tags.py adds"""
+
+value_regex = re.compile(r"'(?:[^']|'')*'|\$\d+|%s|\?|\b\d+(?:\.\d+)?\b")
+"""string and number literals and the placeholders of every db"""
+
+list_regex = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+"""IN lists, so the same query with a different number of values is one query"""
+
+table_regex = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+((?:"[^"]+"|[\w$]+)(?:\.(?:"[^"]+"|[\w$]+))?)', re.I)
+
+
+def normalize_sql(sql):
+    """return sql without comments and with every value replaced by ?, so every run
+    of the same query has the same text"""
+    sql = comment_regex.sub("", sql)
+    sql = value_regex.sub("?", sql)
+    sql = list_regex.sub("(...)", sql)
+    return " ".join(sql.split())
+
+
+def get_table_names(sql):
+    """return the names of the tables sql reads from or writes to"""
+    ret = []
+    for name in table_regex.findall(sql):
+        name = name.split(".")[-1].strip('"')
+        if name not in ret:
+            ret.append(name)
+    return ret
+
+
+def get_orm_map(paths):
+    """return a dict of table names mapped to the names of the Orm classes of the
+    table found in paths"""
+    ret = {}
+    for path in paths:
+        for orm_class in get_orm_classes(path):
+            ret.setdefault(orm_class.table_name, set()).add(
+                "{}.{}".format(orm_class.__module__, orm_class.__name__)
+            )
+    return ret
+
+
+def get_pg_statements(inter):
+    """return the statements pg_stat_statements has recorded for the db of inter
+
+    return -- list -- dicts with sql, orm, calls, total (seconds), and rows keys
+    """
+    conn = inter.connection_config
+    if not "postgres" in conn.interface_name.lower():
+        raise RuntimeError("pg_stat_statements only works with Postgres databases, use --stats")
+
+    version = int(inter.query("SHOW server_version_num")[0]["server_version_num"])
+    # postgres 13 renamed total_time to total_exec_time when it added planning time
+    time_field = "total_exec_time" if version >= 130000 else "total_time"
+    query_str = " ".join([
+        "SELECT query, calls, {} AS total_time, rows FROM pg_stat_statements".format(time_field),
+        "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())",
+    ])
+    try:
+        rows = inter.query(query_str)
+
+    except Exception as e:
+        raise RuntimeError(" ".join([
+            "Could not read pg_stat_statements, the extension needs to be in",
+            "shared_preload_libraries and installed with CREATE EXTENSION pg_stat_statements:",
+            str(e)
+        ]))
+
+    return [{
+        "sql": r["query"],
+        "orm": "",
+        "calls": int(r["calls"]),
+        "total": float(r["total_time"]) / 1000.0,
+        "rows": int(r["rows"]),
+    } for r in rows]
+
+
+def get_dump_statements(path):
+    """return the statements of a metrics.Registry.dump() file, see get_pg_statements()"""
+    with open(path) as fp:
+        snapshot = json.load(fp)
+
+    return [{
+        "sql": q["sql"],
+        "orm": q["orm"],
+        "calls": int(q["count"]),
+        "total": float(q.get("duration", 0.0)),
+        "rows": int(q.get("rows", 0)),
+    } for q in snapshot["queries"]]
+
+
+def get_report(statements, orm_map=None):
+    """group statements by their normalized sql and find the Orm classes of each
+
+    statements -- list -- see get_pg_statements()
+    orm_map -- dict -- see get_orm_map(), used when a statement doesn't know its Orm
+    return -- list -- dicts with sql, orms, tables, calls, total, mean, and rows keys
+    """
+    groups = {}
+    for s in statements:
+        sql = normalize_sql(s["sql"])
+        group = groups.get(sql)
+        if group is None:
+            group = {"sql": sql, "orms": set(), "calls": 0, "total": 0.0, "rows": 0}
+            groups[sql] = group
+
+        if s["orm"]:
+            group["orms"].add(s["orm"])
+        group["calls"] += s["calls"]
+        group["total"] += s["total"]
+        group["rows"] += s["rows"]
+
+    ret = []
+    for group in groups.values():
+        group["tables"] = get_table_names(group["sql"])
+        if not group["orms"] and orm_map:
+            for table_name in group["tables"]:
+                group["orms"].update(orm_map.get(table_name, []))
+
+        group["orms"] = sorted(group["orms"])
+        group["mean"] = group["total"] / group["calls"] if group["calls"] else 0.0
+        ret.append(group)
+
+    return ret
+
+
+def format_report(report, sort="total", limit=20, width=100):
+    """return the lines of the limit heaviest queries of report by sort"""
+    report = sorted(report, key=lambda r: r[sort], reverse=True)
+    if limit:
+        report = report[:limit]
+
+    lines = ["{:>10} {:>8} {:>10} {:>10}  {}".format("total(s)", "calls", "mean(ms)", "rows", "orm")]
+    for r in report:
+        lines.append("{:>10.3f} {:>8} {:>10.3f} {:>10}  {}".format(
+            r["total"],
+            r["calls"],
+            r["mean"] * 1000.0,
+            r["rows"],
+            ", ".join(r["orms"] or r["tables"]) or "-"
+        ))
+        sql = r["sql"]
+        if width and len(sql) > width:
+            sql = "{}...".format(sql[:width - 3])
+        lines.append("    {}".format(sql))
+
+    return lines
+
+
+@arg("paths",
+    nargs="*",
+    help="module or class paths (eg, foo.bar or foo.bar.Che) where prom Orm classes are defined, tables are mapped to them")
+@arg("--stats",
+    dest="stats_path",
+    default="",
+    help="a metrics.registry.dump() file to report on instead of the db's pg_stat_statements")
+@arg("--connection-name", "-c",
+    dest="conn_name",
+    default="",
+    help="the connection name (from prom dsn) whose pg_stat_statements you want")
+@arg("--sort", "-s",
+    dest="sort",
+    default="total",
+    choices=["total", "calls", "mean", "rows"],
+    help="what makes a query heavy, total time, calls, mean time, or rows")
+@arg("--limit", "-n", dest="limit", type=int, default=20, help="how many queries to print, 0 for all")
+@arg("--width", "-w", dest="width", type=int, default=100, help="longer queries are cut to this many characters, 0 to print all of it")
+def main_top(paths, stats_path, conn_name, sort, limit, width):
+    """print the heaviest queries of the db and the Orm classes that ran them
+
+    The queries come from Postgres's pg_stat_statements, or, for any db, from a
+    file prom.metrics.registry.dump() wrote
+    """
+    if stats_path:
+        statements = get_dump_statements(stats_path)
+    else:
+        statements = get_pg_statements(get_interface(conn_name))
+
+    report = get_report(statements, get_orm_map(paths))
+    for line in format_report(report, sort, limit, width):
+        echo.out(line)
@@ -3,6 +3,8 @@ from __future__ import unicode_literals, division, print_function, absolute_impo
 
 import sys
 import hashlib
+import threading
+import weakref
 
 # shamelessly ripped from https://github.com/kennethreitz/requests/blob/master/requests/compat.py
 # Syntax sugar.
@@ -71,3 +73,43 @@ elif is_py3:
             tb = None
 
 
+try:
+    from contextvars import ContextVar, copy_context
+
+except ImportError:
+    # python 2 and 3.6 don't have contextvars, so the value is per thread instead
+    _context_vars = weakref.WeakSet()
+
+    class ContextVar(threading.local):
+        def __init__(self, name, default=None):
+            # threading.local calls this again the first time each thread uses it
+            self.name = name
+            self.value = default
+            _context_vars.add(self)
+
+        def get(self):
+            return self.value
+
+        def set(self, value):
+            self.value = value
+
+    class _Context(object):
+        """the values every ContextVar has in the thread that made this, run()
+        sets them in the thread it's called from for the length of the call"""
+        def __init__(self):
+            self.values = [(var, var.get()) for var in list(_context_vars)]
+
+        def run(self, callback, *args, **kwargs):
+            previous = [(var, var.get()) for var, _ in self.values]
+            for var, value in self.values:
+                var.set(value)
+
+            try:
+                return callback(*args, **kwargs)
+
+            finally:
+                for var, value in previous:
+                    var.set(value)
+
+    def copy_context():
+        return _Context()
@@ -66,12 +66,14 @@ def reconnecting(count=None, backoff=None):
                     if "closed" in e_msg.lower():
                         if attempt == count:
                             logger.debug("all {} attempts failed".format(count))
+                            self.reconnect_failures.incr()
                             raise
                         else:
                             logger.debug("attempt {}/{} failed, retrying".format(
                                 attempt,
                                 count
                             ))
+                            self.reconnect_attempts.incr()
 
                     else:
                         raise
@@ -16,3 +16,8 @@ class InterfaceError(Error):
 
 class UniqueError(InterfaceError):
     pass
+
+
+class NPlusOneError(Error):
+    """raised at the end of a hooks.NPlusOne scope that ran N+1 queries"""
+    pass
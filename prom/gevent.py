@@ -1,17 +1,38 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, division, print_function, absolute_import
+import time
+from collections import deque
 
+import gevent
 import psycogreen.gevent
-from gevent.queue import Queue
-import psycopg2
-from psycopg2 import extensions, OperationalError, connect
-from psycopg2.pool import AbstractConnectionPool, PoolError
+from gevent.event import Event
+from gevent.local import local
+from gevent.lock import Semaphore
 
-from .interface import get_interfaces
+from .interface import get_interfaces, postgres
+from .interface.base import Interface
 from .interface.postgres import PostgreSQL
-
-def patch_all(maxconn=10, **kwargs):
+from .query import ResultsIterator
+from .utils import SingleFlight
+from .metrics import Histogram
+
+def patch_all(maxconn=10, yield_rows=100, yield_interval=0.005, **kwargs):
+    """make prom play nice with gevent
+
+    maxconn -- int -- the most connections each Postgres pool can open
+    yield_rows -- int -- iterators yield to the hub after hydrating this many rows
+    yield_interval -- float -- iterators yield to the hub after this many seconds
+        without yielding, set both yield_* to 0 to never yield
+    **kwargs -- the other pool options (pool_timeout, etc) that are set on every
+        Postgres interface
+    """
     psycogreen.gevent.patch_psycopg()
+    SingleFlight.event_class = Event
+    Interface.local_class = local
+    if yield_rows or yield_interval:
+        ResultsIterator.yielder = Yielder(yield_rows, yield_interval)
+    else:
+        ResultsIterator.yielder = None
 
     kwargs.setdefault('pool_maxconn', maxconn)
     kwargs.setdefault('pool_class', 'prom.gevent.ConnectionPool')
@@ -22,68 +43,98 @@ def patch_all(maxconn=10, **kwargs):
             interface.connection_config.options.update(kwargs)
 
 
-class ConnectionPool(AbstractConnectionPool):
-    """a gevent green thread safe connection pool
-    this is based off an example found here
-    https://github.com/surfly/gevent/blob/master/examples/psycopg2_pool.py
-    """
-    def __init__(self, minconn, maxconn, *args, **kwargs):
-        self.size = 0
-        self.minconn = minconn
-        self.maxconn = maxconn
-        self.closed = False
-
-        self._args = args
-        self._kwargs = kwargs
-        self._pool = Queue()
-
-        for i in range(self.minconn):
-            connection = self._connect()
-            self.putconn(connection)
-
-    def _connect(self, key=None):
-        self.size += 1
-        try:
-            # I think connect() causes a WAIT, so we need to increment size before
-            # we call connect() in order to actually make it increment
-            conn = psycopg2.connect(*self._args, **self._kwargs)
-
-        except:
-            self.size -= 1
-            raise
+class Yielder(object):
+    """Wraps the iterators' row generators so a greenlet that iterates through a
+    lot of rows gives the other greenlets a chance to run, hydrating thousands of
+    Orm instances never touches the network so nothing else would yield
 
-        return conn
+    see -- patch_all(), query.ResultsIterator.yielder
 
-    def getconn(self, key=None):
-        if self.closed: raise PoolError("connection pool is closed")
-        pool = self._pool
-        if self.size >= self.maxconn or pool.qsize():
-            conn = pool.get()
+    rows -- int -- yield after this many rows, 0 to not count rows
+    interval -- float -- yield once this many seconds have passed since the last
+        yield, 0 to not check the time
+    """
+    def __init__(self, rows=100, interval=0.005):
+        self.rows = rows
+        self.interval = interval
+        self.blocked = Histogram()
+        """how long iterating went between yields, blocked.max is the longest
+        the other greenlets were kept waiting"""
+
+    def __call__(self, iterable):
+        rows = self.rows
+        interval = self.interval
+        count = 0
+        last = time.time()
+        for r in iterable:
+            yield r
+            count += 1
+            if rows and count >= rows:
+                last = self.sleep(last)
+                count = 0
+
+            elif interval and time.time() - last >= interval:
+                last = self.sleep(last)
+                count = 0
+
+    def sleep(self, last):
+        """yield to the hub and return when it came back"""
+        self.blocked.observe(time.time() - last)
+        gevent.sleep(0)
+        return time.time()
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "interval": self.interval,
+            "blocked": self.blocked.stats(),
+        }
+
+
+class Condition(object):
+    """A green version of threading.Condition, so a greenlet waiting on the pool
+    yields to the hub even if threading wasn't monkey patched"""
+    def __init__(self):
+        self.lock = Semaphore(1)
+        self.waiters = deque()
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+    def wait(self, timeout=None):
+        waiter = Event()
+        self.waiters.append(waiter)
+        self.lock.release()
+        try:
+            return waiter.wait(timeout)
 
-        else:
+        finally:
+            self.lock.acquire()
             try:
-                conn = self._connect()
+                self.waiters.remove(waiter)
+            except ValueError:
+                pass
 
-            except:
-                raise
+    def notify(self, n=1):
+        for _ in range(min(n, len(self.waiters))):
+            self.waiters.popleft().set()
 
-        return conn
+    def notify_all(self):
+        self.notify(len(self.waiters))
 
-    def putconn(self, conn=None, key=None, close=False):
-        if self.closed: raise PoolError("connection pool is closed")
-        if close:
-            conn.close()
-        else:
-            self._pool.put(conn)
 
-    def closeall(self):
-        if self.closed: raise PoolError("connection pool is closed")
-        # TODO -- might be better to do this decrementing self.size?
-        while not self._pool.empty():
-            conn = self._pool.get_nowait()
-            try:
-                conn.close()
-            except Exception:
-                pass
+class ConnectionPool(postgres.ConnectionPool):
+    """a gevent green thread safe connection pool
+
+    this has all the features of the threaded pool (checkout timeouts, pre-ping,
+    discarding broken connections, max lifetime and idle, stats), waiting for a
+    connection just blocks the greenlet instead of the thread
 
-        self.closed = True
+    see -- interface.postgres.ConnectionPool
+    """
+    def create_condition(self):
+        return Condition()
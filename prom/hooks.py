@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Watch what an interface does by adding callbacks to its events
+
+    def after(event):
+        print(event.sql, event.row_count, event.timings)
+
+    prom.get_interface().add_hook("after", after)
+
+events --
+    connect -- the interface connected to the db, event.timings has connect
+    before -- a query is about to be executed, event.timings has compile
+    after -- a query was executed, event.timings has compile, execute, and fetch
+    error -- a query or connecting failed, event.error is the exception
+    hydrate -- all the rows of a Query.get() were iterated, event.timings has
+        hydrate (how long it took to turn the rows into Orm instances)
+    cache -- a query.BaseCacheQuery looked in its cache, event.cache_hit is True
+        if the result was there
+
+Every callback gets a QueryEvent, an exception raised by a callback is logged
+and doesn't affect the query. When an interface doesn't have any hooks the only
+cost is checking that it doesn't.
+
+SlowQueryLog is a hook that logs the queries that took too long, it can be set up
+with dsn options:
+
+    export PROM_DSN=prom.interface.postgres.PostgreSQL://host/db?slow_query_threshold=0.5&slow_query_explain=1
+
+dsn options --
+    slow_query_threshold -- seconds a query has to take to be logged
+    slow_query_explain -- 1 to log the plan of slow SELECT queries
+    slow_query_explain_interval -- seconds between plans of the same query,
+        defaults to 60
+    slow_query_analyze -- 1 to use EXPLAIN ANALYZE (this runs the query again)
+
+NPlusOne is a hook that finds the same read being run over and over with
+different args from one line of code (eg, Query.ref() or get_pk() in a loop),
+it only counts the queries run inside its scope():
+
+    export PROM_DSN=prom.interface.sqlite.SQLite://:memory:?n_plus_one_threshold=5&n_plus_one_raise=1
+
+    with prom.get_interface().n_plus_one.scope():
+        handle_request()
+
+dsn options --
+    n_plus_one_threshold -- how many times a read can run with different args
+        from the same call site in a scope
+    n_plus_one_raise -- 1 to raise NPlusOneError at the end of a scope that had
+        N+1 queries, otherwise they are only logged
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import collections
+import hashlib
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from .exception import NPlusOneError
+from .metrics import Counter
+from .tags import QueryTags, get_caller_frame
+from .compat import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEvent(object):
+    """What the hooks of an event are told about the query
+
+    interface -- Interface -- the interface that ran the query
+    name -- string -- the event, eg, after
+    orm_class -- Orm -- the Orm class the query was for, None for raw queries
+    method_name -- string -- the interface method that ran the query (eg, get,
+        insert), empty for raw queries
+    query -- Query -- the query the interface method was passed, None for
+        inserts and raw queries
+    sql -- string -- the query that was executed
+    args -- list -- the query args that were passed in with sql
+    args_count -- int -- how many query args were passed in with sql
+    row_count -- int -- how many rows were returned or changed, None if unknown
+    error -- Exception -- set for the error event
+    cache_hit -- boolean -- set for the cache event
+    timings -- dict -- seconds each stage took, the stages are connect, compile,
+        execute, fetch, and hydrate
+    """
+    def __init__(self, interface, orm_class=None, method_name="", query=None):
+        self.interface = interface
+        self.name = ""
+        self.orm_class = orm_class
+        self.method_name = method_name
+        self.query = query
+        self.sql = ""
+        self.args = []
+        self.args_count = 0
+        self.row_count = None
+        self.error = None
+        self.cache_hit = None
+        self.timings = {}
+        self.start = time.time()
+
+    @property
+    def fingerprint(self):
+        """the shape hash of the query, every run of a query that only differs by
+        its values has the same fingerprint, see query.Fingerprint"""
+        query = self.query
+        if query is not None and query.orm_class:
+            return query.fingerprint(self.method_name).shape
+
+        # the args of a raw query are placeholders, so its sql is its shape
+        sql = " ".join(self.sql.split())
+        return hashlib.md5(sql.encode("utf-8")).hexdigest()
+
+    @property
+    def duration(self):
+        """how many seconds all the stages took"""
+        return sum(self.timings.values())
+
+    def __str__(self):
+        return "{} {} {} rows in {:.6f}s".format(
+            self.name,
+            self.orm_class.__name__ if self.orm_class else "",
+            self.row_count,
+            self.duration
+        )
+
+
+class Hooks(object):
+    """The callbacks of an interface's events, see Interface.add_hook()"""
+    names = set(["connect", "before", "after", "error", "hydrate", "cache"])
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def add(self, name, callback):
+        if name not in self.names:
+            raise ValueError("hook event {} is not one of {}".format(
+                name,
+                ", ".join(sorted(self.names))
+            ))
+        self.callbacks.setdefault(name, []).append(callback)
+
+    def remove(self, name, callback):
+        callbacks = self.callbacks.get(name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self.callbacks.pop(name, None)
+
+    def has(self, name):
+        return name in self.callbacks
+
+    def fire(self, name, event):
+        """call every callback of name with event"""
+        event.name = name
+        for callback in list(self.callbacks.get(name, [])):
+            try:
+                callback(event)
+
+            except Exception as e:
+                # only the text of the traceback is logged, a log record holding
+                # the traceback would keep the query's cursor alive
+                logger.error("{} hook {} failed: {}".format(
+                    name,
+                    callback,
+                    traceback.format_exc()
+                ))
+
+    def __bool__(self):
+        return bool(self.callbacks)
+    __nonzero__ = __bool__ # py2
+
+
+class SlowQueryLog(object):
+    """Logs (and keeps the most recent of) the queries that took longer than
+    threshold seconds
+
+    threshold -- float -- how many seconds a query has to take to be slow
+    explain -- boolean -- True to also get the plan of slow SELECT queries, the
+        queries of a transaction aren't explained since a failed plan query would
+        abort the transaction
+    explain_interval -- float -- the same query is explained at most once every
+        explain_interval seconds, getting a plan is another query
+    analyze -- boolean -- True to get the plan with EXPLAIN ANALYZE, this runs
+        the slow query again
+    size -- int -- how many of the most recent slow queries .records keeps
+    args_sample -- int -- how many of the query args are recorded
+    """
+    @classmethod
+    def configure(cls, interface):
+        """add a SlowQueryLog to interface if its dsn options ask for one
+
+        return -- SlowQueryLog -- None if the options don't have a threshold
+        """
+        options = interface.connection_config.options if interface.connection_config else {}
+        threshold = options.get("slow_query_threshold", None)
+        if threshold is None: return None
+
+        instance = cls(
+            threshold=float(threshold),
+            explain=bool(int(options.get("slow_query_explain", 0))),
+            explain_interval=float(options.get("slow_query_explain_interval", 60.0)),
+            analyze=bool(int(options.get("slow_query_analyze", 0))),
+        )
+        return instance.add(interface)
+
+    def __init__(self, threshold=1.0, explain=False, explain_interval=60.0, analyze=False, size=100, args_sample=10):
+        self.threshold = threshold
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.analyze = analyze
+        self.args_sample = args_sample
+
+        self.records = collections.deque(maxlen=size)
+        self.slow_queries = Counter()
+        self.explains = Counter()
+        self.explained = {}
+        """when each query shape was last explained, at most explained_size shapes
+        are remembered"""
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    explained_size = 1000
+    """how many query shapes .explained remembers"""
+
+    def add(self, interface):
+        interface.add_hook("after", self.after)
+        return self
+
+    def remove(self, interface):
+        interface.remove_hook("after", self.after)
+
+    def shape(self, sql):
+        """the args are placeholders in sql, so every run of the same query has the
+        same shape once the whitespace is normalized"""
+        return " ".join(sql.split())
+
+    def sample(self, args):
+        ret = []
+        for arg in args[:self.args_sample]:
+            arg = repr(arg)
+            ret.append(arg if len(arg) <= 100 else "{}...".format(arg[:100]))
+        return ret
+
+    def after(self, event):
+        duration = event.duration
+        if duration < self.threshold: return
+        # the plan query is another query, it shouldn't be logged or explained
+        if getattr(self.local, "explaining", False): return
+
+        shape = self.shape(event.sql)
+        record = {
+            "sql": shape,
+            "args": self.sample(event.args),
+            "args_count": event.args_count,
+            "duration": duration,
+            "timings": dict(event.timings),
+            "orm_class": event.orm_class.__name__ if event.orm_class else "",
+            "method_name": event.method_name,
+            "row_count": event.row_count,
+            "explain": self.get_explain(event, shape) if self.explain else None,
+        }
+        self.slow_queries.incr()
+        self.records.append(record)
+
+        lines = ["Slow query {:.6f}s ({} rows): {}".format(duration, event.row_count, shape)]
+        if record["args"]:
+            lines.append("args: {}".format(", ".join(record["args"])))
+        if record["explain"]:
+            lines.extend(record["explain"])
+        logger.warning("\n".join(lines))
+
+    def get_explain(self, event, shape):
+        """return the plan of the query of event, None if it isn't a SELECT or its
+        shape was explained less than explain_interval seconds ago"""
+        if not shape.upper().startswith("SELECT"): return None
+        # the plan would run on the transaction's connection
+        if event.interface.get_pinned_connection(): return None
+
+        now = time.time()
+        with self.lock:
+            if now - self.explained.get(shape, 0.0) < self.explain_interval:
+                return None
+            self.explained[shape] = now
+            if len(self.explained) > self.explained_size:
+                self.prune_explained(now)
+
+        self.local.explaining = True
+        try:
+            self.explains.incr()
+            return event.interface.explain_SQL(event.sql, event.args, analyze=self.analyze)
+
+        except Exception as e:
+            return ["EXPLAIN failed: {}".format(e)]
+
+        finally:
+            self.local.explaining = False
+
+    def prune_explained(self, now):
+        """forget the shapes that can be explained again, and if that isn't enough
+        the ones that were explained longest ago"""
+        explained = self.explained
+        for shape, when in list(explained.items()):
+            if now - when >= self.explain_interval:
+                del explained[shape]
+
+        if len(explained) > self.explained_size:
+            shapes = sorted(explained, key=explained.get)
+            for shape in shapes[:len(explained) - self.explained_size]:
+                del explained[shape]
+
+    def stats(self):
+        return {
+            "threshold": self.threshold,
+            "slow_queries": self.slow_queries.stats(),
+            "explains": self.explains.stats(),
+        }
+
+
+class NPlusOne(object):
+    """Finds N+1 queries, the same read run more than threshold times with
+    different args from one call site, in the with block of scope()
+
+        n_plus_one = NPlusOne(threshold=5, raise_error=True).add(interface)
+        with n_plus_one.scope():
+            for o in Foo.query.get():
+                o.bar_id.che # a query for every Foo
+
+    An N+1 query is logged as a warning with its call site when it passes the
+    threshold. Hooks can't raise (see Hooks.fire()), so with raise_error the
+    scope raises NPlusOneError when the with block ends
+
+    threshold -- int -- how many times a read can run with different args from
+        the same call site in a scope before it is an N+1 query
+    raise_error -- boolean -- True to raise NPlusOneError at the end of a scope
+        that had N+1 queries
+    """
+    methods = set(["get", "get_one", "count"])
+    """the interface methods that are counted, N+1 queries are reads"""
+
+    skip_modules = QueryTags.skip_modules
+    """the modules that aren't the call site of a query"""
+
+    @classmethod
+    def configure(cls, interface):
+        """add a NPlusOne to interface if its dsn options ask for one
+
+        return -- NPlusOne -- None if the options don't have a threshold
+        """
+        options = interface.connection_config.options if interface.connection_config else {}
+        threshold = options.get("n_plus_one_threshold", None)
+        if threshold is None: return None
+
+        instance = cls(
+            threshold=int(threshold),
+            raise_error=bool(int(options.get("n_plus_one_raise", 0))),
+        )
+        return instance.add(interface)
+
+    def __init__(self, threshold=5, raise_error=False):
+        self.threshold = threshold
+        self.raise_error = raise_error
+        self.n_plus_ones = Counter()
+        self.lock = threading.Lock()
+        self.current = ContextVar("prom_n_plus_one", default=None)
+        """the (records, found) of the scope of the running context"""
+
+    def add(self, interface):
+        interface.add_hook("after", self.after)
+        return self
+
+    def remove(self, interface):
+        interface.remove_hook("after", self.after)
+
+    @contextmanager
+    def scope(self):
+        """count the reads of the with block
+
+        yield -- list -- the N+1 queries found so far, each is a dict with sql,
+            caller, orm_class, method_name, and count keys
+        """
+        records = {}
+        found = []
+        previous = self.current.get()
+        self.current.set((records, found))
+        try:
+            yield found
+
+        finally:
+            self.current.set(previous)
+
+        if found and self.raise_error:
+            raise NPlusOneError("\n".join(self.format(record) for record in found))
+
+    def get_caller(self):
+        """return "path:line in function" of the code that ran the query"""
+        frame = get_caller_frame(self.skip_modules)
+        if not frame: return ""
+        return "{}:{} in {}".format(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+    def after(self, event):
+        current = self.current.get()
+        if current is None or event.method_name not in self.methods: return
+
+        records, found = current
+        key = (event.fingerprint, self.get_caller())
+        args = repr(event.args)
+        with self.lock:
+            record = records.get(key)
+            if record is None:
+                record = {
+                    "sql": " ".join(event.sql.split()),
+                    "caller": key[1],
+                    "orm_class": event.orm_class.__name__ if event.orm_class else "",
+                    "method_name": event.method_name,
+                    "count": 0,
+                    "args": set(),
+                }
+                records[key] = record
+
+            record["count"] += 1
+            # once a query is found its args don't need to be kept anymore
+            if len(record["args"]) > self.threshold: return
+            record["args"].add(args)
+            if len(record["args"]) <= self.threshold: return
+            found.append(record)
+
+        self.n_plus_ones.incr()
+        logger.warning(self.format(record))
+
+    def format(self, record):
+        return "N+1 query, {} {} queries of {} with different args from {}: {}".format(
+            record["count"],
+            record["method_name"],
+            record["orm_class"] or "raw sql",
+            record["caller"] or "an unknown caller",
+            record["sql"]
+        )
+
+    def stats(self):
+        return {
+            "threshold": self.threshold,
+            "n_plus_ones": self.n_plus_ones.stats(),
+        }
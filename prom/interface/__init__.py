@@ -4,6 +4,7 @@ from __future__ import unicode_literals, division, print_function, absolute_impo
 import dsnparse
 
 from ..config import DsnConnection
+from ..metrics import Registry, registry
 
 
 interfaces = {}
@@ -77,8 +78,10 @@ def set_interface(interface, name=''):
     # close down the interface before we discard it
     if name in interfaces:
         interfaces[name].close()
+        registry.remove(interfaces[name])
 
     interfaces[name] = interface
+    Registry.configure(interface)
 
 
 def get_interface(name=''):
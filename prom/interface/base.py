@@ -4,6 +4,8 @@ import sys
 import os
 import datetime
 import logging
+import threading
+import time
 from contextlib import contextmanager
 import uuid as uuidgen
 
@@ -11,6 +13,10 @@ import uuid as uuidgen
 from ..query import Query
 from ..exception import InterfaceError
 from ..decorators import reconnecting
+from ..metrics import Counter
+from ..hooks import Hooks, QueryEvent, SlowQueryLog, NPlusOne
+from ..tags import QueryTags
+from ..utils import Rows
 from ..compat import *
 
 
@@ -30,6 +36,10 @@ class Connection(object):
     transaction_fail will set this back to 0 and rollback the transaction
     """
 
+    commit_callbacks = None
+    """the callbacks to call once the current transaction commits, see
+    add_commit_callback()"""
+
     def transaction_name(self):
         """generate a random transaction name for use in start_transaction() and
         fail_transaction()"""
@@ -52,10 +62,16 @@ class Connection(object):
 
         self.transaction_count += 1
         logger.debug("{}. Start transaction {}".format(self.transaction_count, name))
-        if self.transaction_count == 1:
-            self._transaction_start()
-        else:
-            self._transaction_started(name)
+        try:
+            if self.transaction_count == 1:
+                self._transaction_start()
+            else:
+                self._transaction_started(name)
+
+        except Exception:
+            # the transaction never started so there is nothing to stop or fail
+            self.transaction_count -= 1
+            raise
 
         return self.transaction_count
 
@@ -71,9 +87,36 @@ class Connection(object):
                 self._transaction_stop()
 
             self.transaction_count -= 1
+            if self.transaction_count == 0:
+                self.transaction_committed()
 
         return self.transaction_count
 
+    def add_commit_callback(self, callback):
+        """call callback() once the current transaction commits, it is never called
+        if the transaction is rolled back"""
+        if self.commit_callbacks is None:
+            self.commit_callbacks = []
+        self.commit_callbacks.append(callback)
+
+    def transaction_committed(self):
+        """call the commit callbacks, every callback is called even if one fails,
+        and then the first error is raised"""
+        callbacks = self.commit_callbacks
+        self.commit_callbacks = None
+        exc_info = None
+        for callback in callbacks or []:
+            try:
+                callback()
+
+            except Exception:
+                logger.exception("commit callback {} failed".format(callback))
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+
+        if exc_info:
+            reraise(*exc_info)
+
     def _transaction_stop(self): pass
 
     def transaction_fail(self, name):
@@ -89,6 +132,7 @@ class Connection(object):
             logger.debug("{}. Failing transaction {}".format(self.transaction_count, name))
             if self.transaction_count == 1:
                 self._transaction_fail()
+                self.commit_callbacks = None
             else:
                 self._transaction_failing(name)
 
@@ -139,6 +183,17 @@ class Interface(object):
     connection_config = None
     """a config.Connection() instance"""
 
+    local_class = None
+    """the class used for thread local storage, None means threading.local, this
+    is set to the gevent version by prom.gevent.patch_all()"""
+
+    can_notify = False
+    """true if the db can push row changes to listeners, see set_notify()"""
+
+    _local = None
+
+    _replicas = None
+
     @classmethod
     def configure(cls, connection_config):
         host = connection_config.host
@@ -149,6 +204,12 @@ class Interface(object):
 
     def __init__(self, connection_config=None):
         self.connection_config = connection_config
+        self.reconnect_attempts = Counter()
+        self.reconnect_failures = Counter()
+        self.hooks = Hooks()
+        self.slow_query_log = SlowQueryLog.configure(self)
+        self.n_plus_one = NPlusOne.configure(self)
+        self.query_tags = QueryTags.configure(self)
 
     def connect(self, connection_config=None, *args, **kwargs):
         """
@@ -164,13 +225,23 @@ class Interface(object):
         if connection_config: self.connection_config = connection_config
 
         self.connected = True
+        local_class = self.local_class or threading.local
+        self._local = local_class()
+        event = QueryEvent(self) if self.hooks else None
         try:
             self._connect(self.connection_config)
 
         except Exception as e:
             self.connected = False
+            if event:
+                event.error = e
+                self.hooks.fire("error", event)
             self.raise_error(e)
 
+        if event:
+            event.timings["connect"] = time.time() - event.start
+            self.hooks.fire("connect", event)
+
         self.log("Connected {}", self.connection_config.interface_name)
         return self.connected
 
@@ -182,9 +253,122 @@ class Interface(object):
 
     def is_connected(self): return self.connected
 
+    def concurrency(self):
+        """return how many threads can use this interface at the same time without
+        waiting on each other for a connection
+
+        see -- aio.py
+        """
+        return 1
+
+    def stats(self):
+        """return a dict of how this interface is doing, child classes add what
+        they know about (eg, the connection pool)
+
+        see -- metrics.py
+        """
+        ret = {
+            "interface": self.connection_config.interface_name if self.connection_config else "",
+            "connected": self.connected,
+            "reconnect_attempts": self.reconnect_attempts.stats(),
+            "reconnect_failures": self.reconnect_failures.stats(),
+        }
+        if self._replicas:
+            ret["replicas"] = self._replicas.stats()
+        if self.slow_query_log:
+            ret["slow_query_log"] = self.slow_query_log.stats()
+        if self.n_plus_one:
+            ret["n_plus_one"] = self.n_plus_one.stats()
+        return ret
+
+    def add_hook(self, name, callback):
+        """call callback(event) every time event name happens on this interface
+
+        name -- string -- one of connect, before, after, error, or hydrate
+        callback -- callable -- gets a hooks.QueryEvent instance
+        """
+        self.hooks.add(name, callback)
+
+    def remove_hook(self, name, callback):
+        self.hooks.remove(name, callback)
+
+    def _hook_event(self, method_name, schema, kwargs, query=None):
+        """if this interface has hooks, start the event of an interface method so
+        the SQL compile time of its query can be found, this is called once the
+        method has its connection so waiting on the pool isn't compile time"""
+        if self.hooks:
+            kwargs["query_event"] = QueryEvent(
+                self,
+                orm_class=getattr(schema, "orm_class", None),
+                method_name=method_name,
+                query=query
+            )
+
+    def _tag_query(self, method_name, schema, kwargs):
+        """if this interface tags its SQL, find the comment of an interface method's
+        queries, see tags.py"""
+        if self.query_tags:
+            kwargs["sql_comment"] = self.query_tags.comment(
+                getattr(schema, "orm_class", None),
+                method_name
+            )
+
+    def _relabel_query(self, method_name, schema, kwargs):
+        """the queries one interface method runs for another (eg, the DDL
+        handle_error() runs when an insert finds its table missing) are labeled as
+        method_name in the hooks and tags, so they aren't counted as the queries of
+        the method that failed"""
+        kwargs.pop("query_event", None)
+        kwargs.pop("sql_comment", None)
+        self._tag_query(method_name, schema, kwargs)
+        self._hook_event(method_name, schema, kwargs)
+
+    def get_replicas(self):
+        """return the replica.Replicas this interface's reads are routed to, or
+        None if it doesn't have any replicas, the first call sets them up from
+        the replicas dsn option"""
+        if self._replicas is None:
+            from ..replica import Replicas
+            self._replicas = Replicas.configure(self) or False
+        return self._replicas or None
+
+    def set_replicas(self, replicas):
+        """route this interface's reads to replicas (a replica.Replicas), None
+        sends every read to this interface"""
+        self._replicas = replicas or False
+
+    def last_write(self):
+        """return when this thread last committed a transaction on this interface,
+        0.0 if it never has"""
+        return getattr(self._local, "write_time", 0.0) if self._local else 0.0
+
+    def get_pinned_connection(self):
+        """return the connection this thread has pinned, or None
+
+        while a thread is in a transaction its connection is pinned, so everything
+        else that thread does uses the transaction's connection even if the
+        connection isn't passed in
+        """
+        return getattr(self._local, "connection", None) if self._local else None
+
+    def pin_connection(self, connection):
+        """pin connection to this thread, returns False if a connection was already
+        pinned"""
+        if not self._local or self.get_pinned_connection():
+            return False
+        self._local.connection = connection
+        return True
+
+    def unpin_connection(self):
+        if self._local:
+            self._local.connection = None
+
     @contextmanager
     def connection(self, connection=None, **kwargs):
         try:
+            if not connection:
+                connection = self.get_pinned_connection()
+
             if connection:
                 yield connection
 
@@ -209,6 +393,7 @@ class Interface(object):
 
         self._close()
         self.connected = False
+        self._local = None
         self.log("Closed Connection {}", self.connection_config.interface_name)
         return True
 
@@ -242,15 +427,46 @@ class Interface(object):
             # those db calls will be committed by this line
         """
         with self.connection(connection) as connection:
-            name = connection.transaction_name()
-            connection.transaction_start(name)
+            pinned = self.pin_connection(connection)
             try:
-                yield connection
-                connection.transaction_stop()
+                name = connection.transaction_name()
+                try:
+                    connection.transaction_start(name)
 
-            except Exception as e:
-                connection.transaction_fail(name)
-                self.raise_error(e)
+                except Exception as e:
+                    self.raise_error(e)
+
+                try:
+                    yield connection
+                    connection.transaction_stop()
+                    self._local.write_time = time.time()
+
+                except Exception as e:
+                    connection.transaction_fail(name)
+                    self.raise_error(e)
+
+            finally:
+                if pinned:
+                    self.unpin_connection()
+
+    def in_transaction(self, connection=None, **kwargs):
+        """return True if the connection is currently in a transaction"""
+        with self.connection(connection) as connection:
+            return connection.in_transaction()
+
+    def on_commit(self, callback, connection=None):
+        """call callback() once this thread's transaction commits, or right away if
+        this thread isn't in a transaction
+
+        this is for things outside the db that have to change after the db does
+        (eg, invalidating a cache), doing them before the commit would let another
+        thread see the change and then read the rows from before the commit
+        """
+        connection = connection or self.get_pinned_connection()
+        if connection and connection.in_transaction():
+            connection.add_commit_callback(callback)
+        else:
+            callback()
 
     def set_table(self, schema, **kwargs):
         """
@@ -266,13 +482,16 @@ class Interface(object):
                 with self.transaction(**kwargs):
                     self._set_table(schema, **kwargs)
 
+                    # the indexes are labeled the same as the table, see _relabel_query()
+                    labels = {k: kwargs[k] for k in ("query_event", "sql_comment") if k in kwargs}
                     for index_name, index in schema.indexes.items():
+                        index_options = dict(index.options, **labels)
                         self.set_index(
                             schema,
                             name=index.name,
                             fields=index.fields,
                             connection=connection,
-                            **index.options
+                            **index_options
                         )
 
             except InterfaceError:
@@ -380,6 +599,66 @@ class Interface(object):
     def _set_index(self, schema, name, fields, **index_options):
         raise NotImplementedError()
 
+    def set_notify(self, schema, **kwargs):
+        """
+        have the db tell listeners the primary key of every row of schema's table
+        that is inserted or updated, only interfaces with can_notify support this
+
+        schema -- Schema()
+        """
+        with self.transaction(**kwargs) as connection:
+            kwargs['connection'] = connection
+            self._set_notify(schema, **kwargs)
+
+        return True
+
+    def _set_notify(self, schema, **kwargs): raise NotImplementedError()
+
+    def has_notify(self, schema, **kwargs):
+        """
+        check if set_notify() was called for schema's table
+
+        schema -- Schema()
+        return -- boolean -- True if the table's changes are sent to listeners
+        """
+        if not self.can_notify: return False
+        with self.connection(**kwargs) as connection:
+            kwargs['connection'] = connection
+            return self._has_notify(schema, **kwargs)
+
+    def _has_notify(self, schema, **kwargs): raise NotImplementedError()
+
+    def listen(self, schema, **kwargs):
+        """
+        start listening for schema's changes on connection, the connection only
+        gets notifications while it is held so this should be called inside a
+        with self.connection() block that wraps the notifications() calls
+
+        schema -- Schema()
+        """
+        with self.connection(**kwargs) as connection:
+            kwargs['connection'] = connection
+            self._listen(schema, **kwargs)
+
+        return True
+
+    def _listen(self, schema, **kwargs): raise NotImplementedError()
+
+    def notifications(self, schema, timeout=None, **kwargs):
+        """
+        wait for changes to schema's table on a connection passed to listen()
+
+        schema -- Schema()
+        timeout -- float -- how many seconds to wait, None waits forever
+        return -- list -- the primary keys of the changed rows in the order they
+            changed, empty if nothing changed before timeout
+        """
+        with self.connection(**kwargs) as connection:
+            kwargs['connection'] = connection
+            return self._notifications(schema, timeout, **kwargs)
+
+    def _notifications(self, schema, timeout, **kwargs): raise NotImplementedError()
+
     @reconnecting()
     def insert(self, schema, fields, **kwargs):
         """
@@ -391,9 +670,11 @@ class Interface(object):
         return -- int -- the primary key of the row just inserted
         """
         r = 0
+        self._tag_query("insert", schema, kwargs)
 
         with self.connection(**kwargs) as connection:
             kwargs['connection'] = connection
+            self._hook_event("insert", schema, kwargs)
             try:
                 with self.transaction(**kwargs):
                     r = self._insert(schema, fields, **kwargs)
@@ -420,8 +701,10 @@ class Interface(object):
 
         return -- int -- how many rows where updated
         """
+        self._tag_query("update", schema, kwargs)
         with self.connection(**kwargs) as connection:
             kwargs['connection'] = connection
+            self._hook_event("update", schema, kwargs, query)
             try:
                 with self.transaction(**kwargs):
                     r = self._update(schema, fields, query, **kwargs)
@@ -442,10 +725,13 @@ class Interface(object):
         """this is just a common wrapper around all the get queries since they are
         all really similar in how they execute"""
         if not query: query = Query()
+        method_name = callback.__name__.lstrip("_")
+        self._tag_query(method_name, schema, kwargs)
 
         ret = None
         with self.connection(**kwargs) as connection:
             kwargs['connection'] = connection
+            self._hook_event(method_name, schema, kwargs, query)
             try:
                 if connection.in_transaction():
                     # we wrap SELECT queries in a transaction if we are in a transaction because
@@ -515,12 +801,32 @@ class Interface(object):
 
     def _delete(self, schema, query, **kwargs): raise NotImplementedError()
 
+    def explain(self, schema, query=None, analyze=False, **kwargs):
+        """
+        get the db's plan for the rows matching query
+
+        schema -- Schema()
+        query -- Query()
+        analyze -- boolean -- True to run the query and include what actually
+            happened, not every db supports this
+
+        return -- list -- the lines of the plan
+        """
+        return self._get_query(self._explain, schema, query, analyze=analyze, **kwargs)
+
+    def _explain(self, schema, query, **kwargs): raise NotImplementedError()
+
     def spawn(self):
         """Return a new instance of this Interface with the same connection configuration
 
         :returns: Interface instance
         """
-        return type(self)(self.connection_config)
+        inter = type(self)(self.connection_config)
+        inter.hooks = self.hooks
+        inter.slow_query_log = self.slow_query_log
+        inter.n_plus_one = self.n_plus_one
+        inter.query_tags = self.query_tags
+        return inter
 
     def handle_error(self, schema, e, **kwargs):
         """
@@ -603,18 +909,40 @@ class SQLInterface(Interface):
             ignore_result -- boolean -- true to not attempt to fetch results
             fetchone -- boolean -- true to only fetch one result
             count_result -- boolean -- true to return the int count of rows affected
+            tuple_result -- boolean -- true to return all the rows as a utils.Rows
+                instance (tuples) instead of a list of dicts
+            query_event -- hooks.QueryEvent -- set by the interface method that
+                compiled query_str, see _hook_event()
+            sql_comment -- string -- appended to query_str when it is executed,
+                see _tag_query()
         """
         ret = True
+        hooks = self.hooks
+        event = self._query_event(query_str, query_args, query_options) if hooks else None
+        sql_comment = query_options.get("sql_comment", "")
+        if sql_comment:
+            if query_args and self.val_placeholder == "%s":
+                # the quoted tag values have % in them, which would be read as
+                # placeholders when the query has args
+                sql_comment = sql_comment.replace("%", "%%")
+            # the hooks get the SQL without the comment so the same query always
+            # has the same text no matter where it was called from
+            query_str = "{} {}".format(query_str, sql_comment)
         # http://stackoverflow.com/questions/6739355/dictcursor-doesnt-seem-to-work-under-psycopg2
         connection = query_options.get('connection', None)
         with self.connection(connection) as connection:
-            cur = connection.cursor()
             ignore_result = query_options.get('ignore_result', False)
             count_result = query_options.get('count_result', False)
             one_result = query_options.get('fetchone', query_options.get('one_result', False))
             cursor_result = query_options.get('cursor_result', False)
+            tuple_result = query_options.get('tuple_result', False) and not cursor_result
+            cur = self._cursor(connection, tuple_result=tuple_result)
 
             try:
+                if event:
+                    hooks.fire("before", event)
+                    start = time.time()
+
                 if query_args:
                     self.log("{}{}{}", query_str, os.linesep, query_args)
                     cur.execute(query_str, query_args)
@@ -622,23 +950,71 @@ class SQLInterface(Interface):
                     self.log(query_str)
                     cur.execute(query_str)
 
+                if event:
+                    stop = time.time()
+                    event.timings["execute"] = stop - start
+                    start = stop
+
                 if cursor_result:
                     ret = cur
 
                 elif not ignore_result:
-                    if one_result:
+                    if tuple_result:
+                        # the column names are found once for the whole result set
+                        # instead of every row being its own dict
+                        ret = Rows([d[0] for d in cur.description], cur.fetchall())
+                    elif one_result:
                         ret = self._normalize_result_dict(cur.fetchone())
                     elif count_result:
                         ret = cur.rowcount
                     else:
                         ret = self._normalize_result_list(cur.fetchall())
 
+                if event:
+                    event.timings["fetch"] = time.time() - start
+                    if isinstance(ret, list):
+                        event.row_count = len(ret)
+                    elif one_result:
+                        event.row_count = 1 if ret else 0
+                    elif cur.rowcount >= 0:
+                        event.row_count = cur.rowcount
+                    hooks.fire("after", event)
+
             except Exception as e:
                 self.log(e)
+                if event:
+                    event.error = e
+                    hooks.fire("error", event)
                 raise
 
             return ret
 
+    def _query_event(self, query_str, query_args, query_options):
+        """return the hooks.QueryEvent of the query about to be executed"""
+        event = query_options.get("query_event", None)
+        if event and not event.sql:
+            event.timings["compile"] = time.time() - event.start
+
+        else:
+            # a raw query, or one of the other queries of an interface method
+            event = QueryEvent(
+                self,
+                orm_class=event.orm_class if event else None,
+                method_name=event.method_name if event else "",
+                query=event.query if event else None
+            )
+            event.timings["compile"] = 0.0
+
+        event.sql = query_str
+        event.args = query_args or []
+        event.args_count = len(event.args)
+        return event
+
+    def _cursor(self, connection, tuple_result=False):
+        """return a cursor for connection, if tuple_result is True then the cursor
+        should return each row as a tuple"""
+        return connection.cursor()
+
     def _normalize_result_dict(self, row):
         return row
 
@@ -860,6 +1236,7 @@ class SQLInterface(Interface):
         foreign key to a table that doesn't exist, so this method will go through 
         all fk refs and make sure the tables exist
         """
+        self._relabel_query("set_table", schema, kwargs)
         with self.transaction(**kwargs) as connection:
             kwargs['connection'] = connection
             # go through and make sure all foreign key referenced tables exist
@@ -900,6 +1277,14 @@ class SQLInterface(Interface):
         query_str, query_args = self.get_SQL(schema, query)
         return self.query(query_str, *query_args, **kwargs)
 
+    def _explain(self, schema, query, analyze=False, **kwargs):
+        query_str, query_args = self.get_SQL(schema, query)
+        return self.explain_SQL(query_str, query_args, analyze=analyze, **kwargs)
+
+    def explain_SQL(self, query_str, query_args=None, analyze=False, **kwargs):
+        """return the db's plan for query_str as a list of lines"""
+        raise NotImplementedError()
+
     def _count(self, schema, query, **kwargs):
         query_str, query_args = self.get_SQL(schema, query, count_query=True)
         ret = self.query(query_str, *query_args, **kwargs)
@@ -916,6 +1301,7 @@ class SQLInterface(Interface):
         the reason they have to be NULL is adding fields to Postgres that can be NULL
         is really light, but if they have a default value, then it can be costly
         """
+        self._relabel_query("set_field", schema, kwargs)
         current_fields = self.get_fields(schema, **kwargs)
         for field_name, field in schema.fields.items():
             if field_name not in current_fields:
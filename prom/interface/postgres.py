@@ -11,17 +11,22 @@ import os
 import sys
 import decimal
 import datetime
+import time
+import threading
+import select
 
 # third party
 import psycopg2
 import psycopg2.extras
 import psycopg2.extensions
+from psycopg2.pool import PoolError
 
 # first party
 from .base import SQLInterface, SQLConnection
 from ..compat import *
 from ..utils import get_objects
 from ..exception import UniqueError
+from ..metrics import PoolMetrics
 
 
 # class LoggingCursor(psycopg2.extras.RealDictCursor):
@@ -31,6 +36,15 @@ from ..exception import UniqueError
 #         #psycopg2.extensions.cursor.execute(self, sql, args)
 
 
+def cast_bytea(v, cur):
+    """convert a bytea column to bytes"""
+    if v is None: return v
+    return bytes(psycopg2.BINARY(v, cur))
+
+
+BYTEA = psycopg2.extensions.new_type(psycopg2.BINARY.values, "BYTEA", cast_bytea)
+
+
 #class Connection(psycopg2.extensions.connection, SQLConnection):
 class Connection(SQLConnection, psycopg2.extensions.connection):
 #class Connection(SQLConnection, psycopg2.extras.LoggingConnection):
@@ -50,21 +64,9 @@ class Connection(SQLConnection, psycopg2.extensions.connection):
             psycopg2.extensions.register_type(psycopg2.extensions.UNICODE, self)
             psycopg2.extensions.register_type(psycopg2.extensions.UNICODEARRAY, self)
 
-        else:
-            def normalize_str(v, cur):
-                if isinstance(v, str) and v.startswith("\\x"):
-                    buf = psycopg2.BINARY(v, cur)
-                    v = bytes(buf).decode(cur.connection.encoding)
-
-                    #import binascii
-                    #pout.v(binascii.unhexlify(v[2:]))
-                    #v = v.encode(cur.connection.encoding)
-                    #v = bytes(v, encoding=cur.connection.encoding)
-                return v
-            psycopg2.extensions.register_type(
-                psycopg2.extensions.new_type(psycopg2.STRING.values, "STRING", normalize_str)
-            )
-
+        # text is decoded by psycopg2's C typecaster, only binary columns get a
+        # python typecaster so they come back as bytes instead of a memoryview/buffer
+        psycopg2.extensions.register_type(BYTEA, self)
 
         # http://initd.org/psycopg/docs/connection.html#connection.set_client_encoding
         # https://www.postgresql.org/docs/current/static/multibyte.html
@@ -76,10 +78,245 @@ class Connection(SQLConnection, psycopg2.extensions.connection):
         #self.initialize(logger)
 
 
+class ConnectionPool(object):
+    """A thread safe connection pool
+
+    this has the same interface as the psycopg2 pools (getconn, putconn, and
+    closeall) but checking out a connection will wait for one to be returned
+    when maxconn connections are in use instead of raising an error
+
+    every connection is checked when it is returned, a connection that is still
+    in a transaction is rolled back and a closed or expired connection is thrown
+    away, so the next checkout always gets a usable connection
+
+    minconn -- int -- how many connections to open when the pool is created and
+        to keep open when idle connections are reaped
+    maxconn -- int -- the most connections that can be open at one time
+    timeout -- float -- how many seconds getconn() will wait for a connection
+        before raising a PoolError, defaults to 30, 0 waits forever
+    pre_ping -- bool -- True to run a query on each connection when it is checked
+        out to make sure the server didn't drop it
+    max_lifetime -- float -- connections older than this many seconds are closed
+        and replaced, 0 means they can live forever
+    max_idle -- float -- connections that have sat idle longer than this many
+        seconds are closed (as long as there are still minconn connections), 0
+        means idle connections are never closed
+    *args, **kwargs -- passed through to psycopg2.connect()
+    """
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.timeout = float(kwargs.pop("timeout", 30.0))
+        self.pre_ping = bool(kwargs.pop("pre_ping", False))
+        self.max_lifetime = float(kwargs.pop("max_lifetime", 0.0))
+        self.max_idle = float(kwargs.pop("max_idle", 0.0))
+
+        self.minconn = int(minconn)
+        self.maxconn = max(int(maxconn), self.minconn, 1)
+        self.closed = False
+
+        self._args = args
+        self._kwargs = kwargs
+
+        self.size = 0
+        """how many connections are open, idle or checked out"""
+
+        self.idle = []
+        """connections waiting to be checked out, the most recently returned
+        connection is at the end"""
+
+        self.created = {}
+        """connection -> when it was created"""
+
+        self.returned = {}
+        """connection -> when it was last put back in the pool"""
+
+        self.metrics = PoolMetrics()
+        self.cond = self.create_condition()
+
+        for i in range(self.minconn):
+            self.putconn(self.getconn())
+
+    def create_condition(self):
+        return threading.Condition()
+
+    def _connect(self):
+        start = time.time()
+        try:
+            conn = psycopg2.connect(*self._args, **self._kwargs)
+
+        except:
+            self.metrics.connect_failures.incr()
+            raise
+
+        now = time.time()
+        self.metrics.connect_time.observe(now - start)
+        self.created[conn] = now
+        return conn
+
+    def getconn(self, key=None):
+        """check out a connection, waiting up to timeout seconds for one"""
+        start = time.time()
+        deadline = start + self.timeout if self.timeout else 0
+        while True:
+            conn = self._checkout(deadline)
+            if conn is None:
+                try:
+                    conn = self._connect()
+
+                except:
+                    with self.cond:
+                        self.size -= 1
+                        self.cond.notify()
+                    raise
+
+                break
+
+            elif self.is_usable(conn):
+                break
+
+            else:
+                self._discard(conn)
+
+        self.metrics.checked_out(conn, start)
+        return conn
+
+    def _checkout(self, deadline):
+        """returns an idle connection, or None if the caller should open a new one"""
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+
+                self._reap()
+                if self.idle:
+                    return self.idle.pop()
+
+                if self.size < self.maxconn:
+                    self.size += 1
+                    return None
+
+                remaining = None
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.metrics.timeouts.incr()
+                        raise PoolError("timed out after {} seconds waiting for a connection".format(
+                            self.timeout
+                        ))
+
+                self.metrics.waiting.incr()
+                try:
+                    self.cond.wait(remaining)
+                finally:
+                    self.metrics.waiting.decr()
+
+    def is_usable(self, conn):
+        """return True if the checked out conn can be handed to the caller"""
+        if conn.closed or self.is_expired(conn):
+            return False
+
+        if self.pre_ping:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def is_expired(self, conn):
+        if not self.max_lifetime: return False
+        return (time.time() - self.created.get(conn, 0)) > self.max_lifetime
+
+    def putconn(self, conn, key=None, close=False):
+        """return a checked out connection to the pool"""
+        self.metrics.checked_in(conn)
+        if not close and not self.closed and not conn.closed and not self.is_expired(conn):
+            try:
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                    # the raw rollback bypasses our transaction bookkeeping
+                    if getattr(conn, "transaction_count", 0):
+                        conn.transaction_count = 0
+
+            except psycopg2.Error:
+                close = True
+
+        else:
+            close = True
+
+        if close:
+            self._discard(conn)
+
+        else:
+            with self.cond:
+                self.returned[conn] = time.time()
+                self.idle.append(conn)
+                self.cond.notify()
+
+    def _discard(self, conn):
+        with self.cond:
+            self.size -= 1
+            self.created.pop(conn, None)
+            self.returned.pop(conn, None)
+            self.cond.notify()
+
+        if not conn.closed:
+            conn.close()
+
+    def _reap(self):
+        """close idle connections that have been idle longer than max_idle, this
+        is called with the lock held"""
+        if not self.max_idle: return
+        now = time.time()
+        # the least recently returned connections are at the front
+        while self.idle and self.size > self.minconn:
+            conn = self.idle[0]
+            if now - self.returned.get(conn, now) <= self.max_idle:
+                break
+
+            self.idle.pop(0)
+            self.size -= 1
+            self.created.pop(conn, None)
+            self.returned.pop(conn, None)
+            conn.close()
+
+    def stats(self):
+        """return a dict of how the pool is doing, see metrics.PoolMetrics"""
+        with self.cond:
+            ret = {
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+            }
+        ret["saturation"] = float(ret["in_use"]) / self.maxconn
+        ret.update(self.metrics.stats())
+        return ret
+
+    def closeall(self):
+        """close every idle connection, checked out connections are closed when
+        they are put back"""
+        with self.cond:
+            if self.closed: raise PoolError("connection pool is closed")
+            self.closed = True
+            idle = self.idle
+            self.idle = []
+            self.cond.notify_all()
+
+        for conn in idle:
+            self._discard(conn)
+
+
 class PostgreSQL(SQLInterface):
 
     val_placeholder = '%s'
 
+    can_notify = True
+
     connection_pool = None
 
     _connection = None
@@ -96,7 +333,7 @@ class PostgreSQL(SQLInterface):
         maxconn = int(connection_config.options.get('pool_maxconn', 1))
         pool_class_name = connection_config.options.get(
             'pool_class',
-            'psycopg2.pool.SimpleConnectionPool'
+            'prom.interface.postgres.ConnectionPool'
         )
         async_conn = int(connection_config.options.get('async', 0))
 
@@ -104,6 +341,15 @@ class PostgreSQL(SQLInterface):
 
         self.log("connecting using pool class {}".format(pool_class_name))
 
+        pool_kwargs = {}
+        if issubclass(pool_class, ConnectionPool):
+            pool_kwargs = {
+                "timeout": connection_config.options.get('pool_timeout', 30.0),
+                "pre_ping": int(connection_config.options.get('pool_pre_ping', 0)),
+                "max_lifetime": connection_config.options.get('pool_max_lifetime', 0.0),
+                "max_idle": connection_config.options.get('pool_max_idle', 0.0),
+            }
+
         # http://initd.org/psycopg/docs/module.html#psycopg2.connect
         self.connection_pool = pool_class(
             minconn,
@@ -116,6 +362,7 @@ class PostgreSQL(SQLInterface):
             cursor_factory=psycopg2.extras.RealDictCursor,
             #cursor_factory=LoggingCursor,
             connection_factory=Connection,
+            **pool_kwargs
         )
 
         # hack for sync backwards compatibility with transactions
@@ -147,6 +394,32 @@ class PostgreSQL(SQLInterface):
             self._connection = None
             self.connection_pool = None
 
+    def concurrency(self):
+        # without the async option every thread shares one connection
+        options = self.connection_config.options
+        if int(options.get('async', 0)):
+            return max(int(options.get('pool_maxconn', 1)), 1)
+        return 1
+
+    def stats(self):
+        ret = super(PostgreSQL, self).stats()
+        pool = self.connection_pool
+        if pool and hasattr(pool, "stats"):
+            ret["pool"] = pool.stats()
+        return ret
+
+    def _cursor(self, connection, tuple_result=False):
+        if tuple_result:
+            # the connections default to RealDictCursor
+            return connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+        return connection.cursor()
+
+    def explain_SQL(self, query_str, query_args=None, analyze=False, **kwargs):
+        """https://www.postgresql.org/docs/current/sql-explain.html"""
+        query_str = "{} {}".format("EXPLAIN ANALYZE" if analyze else "EXPLAIN", query_str)
+        rows = self.query(query_str, *(query_args or []), **kwargs)
+        return [r["QUERY PLAN"] for r in rows]
+
     def _get_tables(self, table_name, **kwargs):
         query_str = 'SELECT tablename FROM pg_tables WHERE tableowner = %s'
         query_args = [self.connection_config.username]
@@ -238,7 +511,7 @@ class PostgreSQL(SQLInterface):
             "varchar": str,
             "bool": bool,
             "date": datetime.date,
-            "blob": bytearray,
+            "bytea": bytearray,
         }
 
         # the rows we can set: field_type, name, field_required, min_size, max_size,
@@ -313,7 +586,102 @@ class PostgreSQL(SQLInterface):
 
         return self.query(query_str, ignore_result=True, **index_options)
 
+    def _set_notify(self, schema, **kwargs):
+        """the function, trigger, and channel are all named <table_name>_notify
+
+        https://www.postgresql.org/docs/current/sql-notify.html
+        https://www.postgresql.org/docs/current/plpgsql-trigger.html
+        """
+        name = self._normalize_name("{}_notify".format(schema))
+        query_str = os.linesep.join([
+            'CREATE OR REPLACE FUNCTION {}() RETURNS trigger AS $$',
+            'BEGIN',
+            '  PERFORM pg_notify(%s, NEW.{}::text);',
+            '  RETURN NEW;',
+            'END;',
+            '$$ LANGUAGE plpgsql',
+        ]).format(name, self._normalize_name(schema.pk.name))
+        self.query(query_str, "{}_notify".format(schema), ignore_result=True, **kwargs)
+
+        table_name = self._normalize_table_name(schema)
+        query_str = 'DROP TRIGGER IF EXISTS {} ON {}'.format(name, table_name)
+        self.query(query_str, ignore_result=True, **kwargs)
+
+        query_str = 'CREATE TRIGGER {} AFTER INSERT OR UPDATE ON {} FOR EACH ROW EXECUTE PROCEDURE {}()'.format(
+            name,
+            table_name,
+            name
+        )
+        self.query(query_str, ignore_result=True, **kwargs)
+
+    def _has_notify(self, schema, **kwargs):
+        query_str = " ".join([
+            "SELECT count(*) AS ct FROM pg_trigger",
+            "WHERE tgname = %s AND tgrelid = to_regclass(%s)",
+        ])
+        rows = self.query(
+            query_str,
+            "{}_notify".format(schema),
+            self._normalize_table_name(schema),
+            **kwargs
+        )
+        return rows[0]["ct"] > 0
+
+    def _listen(self, schema, **kwargs):
+        query_str = 'LISTEN {}'.format(self._normalize_name("{}_notify".format(schema)))
+        self.query(query_str, ignore_result=True, **kwargs)
+
+    def _notifications(self, schema, timeout, **kwargs):
+        """
+        http://initd.org/psycopg/docs/advanced.html#asynchronous-notifications
+        """
+        connection = kwargs['connection']
+        if not connection.notifies:
+            # notifications that came in with a query's results are already
+            # in .notifies, otherwise sleep on the socket until one shows up
+            if select.select([connection], [], [], timeout)[0]:
+                connection.poll()
+
+        channel = "{}_notify".format(schema)
+        pk_type = schema.pk.type
+        ret = []
+        while connection.notifies:
+            n = connection.notifies.pop(0)
+            if n.channel == channel:
+                ret.append(int(n.payload) if issubclass(pk_type, (int, long)) else n.payload)
+
+        self.log("{} notifications on {}", len(ret), channel)
+        return ret
+
+    def _normalize_fields(self, schema, fields, connection):
+        """bytes are sent to postgres as bytea, so bytes going into anything that
+        isn't a binary field are decoded with the connection's client encoding
+        first, otherwise a text column would hold the escaped \\x... form of the
+        bytes
+
+        Older versions stored that escaped form and decoded any text that started
+        with \\x when it was read, text is no longer checked so rows written that
+        way come back as the escaped text until they are rewritten, eg:
+
+            UPDATE <table> SET <field> = convert_from(decode(substr(<field>, 3), 'hex'), 'UTF8')
+            WHERE <field> LIKE '\\x%'
+
+        connection -- Connection -- the connection fields will be written with
+        return -- dict -- fields, or a copy of fields with the bytes values decoded
+        """
+        ret = fields
+        for field_name, field_val in fields.items():
+            if isinstance(field_val, bytes) and not is_py2:
+                field = schema.fields.get(field_name)
+                if not field or not issubclass(field.type, bytearray):
+                    if ret is fields:
+                        ret = dict(fields)
+                        encoding = psycopg2.extensions.encodings.get(connection.encoding, "utf-8")
+                    ret[field_name] = field_val.decode(encoding)
+        return ret
+
     def _insert(self, schema, fields, **kwargs):
+        fields = self._normalize_fields(schema, fields, kwargs['connection'])
 
         # get the primary key
         pk_name = schema.pk.name
@@ -336,6 +704,10 @@ class PostgreSQL(SQLInterface):
         ret = self.query(query_str, *query_vals, **kwargs)
         return ret[0][pk_name]
 
+    def _update(self, schema, fields, query, **kwargs):
+        fields = self._normalize_fields(schema, fields, kwargs['connection'])
+        return super(PostgreSQL, self)._update(schema, fields, query, **kwargs)
+
     def _normalize_field_SQL(self, schema, field_name, symbol):
         format_field_name = self._normalize_name(field_name)
         format_val_str = self.val_placeholder
@@ -466,7 +838,7 @@ class PostgreSQL(SQLInterface):
             field_type = 'NUMERIC'
 
         elif issubclass(field.type, bytearray):
-            field_type = 'BLOB'
+            field_type = 'BYTEA'
 
         else:
             raise ValueError('unknown python type: {}'.format(field.type.__name__))
@@ -27,18 +27,31 @@ import decimal
 import datetime
 from distutils import dir_util
 import re
+import sys
 import sqlite3
+import threading
+import multiprocessing
+import weakref
+import random
+import time
+import logging
+from contextlib import contextmanager
 try:
     import thread
 except ImportError:
     thread = None
 
 # first party
-from ..exception import UniqueError
+from ..exception import UniqueError, InterfaceError
+from ..utils import Future
+from ..metrics import Histogram
 from ..compat import *
 from .base import SQLInterface, SQLConnection
 
 
+logger = logging.getLogger(__name__)
+
+
 class SQLiteRowDict(sqlite3.Row):
     def __getitem__(self, k):
         if is_py2:
@@ -58,6 +71,12 @@ class SQLiteConnection(SQLConnection, sqlite3.Connection):
     to Postgres' connection instance so the common code can all be the same in the
     parent class
     """
+    lock_retries = 0
+    """how many times a statement that failed because the db was locked is retried,
+    set by the interface, see SQLite"""
+
+    lock_backoff = 0.1
+
     def __init__(self, *args, **kwargs):
         super(SQLiteConnection, self).__init__(*args, **kwargs)
         self.closed = 0
@@ -67,6 +86,49 @@ class SQLiteConnection(SQLConnection, sqlite3.Connection):
         self.closed = 1
         return r
 
+    def _transaction_start(self):
+        """an IMMEDIATE transaction takes the write lock when it starts, a deferred
+        transaction would take it on its first write, and in WAL mode that fails
+        right away (the busy handler isn't called) if another connection wrote
+        since the transaction first read, so no retry could get it through
+
+        https://www.sqlite.org/lang_transaction.html
+        """
+        self.retry_locked(self.cursor().execute, "BEGIN IMMEDIATE")
+
+    def retry_locked(self, callback, *args, **kwargs):
+        """return callback(*args, **kwargs), if it fails because the db is locked
+        back off and try again up to lock_retries times"""
+        attempt = 0
+        while True:
+            try:
+                return callback(*args, **kwargs)
+
+            except (sqlite3.OperationalError, InterfaceError) as e:
+                if attempt >= self.lock_retries or not is_locked_error(e):
+                    raise
+
+                backoff = self.lock_backoff * (2 ** attempt)
+                backoff += random.uniform(0, backoff)
+                attempt += 1
+                logger.debug("Database locked, retry {} of {} in {:.3f} seconds".format(
+                    attempt,
+                    self.lock_retries,
+                    backoff
+                ))
+                time.sleep(backoff)
+
+
+def is_locked_error(e):
+    """return True if e is sqlite saying another connection has the db locked"""
+    if isinstance(e, InterfaceError):
+        e = e.e
+
+    if isinstance(e, sqlite3.OperationalError):
+        e_msg = str(e)
+        return "database is locked" in e_msg or "database is busy" in e_msg
+    return False
+
 
 class TimestampType(object):
     """External sqlite3 databases can store the TIMESTAMP type as unix timestamps,
@@ -78,18 +140,37 @@ class TimestampType(object):
     the "unixepoch" modifier only works for dates between 0000-01-01 00:00:00 and
     5352-11-01 10:52:47 (unix times of -62167219200 through 106751991167)
     """
+    float_regex = re.compile(r"^\d+\.\d+$")
+
+    int_regex = re.compile(r"^-?\d+$")
+
+    # python 3.7+, this does all the parsing in C
+    fromisoformat = getattr(datetime.datetime, "fromisoformat", None)
+
     @staticmethod
     def adapt(val):
         return val.isoformat(b" ") if is_py2 else val.isoformat(" ")
 
-    @staticmethod
-    def convert(val):
+    @classmethod
+    def convert(cls, val):
         val = StringType.adapt(val)
-        if re.match("^\d+\.\d+$", val):
+
+        # every value prom writes is YYYY-MM-DD HH:MM:SS[.SSSSSS], a unix timestamp
+        # never has a dash in the 5th place so this is a cheap way to tell them apart
+        if val[4:5] == "-":
+            if cls.fromisoformat:
+                try:
+                    return cls.fromisoformat(val)
+                except ValueError:
+                    # fromisoformat (before 3.11) only likes 3 or 6 digit fractions
+                    pass
+            return cls.convert_iso(val)
+
+        if cls.float_regex.match(val):
             # account for unix timestamps with microseconds
             val = datetime.datetime.fromtimestamp(float(val))
 
-        elif re.match("^\-?\d+$", val):
+        elif cls.int_regex.match(val):
             # account for unix timestamps without microseconds
             val = int(val)
 
@@ -106,43 +187,48 @@ class TimestampType(object):
                     val = datetime.datetime.min
 
         else:
-            # this is borrowed from sqlite3.dbapi2.convert_timestamp, sadly it is
-            # burried in a function so I can't wrap it :(
-            datepart, timepart = val.split(" ")
-            year, month, day = map(int, datepart.split("-"))
-            timepart_full = timepart.split(".")
-            hours, minutes, seconds = map(int, timepart_full[0].split(":"))
-            if len(timepart_full) == 2:
-                microseconds = int('{:0<6.6}'.format(timepart_full[1]))
-            else:
-                microseconds = 0
+            val = cls.convert_iso(val)
 
-            val = datetime.datetime(year, month, day, hours, minutes, seconds, microseconds)
         return val
 
+    @staticmethod
+    def convert_iso(val):
+        # this is borrowed from sqlite3.dbapi2.convert_timestamp, sadly it is
+        # burried in a function so I can't wrap it :(
+        datepart, timepart = val.split(" ")
+        year, month, day = map(int, datepart.split("-"))
+        timepart_full = timepart.split(".")
+        hours, minutes, seconds = map(int, timepart_full[0].split(":"))
+        if len(timepart_full) == 2:
+            microseconds = int('{:0<6.6}'.format(timepart_full[1]))
+        else:
+            microseconds = 0
+
+        return datetime.datetime(year, month, day, hours, minutes, seconds, microseconds)
+
 
 class BooleanType(object):
     @staticmethod
     def adapt(val):
-        return int(str(val))
+        return int(val)
 
     @staticmethod
     def convert(val):
-        return bool(str(val))
+        # val is the stored bytes, b"0" or b"1"
+        return val != b"0"
 
 
 class NumericType(object):
     @staticmethod
     def adapt(val):
-        return float(str(val))
+        return float(val)
 
     @staticmethod
     def convert(val):
         if is_py2:
-            ret = decimal.Decimal(str(val))
-        else:
-            val = StringType.adapt(val)
             ret = decimal.Decimal(val)
+        else:
+            ret = decimal.Decimal(val.decode("ascii"))
         return ret
 
 
@@ -157,12 +243,170 @@ class StringType(object):
         return val
 
 
-class SQLite(SQLInterface):
+class GroupCommitWriter(object):
+    """Runs writes from every thread on one writer thread, the writes that queue up
+    while a batch is committing are committed together in the next batch, so many
+    writes share one transaction (and one fsync) instead of each thread fighting
+    for the db's write lock
+
+    Each write runs in its own savepoint, so a write that fails doesn't undo the
+    other writes in its batch. A write's result isn't handed back until its batch
+    has committed
 
+    see -- SQLite.submit()
+    """
+    def __init__(self, interface, batch_size=1000):
+        self.interface = interface
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.pid = os.getpid()
+        self.batch_sizes = Histogram(buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+        self.thread = threading.Thread(target=self.run, name="prom-sqlite-writer")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """commit everything that has been submitted and then stop the thread"""
+        self.queue.put(None)
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def submit(self, callback, *args, **kwargs):
+        """queue callback(*args, connection=connection, **kwargs) to run on the
+        writer thread
+
+        return -- utils.Future
+        """
+        future = Future()
+        self.queue.put((future, callback, args, kwargs))
+        return future
+
+    def run(self):
+        connection = self.interface._open_connection(self.interface.connection_config)
+        try:
+            running = True
+            while running:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if None in batch:
+                    running = False
+                    batch = [item for item in batch if item is not None]
+
+                if batch:
+                    self.commit(connection, batch)
+
+        finally:
+            connection.close()
+
+    def commit(self, connection, batch):
+        """run all the writes in batch in one transaction"""
+        self.batch_sizes.observe(len(batch))
+        results = []
+        try:
+            with self.interface.transaction(connection) as connection:
+                for future, callback, args, kwargs in batch:
+                    kwargs['connection'] = connection
+                    try:
+                        results.append((future, callback(*args, **kwargs), None))
+
+                    except Exception as e:
+                        results.append((future, None, sys.exc_info()))
+
+        except Exception as e:
+            # the commit failed so none of the writes in this batch happened
+            exc_info = sys.exc_info()
+            for future, callback, args, kwargs in batch:
+                future.set_exception(e, exc_info)
+
+        else:
+            for future, result, exc_info in results:
+                if exc_info:
+                    future.set_exception(exc_info[1], exc_info)
+                else:
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "batch_size": self.batch_sizes.stats(),
+        }
+
+
+class SQLite(SQLInterface):
+    """
+    By default every thread shares one connection, set per_thread=1 in the dsn to
+    give each thread its own connection to the db file, the db is switched to WAL
+    journaling so readers don't block the writer (or each other)
+
+    dsn options:
+        per_thread -- int -- 1 to open a connection for each thread
+        busy_timeout -- int -- milliseconds a connection waits on a locked db before
+            giving up, defaults to timeout (in seconds) or 5000
+        lock_retries -- int -- how many times to retry a statement that failed with
+            "database is locked" after busy_timeout ran out, defaults to 3
+        lock_backoff -- float -- seconds to wait before the first retry, this doubles
+            (with some jitter) on every retry, defaults to 0.1
+        group_commit -- int -- 1 to run inserts, updates, and deletes on a writer
+            thread that commits them in batches, see GroupCommitWriter
+        group_commit_size -- int -- the most writes in one batch, defaults to 1000
+        profile -- string -- one of the keys of .profiles, sets those pragmas
+        page_size, journal_mode, synchronous, cache_size, mmap_size, temp_store --
+            set the pragma on every new connection, these override the profile
+
+    https://www.sqlite.org/wal.html
+    https://www.sqlite.org/pragma.html
+    """
     val_placeholder = '?'
 
     _connection = None
 
+    lock_retries = 3
+
+    lock_backoff = 0.1
+
+    per_thread = False
+
+    group_commit = False
+
+    _writer = None
+
+    pragma_names = ("page_size", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store")
+    """the pragmas that can be set from the dsn, in the order they are set, page_size
+    has to be first because it can't be changed once the db is in WAL mode"""
+
+    profiles = {
+        # for a db on a local disk that can lose the last few commits if the power
+        # goes out (but won't be corrupted)
+        "fast-local": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -65536, # 64MB
+            "mmap_size": 268435456, # 256MB
+            "temp_store": "MEMORY",
+        },
+        # every commit is on disk before it returns
+        "durable": {
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+        },
+        # for loading a lot of data into a db you can recreate, a crash in the
+        # middle can corrupt the db
+        "bulk-load": {
+            "journal_mode": "MEMORY",
+            "synchronous": "OFF",
+            "cache_size": -262144, # 256MB
+            "temp_store": "MEMORY",
+        },
+    }
+    """named sets of pragmas that can be set with profile=NAME in the dsn"""
+
     @classmethod
     def configure(cls, connection_config):
         dsn = getattr(connection_config, 'dsn', '')
@@ -189,21 +433,76 @@ class SQLite(SQLInterface):
 
     def _connect(self, connection_config):
         path = connection_config.path
+        self.per_thread = bool(int(connection_config.options.get('per_thread', 0)))
+        self.busy_timeout = int(connection_config.options.get(
+            'busy_timeout',
+            float(connection_config.options.get('timeout', 5.0)) * 1000
+        ))
+        self.lock_retries = int(connection_config.options.get('lock_retries', self.lock_retries))
+        self.lock_backoff = float(connection_config.options.get('lock_backoff', self.lock_backoff))
+
+        self.group_commit = bool(int(connection_config.options.get('group_commit', 0)))
+        self.group_commit_size = int(connection_config.options.get('group_commit_size', 1000))
+
+        if self.per_thread or self.group_commit:
+            if path == ":memory:" or path.startswith("file::memory:"):
+                # every connection to :memory: gets its own private db
+                raise ValueError("per_thread and group_commit need a db file, not :memory:")
+
+        self.pragmas = self.get_dsn_pragmas(connection_config)
+
+        # for some reason this is needed in python 3.6 in order for saved bytes
+        # to be ran through the converter, not sure why
+        sqlite3.register_converter('TEXT' if not is_py2 else b'TEXT', StringType.adapt)
+
+        sqlite3.register_adapter(decimal.Decimal, NumericType.adapt)
+        sqlite3.register_converter('NUMERIC' if not is_py2 else b'NUMERIC', NumericType.convert)
+
+        sqlite3.register_adapter(bool, BooleanType.adapt)
+        sqlite3.register_converter('BOOLEAN' if not is_py2 else b'BOOLEAN', BooleanType.convert)
+
+        sqlite3.register_adapter(datetime.datetime, TimestampType.adapt)
+        sqlite3.register_converter('TIMESTAMP' if not is_py2 else b'TIMESTAMP', TimestampType.convert)
+
+        self._writer_lock = threading.Lock()
+
+        if self.per_thread:
+            local_class = self.local_class or threading.local
+            self._connections = local_class()
+            self._open_connections = weakref.WeakSet()
+            self._open_lock = threading.Lock()
+
+            # make sure the db works before the threads start using it
+            self.get_connection()
+
+        else:
+            self._connection = self._open_connection(connection_config)
+
+    def _open_connection(self, connection_config):
+        """create and set up a new raw connection to the db"""
+        path = connection_config.path
 
         # https://docs.python.org/2/library/sqlite3.html#default-adapters-and-converters
         options = {
             'isolation_level': None,
             'detect_types': sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
             'factory': SQLiteConnection,
-            'check_same_thread': True, # https://stackoverflow.com/a/2578401/5006
+            # https://stackoverflow.com/a/2578401/5006
+            # in per thread mode a connection is only used by the thread that
+            # opened it, but close() can be called from any thread
+            'check_same_thread': not self.per_thread,
         }
+        # dsn options are strings, so the numeric ones are converted
+        option_types = {'detect_types': int, 'timeout': float, 'cached_statements': int}
         option_keys = list(options.keys()) + ['timeout', 'cached_statements']
         for k in option_keys:
             if k in connection_config.options:
                 options[k] = connection_config.options[k]
+                if k in option_types:
+                    options[k] = option_types[k](options[k])
 
         try:
-            self._connection = sqlite3.connect(path, **options)
+            connection = sqlite3.connect(path, **options)
 
         except sqlite3.DatabaseError as e:
             path_d = os.path.dirname(path)
@@ -213,33 +512,174 @@ class SQLite(SQLInterface):
             else:
                 # let's try and make the directory path and connect again
                 dir_util.mkpath(path_d)
-                self._connection = sqlite3.connect(path, **options)
+                connection = sqlite3.connect(path, **options)
+
+        connection.lock_retries = self.lock_retries
+        connection.lock_backoff = self.lock_backoff
 
         # https://docs.python.org/2/library/sqlite3.html#row-objects
-        self._connection.row_factory = SQLiteRowDict
+        connection.row_factory = SQLiteRowDict
         # https://docs.python.org/2/library/sqlite3.html#sqlite3.Connection.text_factory
-        self._connection.text_factory = StringType.adapt
-
-        # for some reason this is needed in python 3.6 in order for saved bytes
-        # to be ran through the converter, not sure why
-        sqlite3.register_converter('TEXT' if not is_py2 else b'TEXT', StringType.adapt)
-
-        sqlite3.register_adapter(decimal.Decimal, NumericType.adapt)
-        sqlite3.register_converter('NUMERIC' if not is_py2 else b'NUMERIC', NumericType.convert)
+        connection.text_factory = StringType.adapt
 
-        sqlite3.register_adapter(bool, BooleanType.adapt)
-        sqlite3.register_converter('BOOLEAN' if not is_py2 else b'BOOLEAN', BooleanType.convert)
+        # https://www.sqlite.org/pragma.html#pragma_busy_timeout
+        self._query('PRAGMA busy_timeout = {:d}'.format(self.busy_timeout), ignore_result=True, connection=connection)
 
-        sqlite3.register_adapter(datetime.datetime, TimestampType.adapt)
-        sqlite3.register_converter('TIMESTAMP' if not is_py2 else b'TIMESTAMP', TimestampType.convert)
+        # WAL is a property of the db file, so setting it only really does something
+        # the first time, but it's cheap so every new connection makes sure
+        self.set_pragmas(self.pragmas, connection=connection)
 
         # turn on foreign keys
         # http://www.sqlite.org/foreignkeys.html
-        self._query('PRAGMA foreign_keys = ON', ignore_result=True);
+        self._query('PRAGMA foreign_keys = ON', ignore_result=True, connection=connection)
+        return connection
+
+    def get_dsn_pragmas(self, connection_config):
+        """return the pragmas set in the dsn, the profile's pragmas are the defaults
+        and any pragma set in the dsn overrides them
+
+        return -- list -- (name, value) tuples in the order of .pragma_names
+        """
+        options = connection_config.options
+        profile = options.get("profile", "")
+        if profile:
+            if profile not in self.profiles:
+                raise ValueError("unknown sqlite profile {}, choose one of: {}".format(
+                    profile,
+                    ", ".join(sorted(self.profiles.keys()))
+                ))
+            pragmas = dict(self.profiles[profile])
+
+        else:
+            pragmas = {}
+
+        if self.per_thread:
+            # concurrent readers are the point of per_thread
+            pragmas.setdefault("journal_mode", "WAL")
+
+        for name in self.pragma_names:
+            if name in options:
+                pragmas[name] = options[name]
+
+        return [(name, pragmas[name]) for name in self.pragma_names if name in pragmas]
+
+    def set_pragmas(self, pragmas, **kwargs):
+        """set the pragmas on the connection
+
+        pragmas -- list|dict -- (name, value) tuples, or a dict of name: value
+        """
+        if isinstance(pragmas, dict):
+            pragmas = [(name, pragmas[name]) for name in self.pragma_names if name in pragmas]
+
+        for name, value in pragmas:
+            value = unicode(value)
+            if not re.match(r"^-?\w+$", value):
+                raise ValueError("{} is not a valid value for pragma {}".format(value, name))
+            self._query('PRAGMA {} = {}'.format(name, value), ignore_result=True, **kwargs)
+
+    def get_pragmas(self, names, **kwargs):
+        """return a dict of name: current value for each pragma in names"""
+        ret = {}
+        for name in names:
+            r = self._query('PRAGMA {}'.format(name), fetchone=True, **kwargs)
+            ret[name] = r[name]
+        return ret
+
+    @contextmanager
+    def bulk_load(self, connection=None, **kwargs):
+        """a context manager for loading a lot of rows, this switches the connection
+        to the bulk-load profile and runs everything inside the with block in one
+        transaction, the connection's old settings are put back when it's done
+
+        journal_mode and page_size are left alone because they can't be changed
+        while other connections are using the db, and synchronous is left alone if
+        the connection is already in a transaction
+
+        example --
+            with interface.bulk_load():
+                for fields in rows:
+                    interface.insert(schema, fields)
+        """
+        with self.connection(connection) as connection:
+            skip = set(["journal_mode", "page_size"])
+            if connection.in_transaction():
+                skip.add("synchronous")
+            names = [n for n in self.pragma_names if n in self.profiles["bulk-load"] and n not in skip]
+            pragmas = dict((n, self.profiles["bulk-load"][n]) for n in names)
+            previous = self.get_pragmas(names, connection=connection)
+            self.set_pragmas(pragmas, connection=connection)
+            try:
+                with self.transaction(connection) as connection:
+                    yield connection
+
+            finally:
+                self.set_pragmas(previous, connection=connection)
 
     def get_connection(self):
         if not self.connected: self.connect()
-        return self._connection
+        if self.per_thread:
+            connection = getattr(self._connections, "connection", None)
+            if connection is None or connection.closed or connection.pid != os.getpid():
+                connection = self._open_connection(self.connection_config)
+                connection.pid = os.getpid()
+                self._connections.connection = connection
+                with self._open_lock:
+                    self._open_connections.add(connection)
+
+        else:
+            connection = self._connection
+
+        return connection
+
+    def get_writer(self):
+        """return the running group commit writer, starting it if needed"""
+        if not self.connected: self.connect()
+        writer = self._writer
+        if writer is None or writer.pid != os.getpid():
+            with self._writer_lock:
+                writer = self._writer
+                if writer is None or writer.pid != os.getpid():
+                    writer = GroupCommitWriter(self, self.group_commit_size)
+                    writer.start()
+                    self._writer = writer
+        return writer
+
+    def is_group_commit(self, **kwargs):
+        """return True if a write with these kwargs should go to the writer thread,
+        writes that are part of the caller's transaction (or that pass in their own
+        connection) run on the caller's connection like normal"""
+        return self.group_commit and not kwargs.get('connection', None) and not self.get_pinned_connection()
+
+    def submit(self, method_name, *args, **kwargs):
+        """queue a write (insert, update, or delete) to the group commit writer
+
+        this returns right away, call .result() on the returned future to wait
+        for the batch the write is in to commit and get the write's return value
+        (or have its error raised)
+
+        method_name -- string -- the name of the write method (eg, "insert")
+        *args -- passed to the method
+        **kwargs -- passed to the method
+
+        return -- utils.Future
+        """
+        callback = getattr(super(SQLite, self), method_name)
+        return self.get_writer().submit(callback, *args, **kwargs)
+
+    def insert(self, schema, fields, **kwargs):
+        if self.is_group_commit(**kwargs):
+            return self.submit("insert", schema, fields, **kwargs).result()
+        return super(SQLite, self).insert(schema, fields, **kwargs)
+
+    def update(self, schema, fields, query, **kwargs):
+        if self.is_group_commit(**kwargs):
+            return self.submit("update", schema, fields, query, **kwargs).result()
+        return super(SQLite, self).update(schema, fields, query, **kwargs)
+
+    def delete(self, schema, query, **kwargs):
+        if self.is_group_commit(**kwargs):
+            return self.submit("delete", schema, query, **kwargs).result()
+        return super(SQLite, self).delete(schema, query, **kwargs)
 
     def _get_thread(self):
         if thread:
@@ -249,8 +689,84 @@ class SQLite(SQLInterface):
         return ret
 
     def _close(self):
-        self._connection.close()
-        self._connection = None
+        if self._writer:
+            self._writer.stop()
+            self._writer = None
+
+        if self.per_thread:
+            with self._open_lock:
+                connections = list(self._open_connections)
+                self._open_connections = weakref.WeakSet()
+
+            for connection in connections:
+                if not connection.closed:
+                    connection.close()
+
+            self._connections = None
+
+        else:
+            self._connection.close()
+            self._connection = None
+
+    def concurrency(self):
+        if int(self.connection_config.options.get('per_thread', 0)):
+            return multiprocessing.cpu_count()
+        return 1
+
+    def stats(self):
+        ret = super(SQLite, self).stats()
+        ret["per_thread"] = self.per_thread
+        if ret["per_thread"] and self.connected:
+            ret["connections"] = len(self._open_connections)
+        if self._writer:
+            ret["writer"] = self._writer.stats()
+        return ret
+
+    def is_locked_error(self, e):
+        """return True if e is sqlite saying another connection has the db locked"""
+        return is_locked_error(e)
+
+    def _query(self, query_str, query_args=None, **query_options):
+        """retries statements that failed because the db was locked
+
+        busy_timeout has already waited by the time a locked error gets here, but
+        there are a few cases where sqlite doesn't wait on the busy handler, so this
+        backs off and tries again. Statements in a transaction aren't retried, the
+        transaction already holds the write lock (see
+        SQLiteConnection._transaction_start()) so a locked error there won't go away
+        by running the statement again
+        """
+        with self.connection(query_options.get('connection', None)) as connection:
+            query_options['connection'] = connection
+            query = super(SQLite, self)._query
+            if connection.in_transaction():
+                return query(query_str, query_args, **query_options)
+            return connection.retry_locked(query, query_str, query_args, **query_options)
+
+    def _cursor(self, connection, tuple_result=False):
+        cur = connection.cursor()
+        if tuple_result:
+            cur.row_factory = None
+        return cur
+
+    def explain_SQL(self, query_str, query_args=None, analyze=False, **kwargs):
+        """sqlite can't analyze, so analyze is ignored and the plan is always the
+        estimated one
+
+        https://www.sqlite.org/eqp.html
+        """
+        query_str = "EXPLAIN QUERY PLAN {}".format(query_str)
+        rows = self.query(query_str, *(query_args or []), **kwargs)
+
+        # each step is indented under its parent step
+        depths = {}
+        ret = []
+        for r in rows:
+            r = dict(r)
+            depth = depths.get(r.get("parent", 0), -1) + 1
+            depths[r.get("id", 0)] = depth
+            ret.append("{}{}".format("  " * depth, r["detail"]))
+        return ret
 
     def _get_tables(self, table_name, **kwargs):
         query_str = 'SELECT tbl_name FROM sqlite_master WHERE type = ?'
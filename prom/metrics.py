@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight metrics that the interfaces and connection pools use to record what
+they are doing, every metric is safe to update from multiple threads
+
+see -- Interface.stats()
+
+The Registry collects the query metrics of the interfaces added to it and renders
+them, along with each interface's stats(), in the Prometheus text format:
+
+    export PROM_DSN=prom.interface.postgres.PostgreSQL://host/db?metrics=1
+
+    from prom import metrics
+    metrics.render() # the text to serve at /metrics
+    metrics.registry.dump("/tmp/prom-stats.json") # for `prom top`
+
+dsn options --
+    metrics -- 1 to add the interface to the default registry
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from .compat import *
+
+
+class Counter(object):
+    """A value that only goes up, like how many connections failed"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def incr(self, count=1):
+        with self.lock:
+            self.value += count
+            return self.value
+
+    def stats(self):
+        return self.value
+
+
+class Gauge(Counter):
+    """A value that goes up and down, like how many callers are waiting"""
+    def decr(self, count=1):
+        return self.incr(-count)
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+
+class Histogram(object):
+    """Counts observations (usually durations in seconds) into buckets so you can
+    see the shape of the distribution, not just the average
+
+    buckets are upper bounds, an observation is counted in the first bucket it is
+    less than or equal to, anything bigger than the last bucket goes in +Inf
+    """
+    buckets = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    """the default bucket upper bounds, in seconds"""
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                index = i
+                break
+
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self):
+        """observe how long the with block takes"""
+        start = time.time()
+        try:
+            yield self
+        finally:
+            self.observe(time.time() - start)
+
+    def percentile(self, p):
+        """return the bucket upper bound that p (0.0 to 1.0) of the observations
+        fall under, this is an upper estimate since only the buckets are kept"""
+        if not self.count: return 0.0
+        target = p * self.count
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def stats(self):
+        cumulative = 0
+        buckets = []
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            le = self.buckets[i] if i < len(self.buckets) else float("inf")
+            buckets.append((le, cumulative))
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": (self.sum / self.count) if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "buckets": buckets,
+        }
+
+
+class PoolMetrics(object):
+    """The metrics a connection pool records
+
+    wait_time -- Histogram -- how long getconn() waited for a connection
+    hold_time -- Histogram -- how long a connection was checked out
+    connect_time -- Histogram -- how long opening a new connection took
+    connect_failures -- Counter -- how many times opening a connection failed
+    timeouts -- Counter -- how many times getconn() gave up waiting
+    waiting -- Gauge -- how many callers are waiting on getconn() right now
+    """
+    def __init__(self):
+        self.wait_time = Histogram()
+        self.hold_time = Histogram()
+        self.connect_time = Histogram()
+        self.connect_failures = Counter()
+        self.timeouts = Counter()
+        self.checkouts = {}
+        self.waiting = Gauge()
+
+    def checked_out(self, conn, wait_start):
+        now = time.time()
+        self.wait_time.observe(now - wait_start)
+        self.checkouts[id(conn)] = now
+
+    def checked_in(self, conn):
+        start = self.checkouts.pop(id(conn), None)
+        if start is not None:
+            self.hold_time.observe(time.time() - start)
+
+    def stats(self):
+        return {
+            "wait_time": self.wait_time.stats(),
+            "hold_time": self.hold_time.stats(),
+            "connect_time": self.connect_time.stats(),
+            "connect_failures": self.connect_failures.stats(),
+            "timeouts": self.timeouts.stats(),
+            "waiting": self.waiting.stats(),
+        }
+
+
+class Registry(object):
+    """Collects the query metrics of every interface added to it
+
+    queries are counted by Orm class, interface method, and query fingerprint
+    (the shape of the query, see query.Fingerprint), durations and rows are kept
+    by Orm class and interface method so there is one histogram for each kind of
+    query instead of one for every shape
+
+    see -- hooks.py
+    """
+    namespace = "prom"
+    """the prefix of every rendered metric name"""
+
+    counters = set([
+        "reconnect_attempts",
+        "reconnect_failures",
+        "connect_failures",
+        "timeouts",
+        "primary_reads",
+        "failures",
+        "reads",
+        "slow_queries",
+        "explains",
+        "n_plus_ones",
+    ])
+    """the interface stats() keys that only go up, they are rendered as counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interfaces = []
+        self.reset()
+
+    @classmethod
+    def configure(cls, interface):
+        """add interface to the default registry if its dsn options ask for it
+
+        return -- Registry -- None if the metrics option isn't set
+        """
+        options = interface.connection_config.options if interface.connection_config else {}
+        if not int(options.get("metrics", 0)): return None
+        return registry.add(interface)
+
+    def add(self, interface):
+        """record the queries of interface and render its stats()"""
+        interface.add_hook("after", self.after)
+        interface.add_hook("error", self.error)
+        interface.add_hook("cache", self.cache_result)
+        with self.lock:
+            self.interfaces.append(interface)
+        return self
+
+    def remove(self, interface):
+        interface.remove_hook("after", self.after)
+        interface.remove_hook("error", self.error)
+        interface.remove_hook("cache", self.cache_result)
+        with self.lock:
+            self.interfaces = [inter for inter in self.interfaces if inter is not interface]
+
+    def reset(self):
+        """forget every recorded query metric, the interfaces stay added"""
+        with self.lock:
+            self.queries = {}
+            """(orm, method, fingerprint) -> Counter"""
+            self.query_seconds = {}
+            """(orm, method, fingerprint) -> Counter of the seconds they took"""
+            self.query_rows = {}
+            """(orm, method, fingerprint) -> Counter"""
+            self.shapes = {}
+            """fingerprint -> the sql of one of its queries"""
+            self.durations = {}
+            """(orm, method) -> Histogram"""
+            self.rows = {}
+            """(orm, method) -> Counter"""
+            self.errors = {}
+            """(orm, method) -> Counter"""
+            self.cache = {}
+            """(orm, result) -> Counter, result is hit or miss"""
+
+    def get_metric(self, metrics, key, metric_class):
+        metric = metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = metrics.get(key)
+                if metric is None:
+                    metric = metric_class()
+                    metrics[key] = metric
+        return metric
+
+    def orm_name(self, orm_class):
+        return "{}.{}".format(orm_class.__module__, orm_class.__name__) if orm_class else ""
+
+    def fingerprint(self, event):
+        """return the shape hash of the query of event"""
+        return event.fingerprint[:16]
+
+    def after(self, event):
+        orm = self.orm_name(event.orm_class)
+        method_name = event.method_name
+        fingerprint = self.fingerprint(event)
+        duration = event.duration
+        key = (orm, method_name, fingerprint)
+        self.get_metric(self.queries, key, Counter).incr()
+        self.get_metric(self.query_seconds, key, Counter).incr(duration)
+        if event.row_count:
+            self.get_metric(self.query_rows, key, Counter).incr(event.row_count)
+        if fingerprint not in self.shapes:
+            self.shapes[fingerprint] = event.sql
+
+        key = (orm, method_name)
+        self.get_metric(self.durations, key, Histogram).observe(duration)
+        if event.row_count:
+            self.get_metric(self.rows, key, Counter).incr(event.row_count)
+
+    def error(self, event):
+        key = (self.orm_name(event.orm_class), event.method_name)
+        self.get_metric(self.errors, key, Counter).incr()
+
+    def cache_result(self, event):
+        """record a cache lookup of a query.BaseCacheQuery"""
+        key = (self.orm_name(event.orm_class), "hit" if event.cache_hit else "miss")
+        self.get_metric(self.cache, key, Counter).incr()
+
+    def snapshot(self):
+        """return a copy of everything recorded so far as plain values
+
+        return -- dict
+        """
+        with self.lock:
+            queries = list(self.queries.items())
+            query_seconds = dict((k, v.stats()) for k, v in self.query_seconds.items())
+            query_rows = dict((k, v.stats()) for k, v in self.query_rows.items())
+            durations = list(self.durations.items())
+            rows = dict((k, v.stats()) for k, v in self.rows.items())
+            errors = dict((k, v.stats()) for k, v in self.errors.items())
+            cache = dict((k, v.stats()) for k, v in self.cache.items())
+            shapes = dict(self.shapes)
+            interfaces = list(self.interfaces)
+
+        ret = {
+            "queries": [],
+            "orms": [],
+            "cache": [],
+            "interfaces": [],
+        }
+        for key, counter in queries:
+            orm, method_name, fingerprint = key
+            ret["queries"].append({
+                "orm": orm,
+                "method": method_name,
+                "fingerprint": fingerprint,
+                "sql": shapes.get(fingerprint, ""),
+                "count": counter.stats(),
+                "duration": query_seconds.get(key, 0.0),
+                "rows": query_rows.get(key, 0),
+            })
+
+        # an orm and method whose queries only ever failed doesn't have durations
+        durations = dict(durations)
+        for key in sorted(set(durations) | set(errors)):
+            orm, method_name = key
+            histogram = durations.get(key)
+            ret["orms"].append({
+                "orm": orm,
+                "method": method_name,
+                "duration": histogram.stats() if histogram else Histogram().stats(),
+                "rows": rows.get(key, 0),
+                "errors": errors.get(key, 0),
+            })
+
+        orms = set(orm for orm, result in cache)
+        for orm in orms:
+            hits = cache.get((orm, "hit"), 0)
+            misses = cache.get((orm, "miss"), 0)
+            ret["cache"].append({
+                "orm": orm,
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": float(hits) / (hits + misses) if (hits + misses) else 0.0,
+            })
+
+        for inter in interfaces:
+            ret["interfaces"].append({
+                "name": inter.connection_config.name if inter.connection_config else "",
+                "stats": inter.stats(),
+            })
+
+        return ret
+
+    def dump(self, path):
+        """write snapshot() to path as json, `prom top --stats=path` reports on it"""
+        with open(path, "w") as fp:
+            json.dump(self.snapshot(), fp, default=str)
+
+    def render(self):
+        """return every metric in the Prometheus text exposition format
+
+        https://prometheus.io/docs/instrumenting/exposition_formats/
+        """
+        snapshot = self.snapshot()
+        families = Families(self.namespace)
+
+        for q in snapshot["queries"]:
+            families.add(
+                "queries_total",
+                "counter",
+                "Queries run by Orm class, interface method, and query shape",
+                q["count"],
+                orm=q["orm"],
+                method=q["method"],
+                fingerprint=q["fingerprint"],
+            )
+
+        for o in snapshot["orms"]:
+            labels = {"orm": o["orm"], "method": o["method"]}
+            families.add_histogram(
+                "query_duration_seconds",
+                "How long queries took by Orm class and interface method",
+                o["duration"],
+                **labels
+            )
+            families.add("rows_total", "counter", "Rows returned or changed by queries", o["rows"], **labels)
+            families.add("query_errors_total", "counter", "Queries that failed", o["errors"], **labels)
+
+        for c in snapshot["cache"]:
+            for result in ["hit", "miss"]:
+                families.add(
+                    "cache_requests_total",
+                    "counter",
+                    "Cache query lookups by whether they hit the cache",
+                    c["hits"] if result == "hit" else c["misses"],
+                    orm=c["orm"],
+                    result=result,
+                )
+            families.add("cache_hit_ratio", "gauge", "Cache query hits over lookups", c["hit_ratio"], orm=c["orm"])
+
+        for i in snapshot["interfaces"]:
+            self.render_stats(families, "interface", i["stats"], interface=i["name"])
+
+        return families.render()
+
+    def render_stats(self, families, prefix, stats, **labels):
+        """add the numbers of an interface's stats() dict to families, nested
+        dicts are flattened into the metric name"""
+        for key, val in sorted(stats.items()):
+            name = "{}_{}".format(prefix, key)
+            if isinstance(val, bool):
+                families.add(name, "gauge", "", int(val), **labels)
+
+            elif isinstance(val, (int, long, float)):
+                if key in self.counters:
+                    families.add("{}_total".format(name), "counter", "", val, **labels)
+                else:
+                    families.add(name, "gauge", "", val, **labels)
+
+            elif isinstance(val, dict):
+                if "buckets" in val:
+                    families.add_histogram(name, "", val, **labels)
+                else:
+                    self.render_stats(families, name, val, **labels)
+
+
+class Families(object):
+    """Groups the samples of each metric so they can be rendered together, you
+    probably don't need to worry about this class, see Registry.render()"""
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.families = {}
+        self.order = []
+
+    def get_family(self, name, metric_type, help_str):
+        name = "{}_{}".format(self.namespace, name)
+        family = self.families.get(name)
+        if family is None:
+            family = {"type": metric_type, "help": help_str, "samples": []}
+            self.families[name] = family
+            self.order.append(name)
+        return name, family
+
+    def add(self, name, metric_type, help_str, value, **labels):
+        name, family = self.get_family(name, metric_type, help_str)
+        family["samples"].append((name, labels, value))
+
+    def add_histogram(self, name, help_str, stats, **labels):
+        """add a Histogram.stats() dict"""
+        name, family = self.get_family(name, "histogram", help_str)
+        for le, count in stats["buckets"]:
+            bucket_labels = dict(labels)
+            bucket_labels["le"] = "+Inf" if le == float("inf") else self.format_value(le)
+            family["samples"].append(("{}_bucket".format(name), bucket_labels, count))
+        family["samples"].append(("{}_sum".format(name), labels, stats["sum"]))
+        family["samples"].append(("{}_count".format(name), labels, stats["count"]))
+
+    def format_value(self, value):
+        if isinstance(value, float):
+            if value == float("inf"): return "+Inf"
+            return repr(value)
+        return "{}".format(value)
+
+    def format_labels(self, labels):
+        if not labels: return ""
+        parts = []
+        for k, v in sorted(labels.items()):
+            v = "{}".format(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            parts.append('{}="{}"'.format(k, v))
+        return "{{{}}}".format(",".join(parts))
+
+    def render(self):
+        lines = []
+        for name in self.order:
+            family = self.families[name]
+            if family["help"]:
+                lines.append("# HELP {} {}".format(name, family["help"]))
+            lines.append("# TYPE {} {}".format(name, family["type"]))
+            for sample_name, labels, value in family["samples"]:
+                lines.append("{}{} {}".format(
+                    sample_name,
+                    self.format_labels(labels),
+                    self.format_value(value)
+                ))
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+"""the default registry, see the metrics dsn option"""
+
+
+def render():
+    """return the metrics of the default registry in the Prometheus text format"""
+    return registry.render()
@@ -9,6 +9,7 @@ from .query import Query, Iterator
 from . import decorators, utils
 from .interface import get_interface
 from .config import Schema, Field, ObjectField, Index
+from .shard import Shards
 from .compat import *
 
 
@@ -65,6 +66,16 @@ class Orm(object):
     connection_name = ""
     """the name of the connection to use to retrieve the interface"""
 
+    shard_connection_names = None
+    """the names of the connections this Orm's rows are split across, see shard.py"""
+
+    shard_field_name = ""
+    """the field that decides which of the shard_connection_names a row lives on"""
+
+    shard_ranges = None
+    """the lowest shard_field_name value of each shard after the first, None to hash
+    the shard_field_name value instead"""
+
     query_class = Query
     """the class this Orm will use to create Query instances to query the db"""
 
@@ -112,6 +123,12 @@ class Orm(object):
         """
         return get_interface(cls.connection_name)
 
+    @decorators.classproperty
+    def shards(cls):
+        """the shard.Shards instance this Orm's rows are split across, None if the
+        Orm isn't sharded"""
+        return Shards.get_instance(cls)
+
     @decorators.classproperty
     def query(cls):
         """
@@ -191,6 +208,15 @@ class Orm(object):
         instance.save()
         return instance
 
+    @classmethod
+    def acreate(cls, fields=None, **fields_kwargs):
+        """awaitable create()
+
+        see -- aio.py
+        """
+        from . import aio
+        return aio.run(cls.interface, cls.create, fields, **fields_kwargs)
+
     @classmethod
     def datestamp(cls, field_val):
         """get the field_val as a string datestamp
@@ -248,6 +274,37 @@ class Orm(object):
 
         self._populate(pop_fields)
 
+    @classmethod
+    def row_hydrator(cls, columns):
+        """return a callable that builds a hydrated instance from a tuple row of a
+        result set with columns (see utils.Rows), the position of each field is
+        found once for the whole result set so no row is made into a dict first
+
+        a class that overrides __init__() or populate() gets its rows the usual
+        way, as a dict passed to cls(fields, hydrate=True)
+
+        :param columns: list, the column names of the result set
+        :returns: callable, takes a row tuple and returns an instance of cls
+        """
+        index = dict((c, i) for i, c in enumerate(columns))
+        field_indexes = [(k, index.get(k, None)) for k in cls.schema.fields.keys()]
+
+        if cls.__init__ is not Orm.__init__ or cls.populate is not Orm.populate:
+            def hydrate(row):
+                return cls(
+                    {k: row[i] for k, i in field_indexes if i is not None},
+                    hydrate=True
+                )
+
+        else:
+            def hydrate(row):
+                instance = cls.__new__(cls)
+                instance.reset_modified()
+                instance._populate({k: None if i is None else row[i] for k, i in field_indexes})
+                return instance
+
+        return hydrate
+
     def _populate(self, fields):
         """this runs all the fields through their iget methods to mimic them
         freshly coming out of the db, then resets modified
@@ -327,6 +384,14 @@ class Orm(object):
         else:
             raise ValueError("You cannot update without a primary key")
 
+        if self.shards:
+            shard_field_name = self.shard_field_name
+            if shard_field_name in self.modified_fields:
+                raise ValueError("You cannot change the shard key {} of a saved row".format(
+                    shard_field_name
+                ))
+            q.is_field(shard_field_name, getattr(self, shard_field_name))
+
         if q.update():
             fields = q.fields
             self._populate(fields)
@@ -358,6 +423,11 @@ class Orm(object):
 
         return ret
 
+    def asave(self):
+        """awaitable save()"""
+        from . import aio
+        return aio.run(self.interface, self.save)
+
     def delete(self):
         """delete the object from the db if pk is set"""
         ret = False
@@ -365,7 +435,10 @@ class Orm(object):
         pk = self.pk
         if pk:
             pk_name = self.schema.pk.name
-            self.query.is_field(pk_name, pk).delete()
+            q.is_field(pk_name, pk)
+            if self.shards:
+                q.is_field(self.shard_field_name, getattr(self, self.shard_field_name))
+            q.delete()
             setattr(self, pk_name, None)
 
             # mark all the fields that still exist as modified
@@ -378,6 +451,11 @@ class Orm(object):
 
         return ret
 
+    def adelete(self):
+        """awaitable delete()"""
+        from . import aio
+        return aio.run(self.interface, self.delete)
+
     def is_modified(self):
         """true if a field has been changed from its original value, false otherwise"""
         return len(self.modified_fields) > 0
@@ -411,8 +489,9 @@ class Orm(object):
         modified_fields = set()
         fields = self.make_dict(fields, fields_kwargs)
         fields = self._modify(fields)
+        schema_fields = self.schema.fields
         for field_name, field_val in fields.items():
-            in_schema = field_name in self.schema.fields
+            in_schema = field_name in schema_fields
             if in_schema:
                 setattr(self, field_name, field_val)
                 modified_fields.add(field_name)
@@ -430,8 +509,9 @@ class Orm(object):
         return fields
 
     def __setattr__(self, field_name, field_val):
-        if field_name in self.schema.fields:
-            if field_name == self.schema.pk.name:
+        fields = self.schema.fields
+        if field_name in fields:
+            if fields[field_name].is_pk():
                 # we mark everything as dirty because the primary key has changed
                 # and so a new row would be inserted into the db
                 self.modified_fields.add(field_name)
@@ -488,5 +568,8 @@ class Orm(object):
     @classmethod
     def install(cls):
         """install the Orm's table using the Orm's schema"""
+        shards = cls.shards
+        if shards:
+            return all([inter.set_table(cls.schema) for inter in shards.interfaces])
         return cls.interface.set_table(cls.schema)
 
@@ -10,10 +10,16 @@ import logging
 import os
 from contextlib import contextmanager
 import multiprocessing
-from multiprocessing import queues
+import multiprocessing.pool
 import math
 import inspect
+import itertools
 import time
+import hashlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 import threading
 try:
@@ -22,8 +28,10 @@ except ImportError:
     thread = None
 
 from . import decorators
-from .utils import make_list, get_objects, make_dict, make_hash
+from .utils import make_list, get_objects, make_dict, SingleFlight, Rows
 from .interface import get_interfaces
+from .cache import RowCache
+from .hooks import QueryEvent
 from .compat import *
 
 
@@ -185,6 +193,10 @@ class ResultsIterator(BaseIterator):
         for pk in SomeOrm.query.get().pk:
             print pk
     """
+    yielder = None
+    """a callable that wraps the generator of results so green threads can yield
+    while rows are hydrated, see gevent.Yielder"""
+
     def __init__(self, results, orm_class=None, has_more=False, query=None):
         """
         create a result set iterator
@@ -197,8 +209,16 @@ class ResultsIterator(BaseIterator):
         self.results = results
         self.orm_class = orm_class
         self.has_more = has_more
+        # copies don't keep the interface, so grab the one that ran the query
+        self._interface = getattr(query, "_interface", None)
         self.query = query.copy()
         self._values = False
+
+        # tuple rows (utils.Rows) find the position of each field once
+        self.row_hydrator = None
+        if orm_class and isinstance(results, Rows):
+            self.row_hydrator = orm_class.row_hydrator(results.columns)
+
         self.reset()
 
     def reset(self):
@@ -217,6 +237,11 @@ class ResultsIterator(BaseIterator):
         if not self.fcount:
             raise ValueError("no select fields were set, so cannot iterate values")
 
+        # tuple rows (utils.Rows) find the position of each field once
+        index = getattr(self.results, "index", None)
+        if isinstance(index, dict):
+            self.field_indexes = [index.get(fn, None) for fn in self.field_names]
+
         return self
 
     def __iter__(self):
@@ -258,14 +283,55 @@ class ResultsIterator(BaseIterator):
 
     def create_generator(self):
         """put all the pieces together to build a generator of the results"""
-        return (self._get_result(d) for d in self.results)
+        ret = (self._get_result(d) for d in self.results)
+        interface = self._interface
+        if interface and interface.hooks.has("hydrate"):
+            ret = self.hydrate_generator(ret, interface)
+        if self.yielder:
+            ret = self.yielder(ret)
+        return ret
+
+    def hydrate_generator(self, results, interface):
+        """time how long results takes to build each row (not counting the time the
+        caller spends on the row) and tell interface's hydrate hooks once all the
+        rows have been built
+
+        see -- hooks.py
+        """
+        event = QueryEvent(interface, orm_class=self.orm_class, method_name="get")
+        elapsed = 0.0
+        count = 0
+        results = iter(results)
+        while True:
+            start = time.time()
+            try:
+                r = next(results)
+            except StopIteration:
+                break
+            elapsed += time.time() - start
+            count += 1
+            yield r
+
+        event.row_count = count
+        event.timings["hydrate"] = elapsed
+        interface.hooks.fire("hydrate", event)
 
     def _get_result(self, d):
         r = None
+        is_row = isinstance(d, tuple)
         if self._values:
-            field_vals = [d.get(fn, None) for fn in self.field_names]
+            if is_row:
+                field_vals = [None if i is None else d[i] for i in self.field_indexes]
+            else:
+                field_vals = [d.get(fn, None) for fn in self.field_names]
             r = field_vals if self.fcount > 1 else field_vals[0]
 
+        elif is_row:
+            if self.orm_class:
+                r = self.row_hydrator(d)
+            else:
+                r = self.results.row_dict(d)
+
         else:
             if self.orm_class:
                 r = self.orm_class(d, hydrate=True)
@@ -401,6 +467,77 @@ class AllIterator(ResultsIterator):
         return super(AllIterator, self).values()
 
 
+class Fingerprint(object):
+    """Identifies a query by encoding its parts as they are added
+
+    the fingerprint has two halves, the shape is the structure of the query (the
+    fields and the commands), so queries that only differ by their values have
+    the same shape, which is what you want to group queries by for things like
+    metrics, the args are the values, and together they identify a specific query
+    so they can be used as a cache key
+
+    each part is encoded when it is added, so computing the fingerprint of a
+    finished query is just one hash over bytes that are already there instead of
+    stringifying every value of the query
+    """
+    protocol = 2
+    """pickle protocol used to encode the parts, 2 is readable by python 2 and 3"""
+
+    separator = b"|"
+    """put between sections when fingerprints are combined, a pickle never starts
+    with this so the sections can't bleed into each other"""
+
+    @property
+    def shape(self):
+        return hashlib.md5(b"".join(self.shape_parts)).hexdigest()
+
+    @property
+    def args(self):
+        return hashlib.md5(b"".join(self.args_parts)).hexdigest()
+
+    @property
+    def hash(self):
+        """the full fingerprint, suitable for a cache key"""
+        h = hashlib.md5(b"".join(self.shape_parts))
+        h.update(self.separator)
+        h.update(b"".join(self.args_parts))
+        return h.hexdigest()
+
+    def __init__(self):
+        self.shape_parts = []
+        self.args_parts = []
+
+    def update(self, shape, args):
+        """add a part to the fingerprint
+
+        shape -- mixed -- the structural part (eg, field name and command)
+        args -- mixed -- the values of the part
+        """
+        self.shape_parts.append(self.encode(shape))
+        self.args_parts.append(self.encode(args))
+        return self
+
+    def extend(self, fingerprint):
+        """add all the parts of another fingerprint as a new section"""
+        self.shape_parts.append(self.separator)
+        self.shape_parts.extend(fingerprint.shape_parts)
+        self.args_parts.append(self.separator)
+        self.args_parts.extend(fingerprint.args_parts)
+        return self
+
+    def encode(self, val):
+        # pickle is done in C, it keeps types distinct (1 != "1" != True), it
+        # never truncates a long list, and a pickle knows where it ends so the
+        # parts can just be concatenated
+        try:
+            return pickle.dumps(val, self.protocol)
+        except Exception:
+            return pickle.dumps(repr(val), self.protocol)
+
+    def __str__(self):
+        return self.hash
+
+
 class Fields(object):
     def __init__(self):
         self.reset()
@@ -409,11 +546,18 @@ class Fields(object):
         self.fields = []
         self.fields_map = defaultdict(list)
         self.options = {}
+        self.fingerprint = Fingerprint()
 
     def append(self, field_name, field_args):
         index = len(self.fields)
         self.fields.append(field_args)
         self.fields_map[field_name].append(index)
+        self.fingerprint.update(*self.fingerprint_parts(field_args))
+
+    def fingerprint_parts(self, field_args):
+        """split field_args into a (shape, args) tuple for the fingerprint"""
+        field_name, field_val = field_args
+        return field_name, field_val
 
     def __iter__(self):
         for field in self.fields:
@@ -463,6 +607,21 @@ class FieldsWhere(Fields):
 
         return super(FieldsWhere, self).append(field_name, field_args)
 
+    def fingerprint_parts(self, field_args):
+        cmd, field_name, field_val, field_kwargs = field_args
+        kwargs = sorted(field_kwargs.items()) if field_kwargs else []
+        # a None value changes the generated sql (eg, IS NULL) so it's part of
+        # the shape, but the length of an IN list isn't
+        shape = [cmd, field_name, field_val is None, [k for k, _ in kwargs]]
+        return shape, [field_val, kwargs]
+
+
+class FieldsSort(Fields):
+    """The sort fields of a query"""
+    def fingerprint_parts(self, field_args):
+        direction, field_name, field_vals = field_args
+        return [direction, field_name, bool(field_vals)], field_vals
+
 
 class Limit(object):
 
@@ -571,9 +730,29 @@ class Query(object):
     """
     fields_set_class = Fields
     fields_where_class = FieldsWhere
-    fields_sort_class = Fields
+    fields_sort_class = FieldsSort
     bounds_class = Limit
 
+    reduce_range_commands = set(["gt", "gte", "lt", "lte"])
+    """the primary key criteria reduce() can add its ranges to"""
+
+    single_flight = False
+    """True if concurrent identical reads should wait on the first one's result
+    instead of all going to the db, reads in a transaction always go to the db"""
+
+    single_flight_methods = set(["get", "get_one", "count"])
+    """the interface methods single_flight applies to"""
+
+    single_flights = SingleFlight()
+
+    tuple_rows = True
+    """True if get() should fetch rows as tuples (utils.Rows) and build each Orm
+    straight from them, set to False to get the interface's dict rows"""
+
+    replica_methods = set(["get", "get_one", "count"])
+    """the interface methods that go to the interface's read replicas if it has
+    any, see replica.py and primary()"""
+
     @property
     def interface(self):
         if not self.orm_class: return None
@@ -594,6 +773,12 @@ class Query(object):
         except AttributeError:
             pass
 
+    @property
+    def shards(self):
+        """the shard.Shards the orm_class's rows are split across, None if they
+        all live on one interface"""
+        return getattr(self.orm_class, "shards", None)
+
     @property
     def schema(self):
         if not self.orm_class: return None
@@ -992,6 +1177,12 @@ class Query(object):
         self.bounds.page = page
         return self
 
+    def primary(self):
+        """read from the primary even if the interface has read replicas, for
+        reads that can't be even a little bit behind"""
+        self.replica_methods = set()
+        return self
+
     def cursor(self, limit=None, page=None):
         # TODO -- combine the common parts of this method and get()
         has_more = False
@@ -1016,12 +1207,24 @@ class Query(object):
 
         return -- Iterator()
         """
-        has_more = False
+        limit_paginate = self._get_prepare(limit, page)
+        results = self._query('get')
+        return self._get_iterator(results, limit_paginate)
+
+    def _get_prepare(self, limit, page):
+        """set up the query for get(), this is split out of get() so other ways of
+        fetching the rows (like prom.aio) can share it
+
+        return -- int -- the limit plus the one extra row that tells if there are more
+        """
         self.bounds.paginate = True
         limit_paginate, offset = self.bounds.get(limit, page)
         self.default_val = []
-        results = self._query('get')
+        return limit_paginate
 
+    def _get_iterator(self, results, limit_paginate):
+        """wrap the rows fetched for get() in an iterator"""
+        has_more = False
         if limit_paginate:
             self.bounds.paginate = False
             if len(results) == limit_paginate:
@@ -1107,6 +1310,15 @@ class Query(object):
         """convenience method for running desc__id().get_one()"""
         return self.desc__id().get_one()
 
+    def explain(self, analyze=False):
+        """return the db's plan for the query get() would run
+
+        analyze -- boolean -- True to run the query and have the plan include what
+            actually happened (Postgres only, SQLite always gives the estimated plan)
+        return -- list -- the lines of the plan
+        """
+        return self._interface_query("explain", analyze=analyze)
+
     def count(self):
         """return the count of the criteria"""
 
@@ -1133,6 +1345,10 @@ class Query(object):
         #fields = self.fields
         #fields = self.orm_class.depart(self.fields, is_update=False)
         #self.set_fields(fields)
+        shards = self.shards
+        if shards:
+            return shards.insert(self)
+
         return self.interface.insert(
             self.schema,
             self.fields
@@ -1146,6 +1362,10 @@ class Query(object):
         #fields = self.fields
         #fields = self.orm_class.depart(self.fields, is_update=True)
         #self.set_fields(fields)
+        shards = self.shards
+        if shards:
+            return shards.update(self)
+
         return self.interface.update(
             self.schema,
             self.fields,
@@ -1175,8 +1395,81 @@ class Query(object):
         i = self.interface
         return i.query(query_str, *query_args, **query_options)
 
-    def reduce(self, target_map, target_reduce, threads=0):
-        """map/reduce this query among a bunch of processes
+    def aget(self, limit=None, page=None):
+        """awaitable get()
+
+        see -- aio.py
+        """
+        return self._aquery("get", limit, page)
+
+    def aall(self):
+        """return an async iterator of every result for this query
+
+        example --
+            async for o in Foo.query.is_bar(1).aall():
+                pass
+
+        see -- aio.py
+        """
+        from . import aio
+        return aio.AllIterator(self)
+
+    def aget_one(self):
+        """awaitable get_one()"""
+        return self._aquery("get_one")
+
+    def avalues(self, limit=None, page=None):
+        """awaitable values()"""
+        return self._aquery("values", limit, page)
+
+    def aget_pks(self, field_vals):
+        """awaitable get_pks()"""
+        return self._aquery("get_pks", list(field_vals))
+
+    def aget_pk(self, field_val):
+        """awaitable get_pk()"""
+        return self._aquery("get_pk", field_val)
+
+    def acount(self):
+        """awaitable count()"""
+        return self._aquery("count")
+
+    def ahas(self):
+        """awaitable has()"""
+        return self._aquery("has")
+
+    def ainsert(self):
+        """awaitable insert()"""
+        return self._aquery("insert")
+
+    def aupdate(self):
+        """awaitable update()"""
+        return self._aquery("update")
+
+    def adelete(self):
+        """awaitable delete()"""
+        return self._aquery("delete")
+
+    def _aquery(self, method_name, *args, **kwargs):
+        from . import aio
+        return aio.get_runner(self.interface).query(self, method_name, *args, **kwargs)
+
+    def reduce(self, target_map, target_reduce, threads=0, mode="process", chunk_size=10000, timeout=600):
+        """map/reduce this query among a bunch of processes (or threads)
+
+        the rows are split up into primary key ranges of chunk_size rows each, each
+        worker maps one range at a time and sends back all the non None values of
+        the range at once, target_reduce is called on this (the main) process.
+        Ranges are found as they are needed and only so many are handed out ahead
+        of target_reduce, so a slow reduce holds the workers back instead of piling
+        up values
+
+        the rows are mapped in primary key order, a limit or offset picks the rows
+        in that order, so a query that is sorted some other way and has a limit or
+        offset raises a ValueError instead of mapping different rows. A query that
+        lists its primary keys (eg, in_pk()) is split up by those pks instead, and
+        a query with other primary key criteria a range can't be added to (eg,
+        nin_pk()) is mapped by one worker
 
         :param target_map: callable, this function will be called once for each 
             row this query pulls out of the db, if you want something about the row
@@ -1184,98 +1477,496 @@ class Query(object):
             and it will be queued for the target_reduce function to process it
         :param target_reduce: callable, this function will be called for any non 
             None value that the target_map function returns
-        :param threads: integer, if not passed in this will be pegged to how many
-            cpus python detects, which is almost always what you want
+        :param threads: integer, how many workers to use, if not passed in this will
+            be pegged to how many cpus python detects, which is almost always what
+            you want
+        :param mode: string, "process" to map in child processes, or "thread" to
+            map in threads when target_map spends its time waiting on io
+        :param chunk_size: integer, how many rows each range covers
+        :param timeout: float, how many seconds to wait for a range to be mapped,
+            a worker process that dies (eg, it was killed for using too much memory)
+            never sends back its range, 0 or None to wait forever
         """
         if not threads:
             threads = multiprocessing.cpu_count()
 
-        # we subtract one for the main process
-        map_threads = threads - 1 if threads > 1 else 1
+        if mode == "process":
+            # we subtract one for the main process
+            workers = threads - 1 if threads > 1 else 1
+        elif mode == "thread":
+            workers = threads
+        else:
+            raise ValueError("unknown reduce mode {}".format(mode))
 
         q = self.copy()
-        limit = q.bounds.limit
-        offset = q.bounds.offset
+        ranges = self.reduce_ranges(q, chunk_size)
+        r = next(ranges, None)
+        if r is None:
+            return
+        ranges = itertools.chain([r], ranges)
+
+        worker = ReduceWorker(target_map, q)
+        if mode == "process":
+            # close all open db global connections just in case, because we can't be sure
+            # what the target_map methods are going to do, we want them to re-open connections
+            # that they need
+            interfaces = get_interfaces()
+            for name, inter in interfaces.items():
+                inter.close()
+
+            # just in case we also close the query connection since it can in theory
+            # be non-global
+            q.interface.close()
+
+            pool = multiprocessing.Pool(workers, initializer=reduce_init, initargs=(worker,))
+            task = reduce_range
 
-        total_count = limit if limit else q.count()
-        limit_count = int(math.ceil(float(total_count) / float(map_threads)))
-        logger.info("{} processes will handle {} rows each for a total of {}".format(
-            map_threads,
-            limit_count,
-            total_count
-        ))
-
-        queue = multiprocessing.JoinableQueue()
-
-        # close all open db global connections just in case, because we can't be sure
-        # what the target_map methods are going to do, we want them to re-open connections
-        # that they need
-        interfaces = get_interfaces()
-        for name, inter in interfaces.items():
-            inter.close()
+        else:
+            pool = multiprocessing.pool.ThreadPool(workers)
+            task = worker
+
+        logger.info("{} {}es will map {} rows at a time".format(workers, mode, chunk_size))
+
+        done = queue.Queue()
+        kwargs = {"callback": done.put}
+        if not is_py2:
+            # the task itself catches map errors, this catches anything else, like
+            # a result that couldn't be pickled
+            kwargs["error_callback"] = lambda e: done.put((None, e))
+
+        pending = 0
+        try:
+            for r in ranges:
+                pool.apply_async(task, r, **kwargs)
+                pending += 1
+                if pending >= workers * 2:
+                    pending -= self.reduce_values(done, target_reduce, timeout)
+
+            while pending:
+                pending -= self.reduce_values(done, target_reduce, timeout)
+
+        except:
+            pool.terminate()
+            raise
+
+        else:
+            pool.close()
 
-        # just in case we also close the query connection since it can in theory
-        # be non-global
-        q.interface.close()
-
-        ts = []
-        for page in range(map_threads):
-            q = self.copy()
-            q.limit(limit_count).offset(offset + (limit_count * page))
-            t = ReduceThread(
-                target=target_map,
-                query=q,
-                queue=queue,
+        finally:
+            pool.join()
+            worker.close()
+
+    def reduce_ranges(self, q, chunk_size):
+        """find the primary key ranges reduce() will split q into, each range is
+        found by paging through the primary keys q matches, so every range has
+        chunk_size rows (the last one can have less) no matter how sparse they are
+
+        if q lists its primary keys (is_pk() or in_pk()) they are split into chunks
+        of chunk_size pks instead, and if q has primary key criteria that a range
+        can't be added to (eg, nin_pk()) it is one (None, None) range that maps q
+        as it is
+
+        :returns: generator, yields (start_pk, stop_pk) or (None, None, pks) tuples,
+            see ReduceWorker.map(), the limit and offset of q are moved into the
+            ranges
+        """
+        pk_name = self.schema.pk.name
+        pk_where = q.fields_where.get(pk_name)
+        if any(f[0] not in self.reduce_range_commands for f in pk_where):
+            cmd, _, val, field_kwargs = pk_where[0]
+            if cmd in ("is", "in") and val is not None and not field_kwargs and not q.bounds:
+                pks = []
+                for pk in make_list(val):
+                    if pk not in pks:
+                        pks.append(pk)
+
+                for i in range(0, len(pks), chunk_size):
+                    yield (None, None, pks[i:i + chunk_size])
+
+            else:
+                yield (None, None)
+            return
+
+        sort = [f for f in q.fields_sort if f[1] != pk_name or f[0] < 0 or f[2]]
+        if sort and q.bounds:
+            raise ValueError(
+                "reduce() maps rows in primary key order so it can't limit a query sorted by {}".format(
+                    ", ".join(f[1] for f in sort)
+                )
             )
-            t.start()
-            ts.append(t)
 
-        while ts or not queue.empty():
-            try:
-                val = queue.get(True, 1.0)
-                target_reduce(val)
+        pq = q.copy()
+        pq.fields_sort = pq.fields_sort_class()
+        pq.bounds = pq.bounds_class()
+        remaining = q.bounds.limit or None
+        offset = q.bounds.offset
+        q.bounds = q.bounds_class()
 
-            except queues.Empty:
-                pass
+        stop_pk = None
+        while remaining is None or remaining > 0:
+            page_size = chunk_size if remaining is None else min(chunk_size, remaining)
 
+            page = pq.copy().asc_pk().limit(page_size)
+            if stop_pk is None:
+                if offset:
+                    page.offset(offset)
             else:
-                queue.task_done()
+                page.gt_pk(stop_pk)
 
-            # faster than using any((t.is_alive() for t in mts))
-            ts = [t for t in ts if t.is_alive()]
+            pks = list(page.pks())
+            if not pks:
+                break
 
-    def watch(self, interval=60, timeout=0, cursor_field_name="pk"):
-        inter = self.interface.spawn()
-        start = time.time()
+            stop_pk = pks[-1]
+            yield (pks[0], stop_pk)
+
+            if len(pks) < page_size:
+                break
+
+            if remaining is not None:
+                remaining -= len(pks)
+
+    def reduce_query(self, start_pk=None, stop_pk=None, pks=None):
+        """return a copy of this query that only matches the rows of one
+        reduce_ranges() range, the range is always inside this query's primary key
+        criteria so it takes their place, a field can only be set once in a where
 
+        :param start_pk: the first primary key of the range
+        :param stop_pk: the last primary key of the range
+        :param pks: list, the primary keys of a query that lists them
+        :returns: Query
+        """
+        q = self.copy()
+        if pks is None and start_pk is None and stop_pk is None:
+            return q
+
+        pk_name = self.schema.pk.name
+        fields_where = q.fields_where_class()
+        for field in q.fields_where:
+            if field[1] != pk_name:
+                fields_where.append(field[1], field)
+        q.fields_where = fields_where
+
+        if pks is None:
+            q.between_pk(start_pk, stop_pk)
+        else:
+            q.in_pk(pks)
+        return q
+
+    def reduce_values(self, done, target_reduce, timeout=None):
+        """wait for a range to finish mapping and reduce its values
+
+        :param timeout: float, seconds to wait for the range
+        :returns: int, how many ranges were reduced, always 1
+        """
+        try:
+            vals, e = done.get(timeout=timeout or None)
+
+        except queue.Empty:
+            raise multiprocessing.TimeoutError(
+                "No mapped range came back in {} seconds".format(timeout)
+            )
+
+        if e is not None:
+            raise e
+
+        for val in vals:
+            target_reduce(val)
+        return 1
+
+    def watch(self, interval=60, timeout=0, cursor_field_name="pk", notify=True, batch_size=1000):
+        """yield every row this query matches and then keep yielding rows as they
+        are inserted or updated
+
+        If the interface can_notify (Postgres) and the table's notify trigger was
+        installed with interface.set_notify(schema), the primary key of every
+        inserted or updated row is sent to a connection that isn't in the
+        interface's pool and watch wakes up as soon as a notification comes in.
+        Otherwise the query is polled every interval seconds for rows with a bigger
+        cursor_field_name (new rows) and, if the orm has an _updated field, for
+        rows with a newer _updated value.
+
+        A row can be yielded more than once, each time it changes and possibly
+        twice if it changed while watch was starting up.
+
+        interval -- float -- seconds between polls, when notifications are used
+            this is only how often timeout is checked
+        timeout -- float -- stop watching after this many seconds, 0 watches forever
+        cursor_field_name -- string -- the always increasing field polling uses to
+            find new rows
+        notify -- boolean -- False to poll even if the interface can_notify (eg,
+            LISTEN doesn't work through pgbouncer's transaction pooling)
+        batch_size -- int -- the most changed rows that are fetched at one time
+        """
         # we want a new connection for this
+        inter = self.interface.spawn()
         try:
-            cursor_field_val = None
-            while True:
-                query = self.copy()
-                query.interface = inter
-                if cursor_field_val is not None:
-                    query.gt_field(cursor_field_name, cursor_field_val)
+            if notify and inter.has_notify(self.schema):
+                it = self.watch_notify(inter, interval, timeout, batch_size)
 
-                for instance in query.get():
-                    yield instance
-                    cursor_field_val = getattr(instance, cursor_field_name)
+            else:
+                it = self.watch_poll(inter, interval, timeout, cursor_field_name, batch_size)
 
-                time.sleep(interval)
-                stop = time.time()
-                if timeout:
-                    if (stop - start) > timeout:
-                        break
+            for instance in it:
+                yield instance
 
         finally:
             inter.close()
 
+    def watch_query(self, inter, *sort_field_names):
+        """return a copy of this query that watch can add its own criteria to, if
+        sort_field_names are passed in they replace the query's sort"""
+        query = self.copy().primary()
+        query.interface = inter
+        query.bounds = query.bounds_class()
+        if sort_field_names:
+            query.fields_sort = query.fields_sort_class()
+            for field_name in sort_field_names:
+                query.asc_field(field_name)
+        return query
+
+    def watch_pks(self, query, pks):
+        """split query's own primary key criteria off so the notified pks can be
+        added to it, a field can only be set once in a where
+
+        :param query: Query, a watch_query() copy, its pk criteria are removed
+        :param pks: list, the notified primary keys
+        :returns: list, the pks that match query's pk criteria
+        """
+        pk_name = self.schema.pk.name
+        where = query.fields_where
+        if pk_name not in where:
+            return pks
+
+        ops = {
+            "is": lambda pk, v: pk == v,
+            "not": lambda pk, v: pk != v,
+            "in": lambda pk, v: pk in v,
+            "nin": lambda pk, v: pk not in v,
+            "gt": lambda pk, v: pk > v,
+            "gte": lambda pk, v: pk >= v,
+            "lt": lambda pk, v: pk < v,
+            "lte": lambda pk, v: pk <= v,
+        }
+        pk_type = self.schema.pk.type
+        fields_where = query.fields_where_class()
+        criteria = []
+        for field in where:
+            if field[1] == pk_name:
+                cmd, _, val, _ = field
+                if cmd not in ops:
+                    raise ValueError("watch() can't check {}_{} criteria".format(cmd, pk_name))
+                if cmd in ("in", "nin"):
+                    val = set(pk_type(v) for v in val)
+                else:
+                    val = pk_type(val)
+                criteria.append((ops[cmd], val))
+
+            else:
+                fields_where.append(field[1], field)
+
+        query.fields_where = fields_where
+        return [pk for pk in pks if all(op(pk, val) for op, val in criteria)]
+
+    def watch_notify(self, inter, interval, timeout, batch_size):
+        """watch() by waiting on the notifications of changed primary keys
+
+        inter only holds the LISTEN connection, the rows are read with the
+        query's interface so they don't wait on the listening connection
+        """
+        start = time.time()
+        schema = self.schema
+        pk_name = schema.pk.name
+        # fail now if the query's pk criteria can't be checked
+        self.watch_pks(self.watch_query(self.interface), [])
+        with inter.connection() as connection:
+            # listening starts before the existing rows are read so nothing that
+            # changes in between is missed
+            inter.listen(schema, connection=connection)
+            for instance in self.watch_query(self.interface).all():
+                yield instance
+
+            while True:
+                wait = interval
+                if timeout:
+                    wait = min(wait, timeout - (time.time() - start))
+                    if wait <= 0:
+                        break
+
+                pks = inter.notifications(schema, wait, connection=connection)
+                if pks:
+                    # a row that changed a bunch of times only needs to be read once
+                    seen = set()
+                    pks = [pk for pk in pks if not (pk in seen or seen.add(pk))]
+                    query = self.watch_query(self.interface)
+                    pks = self.watch_pks(query, pks)
+                    for i in range(0, len(pks), batch_size):
+                        q = query.copy().in_field(pk_name, pks[i:i + batch_size])
+                        for instance in q.get():
+                            yield instance
+
+    def watch_poll(self, inter, interval, timeout, cursor_field_name, batch_size):
+        """watch() by polling every interval seconds
+
+        new rows are the rows with a bigger cursor_field_name, if the orm has an
+        _updated field then the rows that were already read are checked for a newer
+        _updated value. Both are read in pages that start right after the last row
+        read, so a page never has to skip over rows that were already returned
+        """
+        start = time.time()
+        has_updated = "_updated" in self.schema.fields
+        cursor = None
+        updated = None # (_updated, pk) of the last change read
+        reading = True # still reading the rows that existed when watch started
+        fresh = {} # pk: _updated of the new rows the last poll read
+        while True:
+            seen = cursor
+            query = self.watch_query(inter, cursor_field_name)
+            if cursor is not None:
+                query.gt_field(cursor_field_name, cursor)
+
+            instances = list(query.get(batch_size))
+            new = {}
+            for instance in instances:
+                cursor = getattr(instance, cursor_field_name)
+                if has_updated:
+                    key = (instance._updated, instance.pk)
+                    if reading:
+                        if updated is None or key > updated:
+                            updated = key
+                    else:
+                        new[instance.pk] = instance._updated
+                yield instance
+
+            more = len(instances) == batch_size
+            if not more and cursor is not None:
+                reading = False
+
+            if has_updated and not reading and seen is not None:
+                for instance in self.watch_updates(inter, cursor_field_name, seen, updated, batch_size):
+                    updated = (instance._updated, instance.pk)
+                    # a new row shows up here too since it is newer than the
+                    # cursor, it only needs to be yielded again if it changed
+                    if fresh.get(instance.pk) != instance._updated:
+                        yield instance
+            fresh = new
+
+            if not more:
+                if timeout and (time.time() - start) > timeout:
+                    break
+                time.sleep(interval)
+
+    def watch_updates(self, inter, cursor_field_name, seen, updated, batch_size):
+        """yield the rows up to seen that changed after updated in (_updated, pk)
+        order, the rows that have updated's _updated value are finished first"""
+        pk_name = self.schema.pk.name
+        while True:
+            instances = []
+            if updated is not None:
+                query = self.watch_query(inter, pk_name)
+                query.lte_field(cursor_field_name, seen)
+                query.is_field("_updated", updated[0]).gt_field(pk_name, updated[1])
+                instances = list(query.get(batch_size))
+
+            more = bool(instances)
+            if not instances:
+                query = self.watch_query(inter, "_updated", pk_name)
+                query.lte_field(cursor_field_name, seen)
+                if updated is not None:
+                    query.gt_field("_updated", updated[0])
+                instances = list(query.get(batch_size))
+                more = len(instances) == batch_size
+
+            for instance in instances:
+                updated = (instance._updated, instance.pk)
+                yield instance
+
+            if not more:
+                break
+
     def _query(self, method_name, **kwargs):
         if not self.can_get: return self.default_val
-        i = self.interface
+        if self.single_flight and not kwargs and method_name in self.single_flight_methods:
+            key = self.single_flight_key(self.fingerprint(method_name).hash)
+            if key:
+                result, shared = self.single_flights.do(key, self._interface_query, method_name)
+                return self._single_flight_result(result, shared)
+
+        return self._interface_query(method_name, **kwargs)
+
+    def single_flight_key(self, key):
+        """return the key concurrent callers of the same read share, or empty if
+        this read shouldn't be shared
+
+        a read in a transaction can see the transaction's uncommitted writes, so it
+        is never shared, and reads on different connections never share a result
+
+        :param key: string, identifies the read in its table
+        :returns: string
+        """
+        if not self.single_flight: return ""
+
+        inter = self.interface
+        if inter.get_pinned_connection(): return ""
+
+        config = inter.connection_config
+        return "{}:{}:{}".format(config.name if config else "", self.schema, key)
+
+    def _interface_query(self, method_name, **kwargs):
+        if method_name == "get" and self.tuple_rows and not kwargs.get("cursor_result", False):
+            kwargs["tuple_result"] = True
+
+        shards = self.shards
+        if shards:
+            return shards.query(self, method_name, **kwargs)
+
+        return self._interface_call(self.interface, method_name, **kwargs)
+
+    def _interface_call(self, i, method_name, **kwargs):
+        """run i.method_name(schema, query, **kwargs), or on one of i's read replicas"""
         s = self.schema
+        if method_name in self.replica_methods:
+            replicas = i.get_replicas()
+            if replicas:
+                return replicas.query(method_name, s, self, **kwargs)
+
         return getattr(i, method_name)(s, self, **kwargs) # i.method_name(schema, query)
 
+    def _single_flight_result(self, result, shared):
+        # get() pops the extra pagination row off the result list, so every caller
+        # needs its own list
+        if shared and isinstance(result, list):
+            result = copy.copy(result)
+        return result
+
+    def fingerprint(self, method_name=""):
+        """return a Fingerprint that identifies this query
+
+        the fingerprint's shape is the same for every query that has the same
+        structure, and its hash identifies this exact query
+
+        method_name -- string -- the interface method the query will be passed to
+        return -- Fingerprint
+        """
+        fs = self.fields_set
+        b = self.bounds
+        fp = Fingerprint()
+        fp.update(
+            [
+                method_name,
+                str(self.schema) if self.orm_class else "",
+                sorted(fs.options.items()),
+                b.has_limit(),
+                b.offset > 0,
+                b.paginate,
+            ],
+            [b.limit, b.offset]
+        )
+        fp.extend(fs.fingerprint)
+        fp.extend(self.fields_where.fingerprint)
+        fp.extend(self.fields_sort.fingerprint)
+        return fp
+
     def copy(self):
         """nice handy wrapper around the deepcopy"""
         return copy.deepcopy(self)
@@ -1289,46 +1980,86 @@ class Query(object):
         return instance
 
 
-class ReduceThread(multiprocessing.Process):
-    """Runs one of the reduce processes created in Query.reduce()
+class ReduceWorker(object):
+    """Maps one primary key range of the rows Query.reduce() is going through, each
+    worker process or thread opens its own connection
 
     You probably don't need to worry about this class
     """
-    def __init__(self, target, query, queue):
+    def __init__(self, target, query):
+        self.target = target
+        self.query = query
+        self.local = threading.local()
+        self.interfaces = []
+
+    def get_interface(self):
+        interface = getattr(self.local, "interface", None)
+        if interface is None:
+            interface = self.query.interface.spawn()
+            self.local.interface = interface
+            self.interfaces.append(interface)
+        return interface
 
-        name = "Reduce-{}to{}".format(
-            query.bounds.offset,
-            query.bounds.offset + query.bounds.limit
-        )
+    def close(self):
+        """close the interfaces the worker threads opened, a worker process's
+        interface goes away with the process"""
+        while self.interfaces:
+            interface = self.interfaces.pop()
+            try:
+                interface.close()
 
-        logger.debug("Starting process: {}".format(name))
-
-        def wrapper_target(target, query, queue):
-            # create a new connection just for this thread
-            #query.interface = query.interface.spawn()
-            for orm in query.all():
-                val = target(orm)
-                if val:
-                    try:
-                        # queue size taps out at 32767, booooo
-                        # http://stackoverflow.com/questions/5900985/multiprocessing-queue-maxsize-limit-is-32767
-                        #queue.put_nowait(val)
-                        queue.put(val, True, 1.0)
-                    except queues.Full as e:
-                        logger.exception(e)
-                        #queue.close()
-                        # If we ever hit a full queue you lose a ton of data but if you
-                        # don't call this method then the process just hangs
-                        queue.cancel_join_thread()
-                        break
+            except Exception as e:
+                # a SQLite connection can only be closed by the thread that
+                # opened it, it closes once the interface is garbage collected
+                logger.debug("Could not close reduce interface: {}".format(e))
+
+    def __call__(self, start_pk, stop_pk, pks=None):
+        """map the range
+
+        :returns: tuple, (values, None), or (None, exception) if mapping failed
+        """
+        try:
+            return self.map(start_pk, stop_pk, pks), None
+
+        except Exception as e:
+            logger.exception(e)
+            return None, e
 
-            query.interface.close()
+    def map(self, start_pk, stop_pk, pks=None):
+        """map the rows of one Query.reduce_ranges() range
 
-        super(ReduceThread, self).__init__(target=wrapper_target, name=name, kwargs={
-            "target": target,
-            "query": query,
-            "queue": queue,
-        })
+        :param start_pk: the first primary key of the range, None with stop_pk
+            to map the whole query
+        :param stop_pk: the last primary key of the range
+        :param pks: list, the primary keys to map instead of a range
+        :returns: list, the values target returned that aren't None
+        """
+        q = self.query.reduce_query(start_pk, stop_pk, pks)
+        q.interface = self.get_interface()
+        results = q.get()
+
+        ret = []
+        target = self.target
+        for orm in results:
+            val = target(orm)
+            if val is not None:
+                ret.append(val)
+        return ret
+
+
+reduce_worker = None
+"""the ReduceWorker of a Query.reduce() child process"""
+
+
+def reduce_init(worker):
+    """runs when each Query.reduce() child process starts"""
+    global reduce_worker
+    reduce_worker = worker
+
+
+def reduce_range(start_pk, stop_pk, pks=None):
+    """map a range of rows in a Query.reduce() child process"""
+    return reduce_worker(start_pk, stop_pk, pks)
 
 
 class BaseCacheQuery(Query):
@@ -1347,7 +2078,15 @@ class BaseCacheQuery(Query):
 
     A child class will have to implement the methods that raise NotImplementedError
     in order to have a valid CacheQuery child
+
+    if single_flight is True, concurrent cache misses on the same key are
+    deduplicated, the first caller queries the db and fills the cache while
+    everyone else waits for its result
     """
+    cache_set_shared = False
+    """True if callers that got their result from another caller's cache miss
+    should also call cache_set(), needed if the cache isn't shared between callers"""
+
     def cache_delete(self, method_name):
         method = getattr(self, "cache_delete_{}".format(method_name), None)
         if method:
@@ -1362,6 +2101,9 @@ class BaseCacheQuery(Query):
 
         return key
 
+    def cache_hash(self, method_name):
+        return self.fingerprint(method_name).hash
+
     def cache_set(self, key, result):
         raise NotImplementedError()
 
@@ -1371,9 +2113,9 @@ class BaseCacheQuery(Query):
         the cache, otherwise False"""
         raise NotImplementedError()
 
-    def _query(self, method_name):
+    def _query(self, method_name, **kwargs):
         cache_hit = False
-        cache_key = self.cache_key(method_name)
+        cache_key = "" if kwargs else self.cache_key(method_name)
         table_name = str(self.schema)
         if cache_key:
             logger.debug("Cache check on {} for key {}".format(table_name, cache_key))
@@ -1381,14 +2123,41 @@ class BaseCacheQuery(Query):
 
         if not cache_hit:
             logger.debug("Cache miss on {} for key {}".format(table_name, cache_key))
-            result = super(BaseCacheQuery, self)._query(method_name)
-            if cache_key:
-                self.cache_set(cache_key, result)
+            single_flight_key = self.single_flight_key(cache_key) if cache_key else ""
+            if single_flight_key:
+                # everyone who misses on this key at the same time waits for the
+                # first one to fill it rather than all going to the db
+                result, shared = self.single_flights.do(
+                    single_flight_key,
+                    self._cache_fill,
+                    method_name,
+                    cache_key
+                )
+                result = self._single_flight_result(result, shared)
+                if shared and self.cache_set_shared:
+                    self.cache_set(cache_key, result)
+
+            elif cache_key:
+                result = self._cache_fill(method_name, cache_key)
+
+            else:
+                result = super(BaseCacheQuery, self)._query(method_name, **kwargs)
 
         else:
             logger.debug("Cache hit on {} for key {}".format(table_name, cache_key))
 
         self.cache_hit = cache_hit
+        if cache_key:
+            interface = self.interface
+            if interface.hooks.has("cache"):
+                event = QueryEvent(interface, self.orm_class, method_name, self)
+                event.cache_hit = cache_hit
+                interface.hooks.fire("cache", event)
+        return result
+
+    def _cache_fill(self, method_name, cache_key):
+        result = super(BaseCacheQuery, self)._query(method_name)
+        self.cache_set(cache_key, result)
         return result
 
     def update(self):
@@ -1487,6 +2256,9 @@ class CacheQuery(BaseCacheQuery):
     _cache_namespace = CacheNamespace()
     """store the cached values in memory"""
 
+    cache_set_shared = True
+    """the cache is namespaced by thread, so each thread has to fill its own"""
+
     @decorators.classproperty
     def cache_namespace(cls):
         return cls._cache_namespace
@@ -1523,16 +2295,6 @@ class CacheQuery(BaseCacheQuery):
     def cache_delete_delete(self):
         self.cache_table.clear()
 
-    def cache_hash(self, method_name):
-        key = make_hash(
-            method_name,
-            self.fields_set,
-            self.fields_where,
-            self.fields_sort,
-            self.bounds
-        )
-        return key
-
     def cache_key_get_one(self):
         return self.cache_hash("get_one")
 
@@ -1571,3 +2333,292 @@ class CacheQuery(BaseCacheQuery):
             ret = super(CacheQuery, self).cache_key(method_name)
         return ret
 
+
+class SharedCacheQuery(BaseCacheQuery):
+    """a CacheQuery that stores its values in a cache.Backend so the cache can be
+    shared by every process that uses the same backend
+
+    invalidation uses a per table generation number stored in the backend, any
+    insert, update, or delete increments the generation for the table, which
+    changes the key of every cached value for that table in every process. The
+    generation is incremented once the write's transaction commits, otherwise
+    another process could cache the rows from before the commit in the new
+    generation, and queries in a transaction don't use the cache at all since
+    they can see rows that aren't committed yet
+
+    example --
+        from prom.cache import SQLiteBackend
+
+        class Foo(prom.Orm):
+            query_class = prom.SharedCacheQuery
+
+        Foo.query_class.cache_configure(SQLiteBackend("/tmp/prom-cache.sqlite"), ttl=60)
+    """
+    cache_backend = None
+    """cache.Backend -- where the values are stored, caching is off if this is None"""
+
+    cache_ttl = 60
+    """how many seconds a cached value should live"""
+
+    @classmethod
+    def cache_configure(cls, backend, ttl=None):
+        cls.cache_backend = backend
+        if ttl is not None:
+            cls.cache_ttl = int(ttl)
+
+    def cache_key(self, method_name):
+        """the key has the table's generation in it, so a lookup gets the
+        generation once and its miss is set in the generation it looked in"""
+        ret = ""
+        if self.cache_backend and not self.interface.get_pinned_connection():
+            ret = super(SharedCacheQuery, self).cache_key(method_name)
+            if ret:
+                ret = self.cache_backend.value_key(str(self.schema), ret)
+        return ret
+
+    def cache_delete(self, method_name):
+        if self.cache_backend:
+            super(SharedCacheQuery, self).cache_delete(method_name)
+
+    def cache_key_get_one(self):
+        return self.cache_hash("get_one")
+
+    def cache_key_get(self):
+        return self.cache_hash("get")
+
+    def cache_key_count(self):
+        return self.cache_hash("count")
+
+    def cache_set(self, key, result):
+        self.cache_backend.set_value(key, result, self.cache_ttl)
+
+    def cache_get(self, key):
+        return self.cache_backend.get_value(key)
+
+    def cache_invalidate(self):
+        backend = self.cache_backend
+        table_name = str(self.schema)
+        self.interface.on_commit(lambda: backend.invalidate(table_name))
+
+    def cache_delete_update(self):
+        self.cache_invalidate()
+
+    def cache_delete_insert(self):
+        self.cache_invalidate()
+
+    def cache_delete_delete(self):
+        self.cache_invalidate()
+
+
+class RowCacheQuery(Query):
+    """a Query that keeps an in process LRU of rows keyed by primary key that
+    get_pk() and get_pks() check first, only the primary keys that aren't cached
+    are fetched from the db, and primary keys that aren't in the db are remembered
+    so they don't keep hitting the db either
+
+    writes through this class keep the cache current: updates by primary key are
+    written through to the cached rows, deletes by primary key remember the rows
+    as missing, and any other update or delete clears the table's cache. Writes
+    in a transaction remove the rows, and remove them again once the transaction
+    commits, so a row another thread read before the commit isn't kept. Each
+    connection has its own caches. Writes that don't go through this class (eg, raw queries or other processes) won't
+    be seen until the rows expire, so set row_cache_ttl if that is a concern
+
+    example --
+        class Foo(prom.Orm):
+            query_class = prom.RowCacheQuery
+
+        Foo.query.get_pk(1) # hits the db
+        Foo.query.get_pk(1) # comes from the cache
+        Foo.query.get_pks([1, 2]) # only 2 is fetched from the db
+    """
+    row_cache_size = 10000
+    """how many rows of each table to keep, 0 for unbounded"""
+
+    row_cache_ttl = 0
+    """how many seconds a cached row is good for, 0 for forever"""
+
+    row_cache_missing_ttl = 60
+    """how many seconds a missing primary key is remembered, 0 for forever"""
+
+    _row_caches = {}
+    """(connection name, table name) -> RowCache"""
+    _row_caches_lock = threading.Lock()
+
+    @property
+    def row_cache(self):
+        """return the cache.RowCache for this query's table on its connection"""
+        config = self.interface.connection_config
+        key = (config.name if config else "", str(self.schema))
+        rc = self._row_caches.get(key, None)
+        if rc is None:
+            with self._row_caches_lock:
+                rc = self._row_caches.get(key, None)
+                if rc is None:
+                    rc = RowCache(
+                        size=self.row_cache_size,
+                        ttl=self.row_cache_ttl,
+                        missing_ttl=self.row_cache_missing_ttl,
+                    )
+                    self._row_caches[key] = rc
+        return rc
+
+    def row_cache_written(self, callback):
+        """call callback() to change the row cache after a write, and if this
+        thread is in a transaction call it again once the transaction commits,
+        a reader outside the transaction could cache the committed rows from
+        before the write in between"""
+        callback()
+        inter = self.interface
+        if inter.get_pinned_connection():
+            inter.on_commit(callback)
+
+    def row_cacheable(self):
+        """True if this query can be answered by the row cache"""
+        return not self.fields_set \
+            and not self.fields_where \
+            and not self.fields_sort \
+            and not self.bounds \
+            and not self.row_cache_in_transaction()
+
+    def row_cache_in_transaction(self):
+        """True if this thread is in a transaction on the query's interface, a
+        thread in a transaction always has a pinned connection so this doesn't
+        check a connection out of the pool"""
+        connection = self.interface.get_pinned_connection()
+        return bool(connection and connection.in_transaction())
+
+    def row_cache_pks(self):
+        """return the primary keys this query's where clause is limited to, or None
+        if the where clause isn't just primary keys"""
+        ret = None
+        fw = self.fields_where
+        pk_name = self.schema.pk.name
+        if len(fw) == 1 and pk_name in fw:
+            cmd, field_name, field_val, field_kwargs = fw[0]
+            if not field_kwargs:
+                if cmd == "is":
+                    ret = [field_val]
+                elif cmd == "in":
+                    ret = list(field_val)
+        return ret
+
+    def normalize_pk(self, pk):
+        """make pk the same type as the primary keys that come out of the db, if it
+        can't be made that type then None is returned"""
+        try:
+            return self.schema.pk.type(pk)
+        except (TypeError, ValueError):
+            return None
+
+    def get_pks(self, field_vals):
+        field_vals = list(field_vals)
+        if not self.row_cacheable():
+            return super(RowCacheQuery, self).get_pks(field_vals)
+
+        pks = [self.normalize_pk(pk) for pk in field_vals]
+        if None in pks:
+            return super(RowCacheQuery, self).get_pks(field_vals)
+
+        rc = self.row_cache
+        rows = {}
+        missing_pks = []
+        for pk in pks:
+            if pk not in rows:
+                row, cache_hit = rc.get_row(pk)
+                if cache_hit:
+                    rows[pk] = row
+                elif pk not in missing_pks:
+                    missing_pks.append(pk)
+
+        if missing_pks:
+            logger.debug("Row cache miss on {} for {} pks".format(self.schema, len(missing_pks)))
+            version = rc.version
+            pk_name = self.schema.pk.name
+            query = type(self)(self.orm_class).in_field(pk_name, missing_pks)
+            query.default_val = []
+            fetched = query._query("get")
+            if isinstance(fetched, Rows):
+                fetched = fetched.dicts()
+
+            for row in fetched:
+                pk = row[pk_name]
+                rows[pk] = row
+                rc.set_row(pk, row, version)
+
+            for pk in missing_pks:
+                if pk not in rows:
+                    rows[pk] = None
+                    rc.set_missing(pk, version)
+
+        results = []
+        seen = set()
+        for pk in pks:
+            if rows[pk] is not None and pk not in seen:
+                results.append(rows[pk])
+                seen.add(pk)
+
+        self.default_val = []
+        it = ResultsIterator(results, orm_class=self.orm_class, query=self)
+        return self.iterator_class(it)
+
+    def get_pk(self, field_val):
+        if not self.row_cacheable():
+            return super(RowCacheQuery, self).get_pk(field_val)
+
+        ret = None
+        for o in self.get_pks([field_val]):
+            ret = o
+        return ret
+
+    def update(self):
+        ret = super(RowCacheQuery, self).update()
+        if ret:
+            pks = self.row_cache_pks()
+            fields = self.fields
+            rc = self.row_cache
+            if pks is None:
+                self.row_cache_written(rc.clear)
+
+            elif self.schema.pk.name in fields or self.row_cache_in_transaction():
+                # the transaction could still be rolled back, so don't write through
+                pks = [self.normalize_pk(pk) for pk in pks]
+                def remove():
+                    for pk in pks:
+                        rc.remove(pk)
+                self.row_cache_written(remove)
+
+            else:
+                for pk in pks:
+                    rc.update_row(self.normalize_pk(pk), fields)
+
+        return ret
+
+    def insert(self):
+        ret = super(RowCacheQuery, self).insert()
+        if ret:
+            # the new pk might be cached as missing
+            rc = self.row_cache
+            pk = self.normalize_pk(ret)
+            self.row_cache_written(lambda: rc.remove(pk))
+        return ret
+
+    def delete(self):
+        ret = super(RowCacheQuery, self).delete()
+        pks = self.row_cache_pks()
+        rc = self.row_cache
+        if pks is None:
+            self.row_cache_written(rc.clear)
+
+        elif self.row_cache_in_transaction():
+            pks = [self.normalize_pk(pk) for pk in pks]
+            def remove():
+                for pk in pks:
+                    rc.remove(pk)
+            self.row_cache_written(remove)
+
+        else:
+            for pk in pks:
+                rc.delete_row(self.normalize_pk(pk))
+
+        return ret
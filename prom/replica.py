@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Route an interface's reads to its read replicas
+
+    export PROM_DSN=prom.interface.postgres.PostgreSQL://primary/db?replicas=r1,r2
+    export PROM_DSN_1=prom.interface.postgres.PostgreSQL://replica1/db#r1
+    export PROM_DSN_2=prom.interface.postgres.PostgreSQL://replica2/db#r2
+
+The replicas option is a comma separated list of the connection names of the
+replicas, once it is set the get, get_one, and count queries (and so all(),
+values(), etc) of every Orm that uses the primary connection go to a replica.
+Writes always go to the primary, and so does every read on a thread that is in a
+transaction or that committed a transaction less than replica_window seconds ago
+(so the caller reads its own writes even if the replicas are behind).
+
+dsn options --
+    replicas -- the names of the replica connections
+    replica_strategy -- round_robin (the default) or least_loaded, least_loaded
+        picks the replica with the fewest queries running on it
+    replica_window -- seconds after a write that reads stay on the primary,
+        defaults to 1.0, 0 turns it off
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import logging
+import threading
+import time
+
+from .exception import InterfaceError
+from .metrics import Counter, Gauge
+from .compat import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class Replicas(object):
+    """Picks which interface each read of a primary interface should use
+
+    primary -- Interface -- the interface every write goes to
+    interfaces -- list -- the replica Interface instances
+    strategy -- string -- round_robin or least_loaded
+    window -- float -- how many seconds after a write the writer's reads stay on
+        the primary
+    """
+    strategies = set(["round_robin", "least_loaded"])
+
+    @classmethod
+    def configure(cls, primary):
+        """create the Replicas from primary's dsn options
+
+        return -- Replicas -- None if the primary doesn't have any replicas
+        """
+        from .interface import get_interface
+
+        options = primary.connection_config.options if primary.connection_config else {}
+        names = [n.strip() for n in options.get("replicas", "").split(",") if n.strip()]
+        if not names: return None
+
+        return cls(
+            primary,
+            [get_interface(name) for name in names],
+            strategy=options.get("replica_strategy", "round_robin"),
+            window=float(options.get("replica_window", 1.0)),
+        )
+
+    def __init__(self, primary, interfaces, strategy="round_robin", window=1.0):
+        if strategy not in self.strategies:
+            raise ValueError("replica strategy {} is not one of {}".format(
+                strategy,
+                ", ".join(sorted(self.strategies))
+            ))
+        if not interfaces:
+            raise ValueError("there are no replica interfaces")
+
+        self.primary = primary
+        self.interfaces = list(interfaces)
+        self.strategy = strategy
+        self.window = window
+
+        self.lock = threading.Lock()
+        self.index = 0
+        self.running = [Gauge() for _ in self.interfaces]
+        """how many queries are running on each replica"""
+        self.reads = [Counter() for _ in self.interfaces]
+        self.primary_reads = Counter()
+        """reads that were pinned to the primary"""
+        self.failures = Counter()
+        """replica reads that failed and were run again on the primary"""
+
+    def next_index(self):
+        with self.lock:
+            index = self.index
+            self.index = (index + 1) % len(self.interfaces)
+        return index
+
+    def choose(self):
+        """return the index of the replica the next read should use"""
+        index = self.next_index()
+        if self.strategy == "least_loaded":
+            # start from the round robin position so idle replicas take turns
+            count = len(self.interfaces)
+            index = min(
+                ((index + i) % count for i in range(count)),
+                key=lambda i: self.running[i].value
+            )
+        return index
+
+    def is_pinned(self):
+        """return True if this thread's reads have to use the primary"""
+        primary = self.primary
+        if primary.get_pinned_connection():
+            # in a transaction
+            return True
+        return bool(self.window) and (time.time() - primary.last_write()) < self.window
+
+    def query(self, method_name, schema, query, **kwargs):
+        """run interface.method_name(schema, query, **kwargs) on a replica, or on
+        the primary if this thread is pinned to it or the replica fails"""
+        if self.is_pinned():
+            self.primary_reads.incr()
+            return getattr(self.primary, method_name)(schema, query, **kwargs)
+
+        index = self.choose()
+        running = self.running[index]
+        running.incr()
+        try:
+            self.reads[index].incr()
+            return getattr(self.interfaces[index], method_name)(schema, query, **kwargs)
+
+        except InterfaceError as e:
+            # the replica might be down or not have the table yet (and a
+            # replica can't create it), the primary can handle both
+            self.failures.incr()
+            logger.warning("replica {} {} failed, running it on the primary: {}".format(
+                index,
+                method_name,
+                e
+            ))
+            return getattr(self.primary, method_name)(schema, query, **kwargs)
+
+        finally:
+            running.decr()
+
+    def stats(self):
+        return {
+            "strategy": self.strategy,
+            "window": self.window,
+            "primary_reads": self.primary_reads.stats(),
+            "failures": self.failures.stats(),
+            "replicas": [
+                {
+                    "interface": inter.connection_config.interface_name if inter.connection_config else "",
+                    "reads": self.reads[i].stats(),
+                    "running": self.running[i].stats(),
+                } for i, inter in enumerate(self.interfaces)
+            ],
+        }
+
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Split an Orm's rows across the interfaces of several connections
+
+    export PROM_DSN_1=prom.interface.postgres.PostgreSQL://shard1/db#users1
+    export PROM_DSN_2=prom.interface.postgres.PostgreSQL://shard2/db#users2
+
+    class User(Orm):
+        shard_connection_names = ["users1", "users2"]
+        shard_field_name = "account_id"
+
+        account_id = Field(long, True)
+
+Every row lives on one shard, picked from its shard key (the value of the
+shard_field_name field). By default the shard key is hashed, set shard_ranges to
+the lowest shard key of each shard after the first to split the rows by range
+instead (eg, [1000, 2000] puts everything below 1000 on the first shard,
+1000-1999 on the second, and the rest on the third).
+
+Inserts need the shard key. Queries that have an is or in condition on the shard
+key (or, with ranges, a gt/gte/lt/lte condition) only go to the shards that can
+have matching rows, every other query goes to all the shards at the same time
+and the results are merged, sorted, and limited here.
+
+Primary keys are only unique on each shard, so look rows up by the shard key
+and the primary key (Orm.save() and Orm.delete() do this for you). Rows can't
+be moved between shards, so the shard key of a saved row can't be changed.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import bisect
+import threading
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from .utils import Rows
+from .compat import *
+
+
+class Shards(object):
+    """Picks which interface each query of a sharded Orm should use
+
+    connection_names -- list -- the names of the shard connections, see
+        interface.get_interface()
+    field_name -- string -- the shard key field
+    ranges -- list -- None to hash the shard key, otherwise the sorted lowest
+        shard key of each shard after the first
+    concurrent -- boolean -- True to query all the shards at the same time when a
+        query goes to more than one, SQLite shards need the per_thread=1 option
+    """
+    instances = {}
+
+    @classmethod
+    def get_instance(cls, orm_class):
+        """return the Shards of orm_class, None if orm_class isn't sharded"""
+        names = orm_class.shard_connection_names
+        if not names: return None
+
+        ranges = orm_class.shard_ranges
+        key = (
+            tuple(names),
+            orm_class.shard_field_name,
+            tuple(ranges) if ranges else None,
+        )
+        instance = cls.instances.get(key)
+        if not instance:
+            instance = cls(names, orm_class.shard_field_name, ranges)
+            cls.instances[key] = instance
+        return instance
+
+    def __init__(self, connection_names, field_name, ranges=None, concurrent=True):
+        if not connection_names:
+            raise ValueError("there are no shard connections")
+        if not field_name:
+            raise ValueError("there is no shard key field")
+
+        self.connection_names = list(connection_names)
+        self.field_name = field_name
+        self.concurrent = concurrent
+
+        if ranges:
+            ranges = list(ranges)
+            if len(ranges) != len(self.connection_names) - 1:
+                raise ValueError("{} shards need {} ranges, not {}".format(
+                    len(self.connection_names),
+                    len(self.connection_names) - 1,
+                    len(ranges)
+                ))
+            if ranges != sorted(ranges):
+                raise ValueError("shard ranges need to be sorted")
+        self.ranges = ranges
+
+        self.lock = threading.Lock()
+        self.pool = None
+
+    @property
+    def interfaces(self):
+        from .interface import get_interface
+        return [get_interface(name) for name in self.connection_names]
+
+    def index(self, value):
+        """return the index of the shard that holds the rows with shard key value"""
+        if value is None:
+            raise ValueError("shard key {} can't be None".format(self.field_name))
+
+        if self.ranges:
+            return bisect.bisect_right(self.ranges, value)
+
+        # crc32 instead of hash() so every process puts the row on the same shard
+        value = value if isinstance(value, basestring) else unicode(value)
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        return (zlib.crc32(value) & 0xffffffff) % len(self.connection_names)
+
+    def indexes(self, query):
+        """return the indexes of the shards that can have rows matching query"""
+        count = len(self.connection_names)
+        indexes = set(range(count))
+        for cmd, field_name, field_val, field_kwargs in query.fields_where.get(self.field_name):
+            if field_kwargs or field_val is None:
+                continue
+
+            if cmd == "is":
+                indexes &= set([self.index(field_val)])
+
+            elif cmd == "in":
+                indexes &= set(self.index(v) for v in field_val)
+
+            elif self.ranges:
+                if cmd.startswith("gt"):
+                    indexes &= set(range(self.index(field_val), count))
+
+                elif cmd.startswith("lt"):
+                    indexes &= set(range(0, self.index(field_val) + 1))
+
+        return sorted(indexes)
+
+    def map(self, callback, indexes):
+        """return [callback(index) for index in indexes], running the callbacks at
+        the same time if there is more than one"""
+        if not self.concurrent or len(indexes) < 2 or self.in_transaction():
+            return [callback(index) for index in indexes]
+
+        with self.lock:
+            if not self.pool:
+                self.pool = ThreadPool(len(self.connection_names))
+        return self.pool.map(callback, indexes)
+
+    def in_transaction(self):
+        """True if this thread is in a transaction on one of the shards, those
+        queries have to stay on this thread's connection"""
+        return any(inter.get_pinned_connection() for inter in self.interfaces)
+
+    def insert(self, query):
+        """insert query.fields on the shard of their shard key"""
+        fields = query.fields
+        if self.field_name not in fields:
+            raise ValueError("shard key {} is needed to insert".format(self.field_name))
+
+        inter = self.interfaces[self.index(fields[self.field_name])]
+        return inter.insert(query.schema, fields)
+
+    def update(self, query):
+        """update the rows matching query on every shard that can have them
+
+        return -- int -- how many rows were updated
+        """
+        fields = query.fields
+        indexes = self.indexes(query)
+        if self.field_name in fields:
+            if indexes != [self.index(fields[self.field_name])]:
+                raise ValueError("rows can't be moved between shards, {} can't be updated".format(
+                    self.field_name
+                ))
+
+        interfaces = self.interfaces
+        def callback(index):
+            return interfaces[index].update(query.schema, fields, query)
+        return sum(self.map(callback, indexes))
+
+    def query(self, query, method_name, **kwargs):
+        """run interface.method_name(schema, query, **kwargs) on every shard that
+        can have rows matching query and combine the results"""
+        interfaces = self.interfaces
+        indexes = self.indexes(query)
+        if len(indexes) == 1:
+            return query._interface_call(interfaces[indexes[0]], method_name, **kwargs)
+
+        if method_name == "get":
+            if kwargs.get("cursor_result", False):
+                raise ValueError("cursor() can only use one shard, query {} with is or in".format(
+                    self.field_name
+                ))
+            return self.get(query, interfaces, indexes, **kwargs)
+
+        elif method_name == "get_one":
+            rows = self.get(query, interfaces, indexes, limit=1)
+            return rows[0] if rows else {}
+
+        if method_name not in set(["count", "delete"]):
+            raise ValueError("{} can't be run on more than one shard".format(method_name))
+
+        def callback(index):
+            return query._interface_call(interfaces[index], method_name, **kwargs)
+        return sum(int(r or 0) for r in self.map(callback, indexes))
+
+    def get(self, query, interfaces, indexes, limit=None, **kwargs):
+        """get the rows matching query from every shard and merge them like the db
+        would have if they were all in one table
+
+        limit -- int -- overrides query's limit
+        return -- list -- utils.Rows if the shards returned tuple rows
+        """
+        bounds = query.bounds
+        offset = bounds.offset
+        if limit is None:
+            limit = bounds.limit
+        else:
+            kwargs.pop("tuple_result", None)
+
+        # every shard returns all the rows up to the end of the page, the page can
+        # come from any of them
+        q = query.copy()
+        q.bounds = query.bounds_class()
+        if limit:
+            q.bounds.limit = offset + limit
+
+        # the rows can only be sorted here if they have the sort fields
+        select_names = set(q.fields_select.names())
+        if select_names:
+            for direction, field_name, field_vals in q.fields_sort:
+                if field_name not in select_names:
+                    q.select_field(field_name)
+                    select_names.add(field_name)
+
+        def callback(index):
+            return q._interface_call(interfaces[index], "get", **kwargs)
+        results = self.map(callback, indexes)
+
+        columns = [getattr(r, "columns", None) for r in results]
+        if columns[0] and all(c == columns[0] for c in columns):
+            rows = Rows(columns[0], (row for r in results for row in r))
+            def getter(field_name):
+                i = rows.index[field_name]
+                return lambda row: row[i]
+
+        else:
+            rows = []
+            for r in results:
+                rows.extend(r.dicts() if isinstance(r, Rows) else r)
+            def getter(field_name):
+                return lambda row: row.get(field_name, None)
+
+        # sort() is stable, so sorting by each field from last to first sorts by
+        # all of them, None values go last like they do in Postgres
+        for direction, field_name, field_vals in reversed(list(q.fields_sort)):
+            get_val = getter(field_name)
+            if field_vals:
+                positions = dict((v, i) for i, v in enumerate(field_vals))
+                key = lambda row: positions.get(get_val(row), len(positions))
+            else:
+                key = lambda row: (get_val(row) is None, get_val(row))
+            rows.sort(key=key, reverse=direction < 0)
+
+        stop = offset + limit if limit else None
+        rows[:] = rows[offset:stop]
+        return rows
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tag the SQL an interface generates with a comment that says where it came from,
+so the heavy statements in pg_stat_statements (or the db's logs) can be traced
+back to the code that ran them
+
+    export PROM_DSN=prom.interface.postgres.PostgreSQL://host/db?sql_comment=1
+
+    SELECT ... /*caller='app.views%3Aindex',method='get',orm='app.models.User'*/
+
+The comment is in the sqlcommenter format (https://google.github.io/sqlcommenter/),
+the keys are sorted and the values are url quoted:
+
+    orm -- the module and name of the Orm class
+    method -- the interface method, eg, get, insert, count
+    caller -- the module and function of the first caller that isn't prom
+    request_id -- set with request_id(), only added when there is one
+
+The comment of a call site is always the same, so every run of it is still the
+same statement text. Postgres leaves comments out when pg_stat_statements groups
+statements, so tagging doesn't split a query's stats, the comment of the first
+call site to run it is the one that is kept with the query text. A request id
+makes the text of every request different, so only set one when the db keeps
+the text of each statement (eg, log_min_duration_statement).
+
+dsn options --
+    sql_comment -- 1 to tag the SQL of the interface
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import sys
+from contextlib import contextmanager
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+from .compat import *
+
+
+_request_id = ContextVar("prom_request_id", default=None)
+
+
+def get_caller_frame(skip_modules):
+    """return the first frame of the stack that isn't in one of skip_modules (or
+    their submodules), None if every frame is"""
+    frame = sys._getframe(1)
+    while frame:
+        module_name = frame.f_globals.get("__name__", "")
+        for name in skip_modules:
+            if module_name == name or module_name.startswith(name + "."):
+                break
+        else:
+            return frame
+        frame = frame.f_back
+    return None
+
+
+def get_request_id():
+    """return the request id set with set_request_id() or request_id()"""
+    return _request_id.get()
+
+
+def set_request_id(value):
+    """add value to the comment of every query this context (or thread, before
+    python 3.7) runs from now on, None to stop"""
+    _request_id.set(value)
+
+
+@contextmanager
+def request_id(value):
+    """add value to the comment of every query run in the with block
+
+        with prom.tags.request_id(request.headers["X-Request-Id"]):
+            user = User.query.is_pk(1).get_one()
+    """
+    previous = get_request_id()
+    set_request_id(value)
+    try:
+        yield value
+
+    finally:
+        set_request_id(previous)
+
+
+class QueryTags(object):
+    """Builds the comment that is appended to the SQL of an interface's queries
+
+    caller -- boolean -- False to leave the caller out, finding it walks the stack
+    """
+    skip_modules = ("prom", "threading", "concurrent", "multiprocessing", "contextlib")
+    """the modules (and their submodules) that aren't the caller, the thread pool
+    modules are here so a query run on a pool doesn't name the pool's worker"""
+
+    @classmethod
+    def configure(cls, interface):
+        """return a QueryTags if interface's dsn options ask for one, otherwise None"""
+        options = interface.connection_config.options if interface.connection_config else {}
+        if not int(options.get("sql_comment", 0)): return None
+        return cls()
+
+    def __init__(self, caller=True):
+        self.caller = caller
+        self.comments = {}
+
+    def get_caller(self):
+        """return "module:function" of the first frame outside of prom, empty if
+        every frame is skipped"""
+        frame = get_caller_frame(self.skip_modules)
+        if not frame: return ""
+        return "{}:{}".format(frame.f_globals.get("__name__", ""), frame.f_code.co_name)
+
+    def orm_name(self, orm_class):
+        return "{}.{}".format(orm_class.__module__, orm_class.__name__) if orm_class else ""
+
+    def comment(self, orm_class, method_name):
+        """return the comment for a method_name query of orm_class, the comments are
+        cached by call site so building one is usually a dict lookup"""
+        key = (
+            orm_class,
+            method_name,
+            self.get_caller() if self.caller else "",
+            get_request_id(),
+        )
+        ret = self.comments.get(key, None)
+        if ret is None:
+            tags = {
+                "orm": self.orm_name(orm_class),
+                "method": method_name,
+                "caller": key[2],
+                "request_id": key[3],
+            }
+            ret = self.format(tags)
+            if key[3] is None:
+                # request ids are different every time, so they aren't cached
+                self.comments[key] = ret
+        return ret
+
+    def format(self, tags):
+        """return tags as a sqlcommenter comment"""
+        parts = []
+        for k, v in sorted(tags.items()):
+            if v is None or v == "": continue
+            # quoting also takes out any ' or */ that would end the value early
+            v = quote(unicode(v).encode("utf-8"), safe="")
+            parts.append("{}='{}'".format(k, v))
+        return "/*{}*/".format(",".join(parts)) if parts else ""
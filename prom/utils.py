@@ -6,6 +6,7 @@ import itertools
 import os
 import sys
 import codecs
+import threading
 from contextlib import contextmanager
 
 from .compat import *
@@ -90,6 +91,125 @@ class Pool(dict):
         raise NotImplementedError()
 
 
+class SingleFlight(object):
+    """Makes sure only one caller at a time runs the callback for a given key,
+    every other caller that comes along with the same key while the first one is
+    running waits for it and gets its result (or its error)
+
+    this stops a stampede of identical queries when a cached value expires
+
+    the event class is looked up when it's needed so this works with real threads
+    and, once threading has been monkey patched (or event_class has been set, see
+    prom.gevent.patch_all), gevent greenlets. The lock only guards the dict of
+    running calls and nothing can block while it is held, so it is safe to share
+    between greenlets either way
+
+    see -- query.BaseCacheQuery
+    """
+    event_class = None
+    """the event class to use, None means threading.Event"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, callback, *args, **kwargs):
+        """run callback(*args, **kwargs) unless another caller is already running
+        it for key, in which case wait for that caller to finish
+
+        return -- tuple -- (result, shared) where shared is True if result came
+            from another caller
+        """
+        with self.lock:
+            call = self.calls.get(key, None)
+            leader = call is None
+            if leader:
+                event_class = self.event_class or threading.Event
+                call = {"event": event_class(), "result": None, "exc_info": None}
+                self.calls[key] = call
+
+        if leader:
+            try:
+                call["result"] = callback(*args, **kwargs)
+
+            except Exception:
+                call["exc_info"] = sys.exc_info()
+                raise
+
+            finally:
+                with self.lock:
+                    self.calls.pop(key, None)
+                call["event"].set()
+
+        else:
+            call["event"].wait()
+            if call["exc_info"]:
+                reraise(*call["exc_info"])
+
+        return call["result"], not leader
+
+
+class Future(object):
+    """The result of a call that runs in another thread, this is a tiny version of
+    python 3's concurrent.futures.Future so it works on python 2 also
+
+    see -- interface.sqlite.GroupCommitWriter
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.exc_info = None
+
+    def done(self):
+        return self.event.is_set()
+
+    def set_result(self, value):
+        self.value = value
+        self.event.set()
+
+    def set_exception(self, e, exc_info=None):
+        if not exc_info:
+            exc_info = (e.__class__, e, None)
+        self.exc_info = exc_info
+        self.event.set()
+
+    def exception(self):
+        """wait for the call to finish and return its error, or None"""
+        self.event.wait()
+        return self.exc_info[1] if self.exc_info else None
+
+    def result(self):
+        """wait for the call to finish and return its value, if the call failed
+        then its error is raised instead"""
+        self.event.wait()
+        if self.exc_info:
+            reraise(*self.exc_info)
+        return self.value
+
+
+class Rows(list):
+    """A list of result rows where each row is a tuple, the column names are
+    found once for the whole result set instead of every row being a dict that
+    carries its own copy of the keys
+
+    see -- interface.base.SQLInterface._query()
+    """
+    def __init__(self, columns, rows=None):
+        super(Rows, self).__init__(rows or [])
+        self.columns = list(columns)
+        self.index = dict((c, i) for i, c in enumerate(self.columns))
+
+    def row_dict(self, row):
+        return dict(zip(self.columns, row))
+
+    def dicts(self):
+        """return all the rows as dicts"""
+        return [self.row_dict(row) for row in self]
+
+    def __copy__(self):
+        return type(self)(self.columns, self)
+
+
 class PriorityQueue(object):
     """A semi-generic priority queue, if you never pass in priorities it defaults to
     a FIFO queue
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import time
+
+try:
+    import asyncio
+    from prom import aio
+except ImportError:
+    asyncio = None
+
+import testdata
+
+from . import BaseTestCase, SkipTest
+from prom.config import DsnConnection
+from prom.compat import *
+import prom
+
+
+class AioTest(BaseTestCase):
+    dsn_options = "async=1&pool_maxconn=4"
+
+    @classmethod
+    def setUpClass(cls):
+        if not asyncio:
+            raise SkipTest("asyncio is not available")
+        super(AioTest, cls).setUpClass()
+
+    @classmethod
+    def create_interface(cls):
+        config = DsnConnection("{}?{}".format(os.environ["PROM_POSTGRES_DSN"], cls.dsn_options))
+        inter = config.interface
+        cls.connections.add(inter)
+        return inter
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        aio.close_runners()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        super(AioTest, self).tearDown()
+
+    def run_loop(self, *futures):
+        ret = self.loop.run_until_complete(asyncio.gather(*futures))
+        return ret[0] if len(futures) == 1 else ret
+
+    def test_query(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 5)
+
+        it = self.run_loop(orm_class.query.asc_pk().aget(limit=2))
+        self.assertEqual(pks[:2], list(it.pk))
+        self.assertTrue(it.has_more)
+
+        o = self.run_loop(orm_class.query.aget_pk(pks[1]))
+        self.assertEqual(pks[1], o.pk)
+        self.assertEqual(set(), o.modified_fields)
+
+        self.assertIsNone(self.run_loop(orm_class.query.aget_pk(pks[-1] + 1)))
+        self.assertEqual(pks[1:3], list(self.run_loop(orm_class.query.aget_pks(pks[1:3])).pk))
+        self.assertEqual(5, self.run_loop(orm_class.query.acount()))
+        self.assertEqual(1, self.run_loop(orm_class.query.desc_pk().is_pk(pks[0]).acount()))
+        self.assertTrue(self.run_loop(orm_class.query.ahas()))
+        self.assertEqual(pks, list(self.run_loop(orm_class.query.select_pk().asc_pk().avalues())))
+
+    def test_row_cache(self):
+        orm_class = self.get_orm_class()
+        class RCQuery(prom.RowCacheQuery):
+            _row_caches = {}
+        orm_class.query_class = RCQuery
+        pks = self.insert(orm_class, 3)
+
+        self.assertEqual(pks[0], self.run_loop(orm_class.query.aget_pk(pks[0])).pk)
+        self.assertEqual(pks[1:], list(self.run_loop(orm_class.query.aget_pks(pks[1:])).pk))
+
+        # the rows are cached, so a change the cache doesn't know about isn't seen
+        prom.Query(orm_class).set_foo(1000).update()
+        self.assertNotEqual(1000, self.run_loop(orm_class.query.aget_pk(pks[0])).foo)
+        os = self.run_loop(orm_class.query.aget_pks(pks))
+        self.assertEqual(0, len([o for o in os if o.foo == 1000]))
+
+    def test_orm(self):
+        orm_class = self.get_orm_class()
+        o = self.run_loop(orm_class.acreate(foo=1, bar="one"))
+        self.assertTrue(o.pk)
+
+        o.foo = 2
+        self.run_loop(o.asave())
+        self.assertEqual(2, orm_class.query.get_pk(o.pk).foo)
+
+        pk = o.pk
+        self.assertTrue(self.run_loop(o.adelete()))
+        self.assertIsNone(orm_class.query.get_pk(pk))
+
+        orm_class.create(foo=3, bar="three")
+        self.assertEqual(1, self.run_loop(orm_class.query.is_foo(3).set_fields(foo=4).aupdate()))
+        self.run_loop(orm_class.query.is_foo(4).adelete())
+        self.assertEqual(0, orm_class.query.count())
+
+    def test_all(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 12)
+
+        ait = aio.AllIterator(orm_class.query.asc_pk().set_limit(5), chunk=4)
+        async_pks = []
+        while True:
+            try:
+                async_pks.append(self.run_loop(ait.__anext__()).pk)
+            except StopAsyncIteration:
+                break
+        self.assertEqual(pks[:5], async_pks)
+
+        ait = orm_class.query.asc_pk().aall()
+        self.assertEqual(pks[0], self.run_loop(ait.__anext__()).pk)
+
+    def test_concurrency(self):
+        orm_class = self.get_orm_class()
+        self.insert(orm_class, 1)
+        runner = aio.get_runner(orm_class.interface)
+        self.assertEqual(4, runner.max_workers)
+
+        start = time.time()
+        i = orm_class.interface
+        self.run_loop(*[
+            aio.run(i, i.query, "SELECT pg_sleep(0.25)") for _ in range(4)
+        ])
+        self.assertLess(time.time() - start, 0.9)
+
+    def test_errors(self):
+        orm_class = self.get_orm_class()
+        o = orm_class.create(foo=1, bar="one")
+        o2 = orm_class(_id=o.pk, foo=2, bar="two")
+        with self.assertRaises(prom.InterfaceError):
+            self.run_loop(o2.asave())
+
+    def test_missing_table(self):
+        # the table doesn't exist yet, the interface's error handling creates it
+        orm_class = self.get_orm_class()
+        self.assertEqual([], list(self.run_loop(orm_class.query.aget())))
+        self.assertIsNone(self.run_loop(orm_class.query.aget_one()))
+        self.assertEqual(0, self.run_loop(orm_class.query.acount()))
+
+
+class AioNativeTest(AioTest):
+    dsn_options = "async=1&pool_maxconn=4&aio_native=1"
+
+    def test_native(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 3)
+        runner = aio.get_runner(orm_class.interface)
+        self.assertTrue(isinstance(runner, aio.PostgresRunner))
+
+        its = self.run_loop(*[orm_class.query.asc_pk().aget() for _ in range(10)])
+        for it in its:
+            self.assertEqual(pks, list(it.pk))
+        self.assertLess(0, runner.size)
+        self.assertLessEqual(runner.size, runner.maxconn)
+        self.assertEqual(runner.size, len(runner.idle))
+
+
+class AioSQLiteTest(AioTest):
+    @classmethod
+    def create_interface(cls):
+        config = DsnConnection("{}?per_thread=1".format(os.environ["PROM_SQLITE_DSN"]))
+        inter = config.interface
+        cls.connections.add(inter)
+        return inter
+
+    def test_concurrency(self):
+        raise SkipTest("sqlite doesn't have pg_sleep")
+
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import time
+import threading
+import multiprocessing
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import testdata
+
+from . import BaseTestCase, TestCase
+from prom.cache import Serializer, MemoryBackend, SQLiteBackend, MemcacheBackend, RowCache
+from prom.query import Query, SharedCacheQuery, RowCacheQuery
+from prom.utils import Rows
+from prom.compat import *
+
+
+class MemcacheHandler(socketserver.StreamRequestHandler):
+    """a tiny stand-in for memcached that understands just enough of the text
+    protocol for MemcacheBackend"""
+    def handle(self):
+        values = self.server.values
+        while True:
+            line = self.rfile.readline()
+            if not line: break
+            bits = line.strip().decode("utf-8").split()
+            cmd = bits[0]
+            if cmd == "get":
+                v = values.get(bits[1])
+                if v is not None:
+                    self.wfile.write("VALUE {} 0 {}\r\n".format(bits[1], len(v)).encode("utf-8"))
+                    self.wfile.write(v + b"\r\n")
+                self.wfile.write(b"END\r\n")
+
+            elif cmd in set(["set", "add"]):
+                body = self.rfile.read(int(bits[4]) + 2)[:-2]
+                if cmd == "add" and bits[1] in values:
+                    self.wfile.write(b"NOT_STORED\r\n")
+                else:
+                    values[bits[1]] = body
+                    self.wfile.write(b"STORED\r\n")
+
+            elif cmd == "incr":
+                if bits[1] in values:
+                    v = int(values[bits[1]]) + int(bits[2])
+                    values[bits[1]] = str(v).encode("ascii")
+                    self.wfile.write(values[bits[1]] + b"\r\n")
+                else:
+                    self.wfile.write(b"NOT_FOUND\r\n")
+
+
+class MemcacheServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ("127.0.0.1", 0), MemcacheHandler)
+        self.values = {}
+
+    def __enter__(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class SerializerTest(TestCase):
+    def test_rows(self):
+        s = Serializer()
+        rows = [{"_id": i, "foo": testdata.get_words()} for i in range(100)]
+        body = s.dumps(rows)
+        self.assertEqual(rows, s.loads(body))
+
+        # the keys aren't repeated for every row
+        self.assertLess(len(body), len(repr(rows)))
+
+    def test_tuple_rows(self):
+        s = Serializer()
+        rows = Rows(["_id", "foo"], [(i, testdata.get_words()) for i in range(100)])
+        r = s.loads(s.dumps(rows))
+        self.assertTrue(isinstance(r, Rows))
+        self.assertEqual(rows.columns, r.columns)
+        self.assertEqual(list(rows), [tuple(row) for row in r])
+
+    def test_values(self):
+        s = Serializer()
+        for v in [0, 10, None, [], {"_id": 1}]:
+            self.assertEqual(v, s.loads(s.dumps(v)))
+
+
+class BackendTest(TestCase):
+    def assertBackend(self, backend):
+        table_name = testdata.get_ascii(16)
+        result, hit = backend.get_result(table_name, "k")
+        self.assertFalse(hit)
+
+        backend.set_result(table_name, "k", [{"foo": 1}], 60)
+        result, hit = backend.get_result(table_name, "k")
+        self.assertTrue(hit)
+        self.assertEqual([{"foo": 1}], result)
+
+        self.assertEqual(1, backend.invalidate(table_name))
+        result, hit = backend.get_result(table_name, "k")
+        self.assertFalse(hit)
+
+        self.assertEqual(2, backend.invalidate(table_name))
+
+    def test_memory(self):
+        self.assertBackend(MemoryBackend())
+
+    def test_sqlite(self):
+        self.assertBackend(SQLiteBackend(testdata.get_file("cache.sqlite").path))
+
+    def test_memcache(self):
+        with MemcacheServer() as server:
+            host, port = server.server_address
+            self.assertBackend(MemcacheBackend(host, port))
+
+    def test_sqlite_processes(self):
+        path = testdata.get_file("cache.sqlite").path
+        backend = SQLiteBackend(path)
+        backend.set_result("foo", "k", 1, 60)
+
+        def target():
+            # this runs in a completely separate process
+            backend.invalidate("foo")
+
+        p = multiprocessing.Process(target=target)
+        p.start()
+        p.join()
+
+        result, hit = backend.get_result("foo", "k")
+        self.assertFalse(hit)
+        self.assertEqual(1, backend.generation("foo"))
+
+    def test_ttl(self):
+        backend = SQLiteBackend(testdata.get_file("cache.sqlite").path)
+        backend.set("foo", b"bar", 1)
+        self.assertEqual(b"bar", backend.get("foo"))
+        time.sleep(1.1)
+        self.assertIsNone(backend.get("foo"))
+
+
+class RowCacheTest(TestCase):
+    def test_lru(self):
+        rc = RowCache(size=2)
+        rc.set_row(1, {"_id": 1})
+        rc.set_row(2, {"_id": 2})
+        rc.get_row(1)
+        rc.set_row(3, {"_id": 3})
+        self.assertTrue(rc.get_row(1)[1])
+        self.assertFalse(rc.get_row(2)[1])
+        self.assertTrue(rc.get_row(3)[1])
+
+        rc.remove(1)
+        self.assertFalse(rc.get_row(1)[1])
+
+    def test_missing(self):
+        rc = RowCache(missing_ttl=1)
+        rc.set_missing(1)
+        self.assertEqual((None, True), rc.get_row(1))
+        time.sleep(1.1)
+        self.assertEqual((None, False), rc.get_row(1))
+
+    def test_version(self):
+        rc = RowCache()
+        version = rc.version
+        rc.update_row(1, {"foo": 1})
+        rc.set_row(1, {"_id": 1, "foo": 0}, version)
+        self.assertFalse(rc.get_row(1)[1])
+
+        rc.set_row(1, {"_id": 1, "foo": 0}, rc.version)
+        rc.update_row(1, {"foo": 1})
+        self.assertEqual({"_id": 1, "foo": 1}, rc.get_row(1)[0])
+
+
+class RowCacheQueryTest(BaseTestCase):
+    def get_orm_class(self):
+        orm_class = super(RowCacheQueryTest, self).get_orm_class()
+        class RCQuery(RowCacheQuery):
+            _row_caches = {}
+        orm_class.query_class = RCQuery
+        return orm_class
+
+    def test_get_pk(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 3)
+
+        o = orm_class.query.get_pk(pks[0])
+        self.assertEqual(pks[0], o.pk)
+
+        # change the row without the cache knowing, the cached row should be returned
+        Query(orm_class).is_pk(pks[0]).set_field("foo", 1000).update()
+        o = orm_class.query.get_pk(pks[0])
+        self.assertNotEqual(1000, o.foo)
+
+        # writes through the cached query class write through to the cache
+        o.foo = 2000
+        o.save()
+        o = orm_class.query.get_pk(pks[0])
+        self.assertEqual(2000, o.foo)
+
+        # queries that aren't just pk lookups go to the db
+        o = orm_class.query.is_foo(2000).get_one()
+        self.assertEqual(pks[0], o.pk)
+
+    def test_get_pks(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 5)
+
+        self.assertEqual(pks[:2], list(orm_class.query.get_pks(pks[:2]).pk))
+
+        # the first two are cached so only the last three should come from the db
+        Query(orm_class).in_pk(pks).set_field("foo", 1000).update()
+        os = orm_class.query.get_pks(pks)
+        self.assertEqual(pks, list(os.pk))
+        self.assertEqual(2, len([o for o in os if o.foo != 1000]))
+
+        # string pks should hit the cache too
+        o = orm_class.query.get_pk(str(pks[0]))
+        self.assertNotEqual(1000, o.foo)
+
+    def test_missing(self):
+        orm_class = self.get_orm_class()
+        pk = self.insert(orm_class, 1)[0]
+
+        self.assertIsNone(orm_class.query.get_pk(pk + 1))
+        row, cache_hit = orm_class.query.row_cache.get_row(pk + 1)
+        self.assertTrue(cache_hit)
+
+        o = orm_class.create(foo=1, bar="one")
+        self.assertEqual(pk + 1, o.pk)
+        self.assertEqual(pk + 1, orm_class.query.get_pk(pk + 1).pk)
+
+        o.delete()
+        self.assertIsNone(orm_class.query.get_pk(pk + 1))
+
+        orm_class.query.is_foo(1000).delete()
+        self.assertEqual(0, len(orm_class.query.row_cache))
+
+    def test_pool(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 2)
+        pool = orm_class.pool(10)
+        self.assertEqual(pks[0], pool[pks[0]].pk)
+        self.assertEqual(pks[0], orm_class.query.row_cache.get_row(pks[0])[0]["_id"])
+
+    def test_threads(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 10)
+        errors = []
+
+        def target():
+            try:
+                for _ in range(10):
+                    self.assertEqual(pks, list(orm_class.query.get_pks(pks).pk))
+            except Exception as e:
+                errors.append(e)
+
+        ts = [threading.Thread(target=target) for _ in range(4)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+        self.assertEqual([], errors)
+
+    def test_transaction(self):
+        orm_class = self.get_orm_class()
+        pk = self.insert(orm_class, 1)[0]
+        rc = orm_class.query.row_cache
+        orm_class.query.get_pk(pk)
+        row = rc.get_row(pk)[0]
+
+        with orm_class.interface.transaction():
+            orm_class.query.is_pk(pk).set_foo(1000).update()
+            # a reader outside the transaction caches the committed row
+            rc.set_row(pk, row, rc.version)
+            self.assertTrue(rc.get_row(pk)[1])
+
+        self.assertFalse(rc.get_row(pk)[1])
+        self.assertEqual(1000, orm_class.query.get_pk(pk).foo)
+
+        # a cached lookup doesn't check a connection out to find the transaction
+        inter = orm_class.interface
+        checkouts = []
+        connection = inter.connection
+        def checkout(*args, **kwargs):
+            checkouts.append(1)
+            return connection(*args, **kwargs)
+        inter.connection = checkout
+        try:
+            self.assertEqual(1000, orm_class.query.get_pk(pk).foo)
+        finally:
+            del inter.connection
+        self.assertEqual([], checkouts)
+
+        with inter.transaction():
+            self.assertFalse(orm_class.query.row_cacheable())
+        self.assertTrue(orm_class.query.row_cacheable())
+
+    def test_connection_name(self):
+        orm_class = self.get_orm_class()
+        q = orm_class.query
+        rc = q.row_cache
+        key = (orm_class.interface.connection_config.name, str(orm_class.schema))
+        self.assertTrue(rc is q._row_caches[key])
+
+
+class SharedCacheQueryTest(BaseTestCase):
+    def get_orm_class(self, backend):
+        orm_class = super(SharedCacheQueryTest, self).get_orm_class()
+        class SCQuery(SharedCacheQuery):
+            pass
+        SCQuery.cache_configure(backend, ttl=60)
+        orm_class.query_class = SCQuery
+        return orm_class
+
+    def test_hit_and_invalidate(self):
+        path = testdata.get_file("cache.sqlite").path
+        orm_class = self.get_orm_class(SQLiteBackend(path))
+        self.insert(orm_class, 5)
+
+        q = orm_class.query
+        self.assertEqual(5, q.count())
+        self.assertFalse(q.cache_hit)
+
+        q = orm_class.query
+        self.assertEqual(5, q.count())
+        self.assertTrue(q.cache_hit)
+
+        # a different backend instance (like another process would have) should
+        # see the same values
+        q = orm_class.query
+        q.cache_backend = SQLiteBackend(path)
+        self.assertEqual(5, q.count())
+        self.assertTrue(q.cache_hit)
+
+        o = orm_class.query.get_one()
+        self.assertTrue(o.pk)
+
+        orm_class.create(foo=1, bar="one")
+        q = orm_class.query
+        self.assertEqual(6, q.count())
+        self.assertFalse(q.cache_hit)
+
+    def test_invalidate_during_miss(self):
+        backend = MemoryBackend()
+        orm_class = self.get_orm_class(backend)
+        self.insert(orm_class, 5)
+
+        class RaceQuery(orm_class.query_class):
+            def _interface_query(self, method_name, **kwargs):
+                ret = super(RaceQuery, self)._interface_query(method_name, **kwargs)
+                # another process writes after the rows were fetched but before
+                # they are cached
+                backend.invalidate(str(self.schema))
+                return ret
+        orm_class.query_class = RaceQuery
+        self.assertEqual(5, orm_class.query.count())
+
+        # the stale count was cached in the old generation, not the new one
+        q = orm_class.query
+        q.count()
+        self.assertFalse(q.cache_hit)
+
+    def test_transaction(self):
+        backend = MemoryBackend()
+        orm_class = self.get_orm_class(backend)
+        self.insert(orm_class, 5)
+        table_name = str(orm_class.schema)
+        generation = backend.generation(table_name)
+        orm_class.query.count()
+
+        with orm_class.interface.transaction():
+            orm_class.create(foo=1, bar="one")
+            # the generation only changes once the write is committed
+            self.assertEqual(generation, backend.generation(table_name))
+
+            # queries in the transaction can see uncommitted rows so they skip
+            # the cache
+            q = orm_class.query
+            self.assertEqual(6, q.count())
+            self.assertFalse(q.cache_hit)
+
+        self.assertEqual(generation + 1, backend.generation(table_name))
+        self.assertEqual(6, orm_class.query.count())
+
+        try:
+            with orm_class.interface.transaction():
+                orm_class.create(foo=2, bar="two")
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(generation + 1, backend.generation(table_name))
+
+    def test_single_flight(self):
+        orm_class = self.get_orm_class(MemoryBackend())
+        self.insert(orm_class, 5)
+        calls = []
+
+        class SFQuery(orm_class.query_class):
+            single_flight = True
+            def _interface_query(self, method_name, **kwargs):
+                calls.append(method_name)
+                time.sleep(0.5)
+                return super(SFQuery, self)._interface_query(method_name, **kwargs)
+        orm_class.query_class = SFQuery
+
+        counts = []
+        def target():
+            counts.append(orm_class.query.count())
+
+        ts = [threading.Thread(target=target) for _ in range(5)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+
+        self.assertEqual([5] * 5, counts)
+        self.assertEqual(["count"], calls)
+
+    def test_memcache(self):
+        with MemcacheServer() as server:
+            host, port = server.server_address
+            orm_class = self.get_orm_class(MemcacheBackend(host, port))
+            pks = self.insert(orm_class, 5)
+
+            q = orm_class.query
+            self.assertEqual(pks, list(q.pks()))
+            self.assertFalse(q.cache_hit)
+
+            q = orm_class.query
+            self.assertEqual(pks, list(q.pks()))
+            self.assertTrue(q.cache_hit)
+
+            orm_class.query.is_pk(pks[0]).delete()
+            q = orm_class.query
+            self.assertEqual(pks[1:], list(q.pks()))
+            self.assertFalse(q.cache_hit)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import time
+
+# needed to test prom with greenthreads
+try:
+    import gevent
+    from prom.gevent import Yielder
+except ImportError as e:
+    gevent = None
+
+from . import BaseTestCase, SkipTest
+from prom.query import ResultsIterator
+from prom.compat import *
+
+
+class YielderTest(BaseTestCase):
+    def setUp(self):
+        if not gevent:
+            raise SkipTest("gevent is not installed")
+
+    def tearDown(self):
+        ResultsIterator.yielder = None
+        super(YielderTest, self).tearDown()
+
+    def test_rows(self):
+        ticks = []
+        def tick():
+            while True:
+                ticks.append(1)
+                gevent.sleep(0)
+
+        g = gevent.spawn(tick)
+        gevent.sleep(0)
+
+        y = Yielder(rows=10, interval=0)
+        self.assertEqual(list(range(100)), list(y(range(100))))
+        g.kill()
+
+        self.assertLessEqual(10, len(ticks))
+        self.assertEqual(10, y.blocked.count)
+
+    def test_interval(self):
+        def busy():
+            for i in range(5):
+                time.sleep(0.02)
+                yield i
+
+        y = Yielder(rows=0, interval=0.03)
+        self.assertEqual(list(range(5)), list(y(busy())))
+        self.assertEqual(2, y.blocked.count)
+        self.assertLess(0.03, y.blocked.max)
+        self.assertLess(0.03, y.stats()["blocked"]["max"])
+
+    def test_iterator(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 25)
+
+        ResultsIterator.yielder = Yielder(rows=10, interval=0)
+        self.assertEqual(pks, list(orm_class.query.asc_pk().get().pk))
+        self.assertEqual(pks, list(orm_class.query.asc_pk().all().pk))
+        self.assertEqual(pks, list(orm_class.query.asc_pk().pks()))
+        self.assertEqual(6, ResultsIterator.yielder.blocked.count)
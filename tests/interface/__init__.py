@@ -5,10 +5,12 @@ import random
 import string
 import decimal
 import datetime
+import time
 
 
 from prom import query
 from prom.config import Schema, Field, Index
+from prom.hooks import SlowQueryLog, NPlusOne
 from prom.compat import *
 import prom
 
@@ -993,6 +995,175 @@ class BaseTestInterface(BaseTestCase):
         self.assertEqual(text, d["group"])
         self.assertEqual(pk, d["_id"])
 
+    def test_hooks(self):
+        i = self.create_interface()
+        events = []
+        def hook(event):
+            events.append((event.name, event.method_name, event.orm_class, event.row_count, dict(event.timings)))
+        def bad_hook(event):
+            raise RuntimeError()
+
+        for name in ["connect", "before", "after", "error", "hydrate"]:
+            i.add_hook(name, hook)
+        i.add_hook("after", bad_hook)
+        with self.assertRaises(ValueError):
+            i.add_hook("foo", hook)
+
+        i.connect()
+        connects = [e for e in events if e[0] == "connect"]
+        self.assertEqual(1, len(connects))
+        self.assertTrue("connect" in connects[0][4])
+
+        orm_class = self.get_orm_class()
+        orm_class.interface = i
+        orm_class.install()
+        del events[:]
+
+        orm_class.create(foo=1, bar="one")
+        orm_class.create(foo=2, bar="two")
+        inserts = [e for e in events if e[1] == "insert"]
+        self.assertEqual(("before", "insert", orm_class), inserts[0][:3])
+        self.assertEqual(("after", "insert", orm_class, 1), inserts[1][:4])
+
+        del events[:]
+        os = orm_class.query.gte_foo(1).asc_foo().get()
+        self.assertEqual(["before", "after"], [e[0] for e in events])
+        self.assertEqual(("get", orm_class, 2), events[1][1:4])
+        self.assertEqual(set(["compile", "execute", "fetch"]), set(events[1][4]))
+
+        self.assertEqual([1, 2], [o.foo for o in os])
+        self.assertEqual(("hydrate", "get", orm_class, 2), events[2][:4])
+        self.assertEqual(["hydrate"], list(events[2][4]))
+
+        # waiting for a connection isn't compile time
+        get_connection = i.get_connection
+        def slow_get_connection():
+            time.sleep(0.2)
+            return get_connection()
+        i.get_connection = slow_get_connection
+        del events[:]
+        orm_class.query.is_foo(1).get_one()
+        del i.get_connection
+        self.assertLess(events[1][4]["compile"], 0.2)
+
+        del events[:]
+        with self.assertRaises(prom.InterfaceError):
+            i.query("SELECT * FROM {}".format(self.get_table_name()))
+        self.assertEqual(["before", "error"], [e[0] for e in events])
+        self.assertEqual(("", None), events[1][1:3])
+
+        # the DDL that creates a missing table isn't counted as the insert's
+        statements = []
+        def statement_hook(event):
+            statements.append((event.method_name, event.sql))
+        i.add_hook("after", statement_hook)
+        missing_class = self.get_orm_class()
+        missing_class.interface = i
+        missing_class.create(foo=3, bar="three")
+        methods = set(m for m, sql in statements if sql.strip().upper().startswith("CREATE"))
+        self.assertEqual(set(["set_table"]), methods)
+        self.assertEqual(1, len([m for m, sql in statements if m == "insert"]))
+
+        for name in ["connect", "before", "after", "error", "hydrate"]:
+            i.remove_hook(name, hook)
+        i.remove_hook("after", bad_hook)
+        i.remove_hook("after", statement_hook)
+        self.assertFalse(i.hooks)
+        del events[:]
+        self.assertEqual(2, orm_class.query.count())
+        self.assertEqual([], events)
+
+    def test_explain(self):
+        i, s = self.get_table()
+        self.insert(i, s, 5)
+        plan = i.explain(s, query.Query().is_foo(1))
+        self.assertLess(0, len(plan))
+        self.assertTrue(any(str(s) in line for line in plan))
+
+        orm_class = self.get_orm_class()
+        orm_class.interface = i
+        orm_class.install()
+        plan = orm_class.query.is_foo(1).explain()
+        self.assertTrue(any(orm_class.table_name in line for line in plan))
+
+    def test_slow_query_log(self):
+        i, s = self.get_table()
+        self.insert(i, s, 5)
+
+        slow = SlowQueryLog(threshold=10).add(i)
+        i.get(s, query.Query().is_foo(1))
+        self.assertEqual(0, len(slow.records))
+
+        slow.threshold = 0
+        slow.explain = True
+        slow.args_sample = 1
+        i.get(s, query.Query().is_foo(1).is_bar("x" * 200))
+        i.get(s, query.Query().is_foo(2).is_bar("y"))
+        i.insert(s, {"foo": 6, "bar": "six"})
+
+        records = [r for r in slow.records if r["method_name"]]
+        self.assertEqual(["get", "get", "insert"], [r["method_name"] for r in records])
+        self.assertEqual(records[0]["sql"], records[1]["sql"])
+        self.assertEqual(2, records[0]["args_count"])
+        self.assertEqual(["1"], records[0]["args"])
+        self.assertTrue(any(str(s) in line for line in records[0]["explain"]))
+        # the same shape isn't explained again until explain_interval has passed
+        self.assertIsNone(records[1]["explain"])
+        # only SELECT queries are explained
+        self.assertIsNone(records[2]["explain"])
+        self.assertEqual(1, slow.explains.stats())
+        self.assertTrue("slow_query_log" not in i.stats())
+
+        # queries in a transaction aren't explained
+        slow.explained = {}
+        with i.transaction():
+            i.get(s, query.Query().is_foo(3))
+        self.assertIsNone(slow.records[-1]["explain"])
+        self.assertEqual(1, slow.explains.stats())
+
+        # only so many shapes are remembered
+        slow.explained_size = 1
+        i.get(s, query.Query().is_foo(3))
+        i.get(s, query.Query().is_bar("z"))
+        self.assertEqual(3, slow.explains.stats())
+        self.assertEqual(1, len(slow.explained))
+
+        slow.remove(i)
+        self.assertFalse(i.hooks)
+
+    def test_n_plus_one(self):
+        orm_class = self.get_orm_class()
+        i = orm_class.interface
+        pks = [orm_class.create(foo=x, bar=str(x)).pk for x in range(5)]
+
+        n = NPlusOne(threshold=3).add(i)
+        # reads outside of a scope aren't counted
+        for pk in pks:
+            orm_class.query.get_pk(pk)
+
+        with n.scope() as found:
+            for o in orm_class.query.get():
+                orm_class.query.get_pk(o.pk)
+
+            # the same args every time isn't an N+1 query
+            for _ in range(5):
+                orm_class.query.is_foo(1).count()
+
+        self.assertEqual(1, len(found))
+        self.assertEqual(5, found[0]["count"])
+        self.assertEqual("get_one", found[0]["method_name"])
+        self.assertTrue("test_n_plus_one" in found[0]["caller"])
+        self.assertEqual(1, n.n_plus_ones.stats())
+
+        n.raise_error = True
+        with self.assertRaises(prom.NPlusOneError):
+            with n.scope():
+                for pk in pks:
+                    orm_class.query.get_pk(pk)
+
+        n.remove(i)
+        self.assertFalse(i.hooks)
+
 
 # https://docs.python.org/2/library/unittest.html#load-tests-protocol
 def load_tests(loader, tests, pattern):
@@ -5,6 +5,7 @@ import os
 import datetime
 import time
 import subprocess
+import threading
 
 # needed to test prom with greenthreads
 try:
@@ -12,12 +13,15 @@ try:
 except ImportError as e:
     gevent = None
 
+import testdata
 from testdata.service import InitD
+import psycopg2
+import psycopg2.pool
 
 from prom import query
 from prom.compat import *
 from prom.config import Schema, DsnConnection, Field
-from prom.interface.postgres import PostgreSQL
+from prom.interface.postgres import PostgreSQL, ConnectionPool
 import prom
 import prom.interface
 
@@ -188,6 +192,98 @@ class InterfacePostgresTest(BaseTestInterface):
             })
             d = interface.set(schema, q)
 
+    def test_bytes(self):
+        i = self.get_interface()
+        s = Schema(
+            self.get_table_name(),
+            _id=Field(int, True, pk=True),
+            foo=Field(str, True),
+            bar=Field(bytearray, False),
+        )
+        i.set_table(s)
+
+        text = testdata.get_unicode_words()
+        blob = bytearray(os.urandom(32))
+        pk = i.insert(s, {"foo": text.encode("utf-8"), "bar": blob})
+        d = i.get_one(s, query.Query().is__id(pk))
+        self.assertEqual(text, d["foo"])
+        self.assertEqual(bytes(blob), d["bar"])
+
+        # text that looks like an escaped bytea value should come back untouched
+        i.update(s, {"foo": "\\x666f6f"}, query.Query().is__id(pk))
+        d = i.get_one(s, query.Query().is__id(pk))
+        self.assertEqual("\\x666f6f", d["foo"])
+
+        # bytes are decoded with the connection's encoding
+        with i.connection() as connection:
+            connection.set_client_encoding("LATIN1")
+            try:
+                i.update(s, {"foo": "caf\u00e9".encode("latin-1")}, query.Query().is__id(pk), connection=connection)
+                d = i.get_one(s, query.Query().is__id(pk), connection=connection)
+
+            finally:
+                connection.set_client_encoding("UTF8")
+
+        self.assertEqual("caf\u00e9", d["foo"])
+
+    def test_notify(self):
+        i, s = self.get_table()
+        i.set_notify(s)
+        i.set_notify(s) # installing it again replaces it
+
+        listener = i.spawn()
+        with listener.connection() as connection:
+            listener.listen(s, connection=connection)
+            self.assertEqual([], listener.notifications(s, 0, connection=connection))
+
+            pk = self.insert(i, s, 1)[0]
+            i.update(s, {"foo": 2}, query.Query().is__id(pk))
+            start = time.time()
+            pks = listener.notifications(s, 5, connection=connection)
+            if len(pks) < 2:
+                pks.extend(listener.notifications(s, 5, connection=connection))
+            self.assertEqual([pk, pk], pks)
+            self.assertLess(time.time() - start, 1)
+        listener.close()
+
+    def test_watch_notify(self):
+        orm_class = self.get_orm_class()
+        # the listening connection can't come from a pool that only has one
+        orm_class.interface = DsnConnection(
+            os.environ["PROM_POSTGRES_DSN"] + "?async=1&pool_maxconn=1&pool_timeout=2"
+        ).interface
+        self.connections.add(orm_class.interface)
+        orm_class.install()
+        pks = [orm_class.create(foo=i, bar="v{}".format(i)).pk for i in range(2)]
+
+        # reading the table doesn't install its trigger
+        i, s = orm_class.interface, orm_class.schema
+        self.assertFalse(i.has_notify(s))
+        i.set_notify(s)
+        self.assertTrue(i.has_notify(s))
+
+        qu = queue.Queue()
+        def target():
+            for o in orm_class.query.gt_pk(pks[0]).watch(interval=0.1, timeout=5):
+                qu.put(o.pk)
+        t = threading.Thread(target=target)
+        t.daemon = True
+        t.start()
+
+        self.assertEqual(pks[1], qu.get(timeout=5))
+        orm_class.query.is_pk(pks[0]).set_foo(10).update()
+        pk = orm_class.create(foo=3, bar="v3").pk
+        # the update of pks[0] doesn't match the watched query
+        self.assertEqual(pk, qu.get(timeout=5))
+        t.join()
+        self.assertTrue(qu.empty())
+
+    def test_explain_analyze(self):
+        i, s = self.get_table()
+        self.insert(i, s, 5)
+        plan = i.explain(s, query.Query().is_foo(1), analyze=True)
+        self.assertTrue(any("actual time" in line for line in plan))
+
     def test_no_db_error(self):
         # we want to replace the db with a bogus db error
         i, s = self.get_table()
@@ -257,6 +353,140 @@ class InterfacePGBouncerTest(InterfacePostgresTest):
         self.assertGreater(len(d), 0)
 
 
+class InterfacePostgresPoolTest(BaseTestInterface):
+    pool_class = ConnectionPool
+
+    @classmethod
+    def create_interface(cls):
+        orig_url = os.environ["PROM_POSTGRES_DSN"]
+        os.environ["PROM_POSTGRES_DSN"] += '?async=1&pool_maxconn=3&pool_timeout=5&pool_pre_ping=1'
+        if cls.pool_class is not ConnectionPool:
+            os.environ["PROM_POSTGRES_DSN"] += '&pool_class={}.{}'.format(
+                cls.pool_class.__module__,
+                cls.pool_class.__name__
+            )
+        try:
+            i = cls.create_postgres_interface()
+
+        finally:
+            os.environ["PROM_POSTGRES_DSN"] = orig_url
+
+        return i
+
+    def get_pool(self, minconn=0, maxconn=2, **kwargs):
+        i = self.get_interface()
+        c = i.connection_config
+        return self.pool_class(
+            minconn,
+            maxconn,
+            dbname=c.database,
+            user=c.username,
+            password=c.password,
+            host=c.host,
+            port=c.port or 5432,
+            **kwargs
+        )
+
+    def test_concurrency(self):
+        i = self.get_interface()
+        def target():
+            i.query('select pg_sleep(1)')
+
+        start = time.time()
+        ts = [threading.Thread(target=target) for _ in range(4)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+        elapsed = time.time() - start
+        self.assertTrue(elapsed >= 2.0 and elapsed < 3.0)
+        self.assertEqual(3, i.connection_pool.size)
+
+        s = i.stats()["pool"]
+        self.assertEqual(3, s["size"])
+        self.assertEqual(0, s["in_use"])
+        self.assertEqual(0, s["waiting"])
+        # one of the threads had to wait for a connection to free up
+        self.assertLess(0.9, s["wait_time"]["max"])
+        self.assertLess(0.9, s["hold_time"]["max"])
+        self.assertLess(0, s["connect_time"]["count"])
+
+    def test_transaction_pinned(self):
+        i, s = self.get_table()
+        i.set_table(s)
+        with i.transaction() as connection:
+            pk = i.insert(s, {"foo": 1, "bar": "one"})
+            # no connection was passed in so if it wasn't pinned this would
+            # be a different connection that can't see the uncommitted row
+            d = i.get_one(s, query.Query().is__id(pk))
+            self.assertEqual(pk, d["_id"])
+            self.assertIs(connection, i.get_pinned_connection())
+
+            # other threads don't use the pinned connection
+            ds = []
+            t = threading.Thread(target=lambda: ds.append(i.get_one(s, query.Query().is__id(pk))))
+            t.start()
+            t.join()
+            self.assertFalse(ds[0])
+
+        self.assertIsNone(i.get_pinned_connection())
+        self.assertEqual(1, i.count(s))
+
+    def test_timeout(self):
+        pool = self.get_pool(maxconn=1, timeout=0.5)
+        conn = pool.getconn()
+        with self.assertRaises(psycopg2.pool.PoolError):
+            pool.getconn()
+        self.assertEqual(1, pool.stats()["timeouts"])
+        self.assertEqual(1.0, pool.stats()["saturation"])
+
+        # a waiting thread gets the connection when it is put back
+        conns = []
+        t = threading.Thread(target=lambda: conns.append(pool.getconn()))
+        t.start()
+        pool.putconn(conn)
+        t.join()
+        self.assertIs(conn, conns[0])
+
+    def test_pre_ping(self):
+        pool = self.get_pool(pre_ping=True)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.close()
+
+        conn2 = pool.getconn()
+        self.assertFalse(conn2.closed)
+        self.assertIsNot(conn, conn2)
+        self.assertEqual(1, pool.size)
+
+    def test_rollback_on_put(self):
+        pool = self.get_pool()
+        conn = pool.getconn()
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        cur.execute("SELECT 1")
+        pool.putconn(conn)
+        self.assertEqual(
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+            conn.get_transaction_status()
+        )
+
+    def test_max_lifetime_and_idle(self):
+        pool = self.get_pool(maxconn=3, max_lifetime=0.5)
+        conn = pool.getconn()
+        time.sleep(0.6)
+        pool.putconn(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(0, pool.size)
+
+        pool = self.get_pool(minconn=1, maxconn=3, max_idle=0.5)
+        conns = [pool.getconn() for _ in range(3)]
+        for conn in conns: pool.putconn(conn)
+        self.assertEqual(3, pool.size)
+        time.sleep(0.6)
+        conn = pool.getconn()
+        self.assertEqual(1, pool.size)
+        pool.putconn(conn)
+
+
 @skipIf(gevent is None, "Skipping Gevent test because gevent module not installed")
 class XInterfacePostgresGeventTest(InterfacePostgresTest):
     """this class has an X to start so that it will run last when all tests are run"""
@@ -335,6 +565,46 @@ class XInterfacePostgresGeventTest(InterfacePostgresTest):
         self.assertEqual([], l)
 
 
+@skipIf(gevent is None, "Skipping Gevent test because gevent module not installed")
+class XInterfacePostgresGeventPoolTest(InterfacePostgresPoolTest):
+    """the threaded pool tests run against the gevent pool, this has an X to start
+    so that it will run last when all tests are run"""
+    @classmethod
+    def setUpClass(cls):
+        import gevent.monkey
+        gevent.monkey.patch_all()
+
+        import prom.gevent
+        prom.gevent.patch_all()
+        cls.pool_class = prom.gevent.ConnectionPool
+        super(XInterfacePostgresGeventPoolTest, cls).setUpClass()
+
+    def test_greenlets(self):
+        pool = self.get_pool(maxconn=2, timeout=0.5)
+
+        def target():
+            conn = pool.getconn()
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT pg_sleep(0.3)")
+
+            finally:
+                pool.putconn(conn)
+
+        # 2 connections for 5 greenlets, the last one has to wait 0.6 seconds for
+        # a connection so it should time out
+        gs = [gevent.spawn(target) for _ in range(5)]
+        gevent.joinall(gs)
+        errors = [g.exception for g in gs if g.exception]
+        self.assertEqual(1, len(errors))
+        self.assertTrue(isinstance(errors[0], psycopg2.pool.PoolError))
+
+        s = pool.stats()
+        self.assertEqual(2, s["size"])
+        self.assertEqual(0, s["in_use"])
+        self.assertEqual(1, s["timeouts"])
+
+
 # https://docs.python.org/2/library/unittest.html#load-tests-protocol
 # def load_tests(loader, tests, pattern):
 #     suite = TestSuite()
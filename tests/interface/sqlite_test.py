@@ -2,12 +2,16 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import os
 import datetime
+import decimal
+import time
+import threading
 
 import testdata
 
-from prom import query, InterfaceError
-from prom.interface.sqlite import SQLite
+from prom import query, InterfaceError, UniqueError
+from prom.interface.sqlite import SQLite, TimestampType, BooleanType, NumericType
 from prom.interface import configure
+from prom.config import DsnConnection
 from prom.model import Orm
 from prom.config import Field
 from prom.compat import *
@@ -33,6 +37,29 @@ class InterfaceTest(BaseTestCase):
         configure(dsn)
         self.assertFalse(InterTorm.interface.has_table(InterTorm.table_name))
 
+    def test_slow_query_log_dsn(self):
+        i = DsnConnection("sqlite://:memory:?slow_query_threshold=0.5&slow_query_explain=1").interface
+        slow = i.slow_query_log
+        self.assertEqual(0.5, slow.threshold)
+        self.assertTrue(slow.explain)
+        self.assertFalse(slow.analyze)
+        self.assertEqual(60.0, slow.explain_interval)
+        self.assertTrue(i.hooks.has("after"))
+        self.assertEqual(0.5, i.stats()["slow_query_log"]["threshold"])
+
+        i = DsnConnection("sqlite://:memory:").interface
+        self.assertIsNone(i.slow_query_log)
+        self.assertFalse(i.hooks)
+
+    def test_n_plus_one_dsn(self):
+        i = DsnConnection("sqlite://:memory:?n_plus_one_threshold=2&n_plus_one_raise=1").interface
+        n = i.n_plus_one
+        self.assertEqual(2, n.threshold)
+        self.assertTrue(n.raise_error)
+        self.assertTrue(i.hooks.has("after"))
+        self.assertEqual(0, i.stats()["n_plus_one"]["n_plus_ones"])
+        self.assertIsNone(DsnConnection("sqlite://:memory:").interface.n_plus_one)
+
 
 class InterfaceSQLiteTest(BaseTestInterface):
     @classmethod
@@ -67,6 +94,35 @@ class InterfaceSQLiteTest(BaseTestInterface):
         r = i.get_one(schema, q.offset(2))
         self.assertEqual(r["ZTIMESTAMP"], datetime.datetime(5352, 11, 1, 10, 52, 47))
 
+    def test_converters(self):
+        self.assertEqual(
+            datetime.datetime(2020, 1, 2, 3, 4, 5, 678000),
+            TimestampType.convert(b"2020-01-02 03:04:05.678")
+        )
+        # fromisoformat can't parse 5 digit fractions before python 3.11
+        self.assertEqual(
+            datetime.datetime(2020, 1, 2, 3, 4, 5, 678900),
+            TimestampType.convert(b"2020-01-02 03:04:05.67890")
+        )
+        self.assertEqual(datetime.datetime.min, TimestampType.convert(b"-62167219200"))
+
+        self.assertFalse(BooleanType.convert(b"0"))
+        self.assertTrue(BooleanType.convert(b"1"))
+        self.assertEqual(1, BooleanType.adapt(True))
+
+        self.assertEqual(decimal.Decimal("1.25"), NumericType.convert(b"1.25"))
+
+    def test_fields_bool(self):
+        table_name = self.get_table_name()
+        schema = self.get_schema(table_name, ZBOOL=Field(bool, True))
+        i = self.create_interface()
+        i.set_table(schema)
+
+        pk1 = i.insert(schema, {"ZBOOL": True})
+        pk2 = i.insert(schema, {"ZBOOL": False})
+        self.assertIs(True, i.get_one(schema, query.Query().is__id(pk1))["ZBOOL"])
+        self.assertIs(False, i.get_one(schema, query.Query().is__id(pk2))["ZBOOL"])
+
     def test_get_fields_float(self):
         sql = "\n".join([
             "CREATE TABLE ZFOOBAR (",
@@ -183,6 +239,53 @@ class InterfaceSQLiteTest(BaseTestInterface):
         _id = self.insert(i, s, 1)[0]
         self.assertTrue(_id)
 
+    def get_pragma_interface(self, **options):
+        path = testdata.get_file("pragmas.sqlite").path
+        dsn = "prom.interface.sqlite.SQLite://{}?{}".format(
+            path,
+            "&".join("{}={}".format(k, v) for k, v in options.items())
+        )
+        i = DsnConnection(dsn).interface
+        self.connections.add(i)
+        return i
+
+    def test_pragmas(self):
+        i = self.get_pragma_interface(profile="fast-local", cache_size=-1000)
+        p = i.get_pragmas(i.pragma_names)
+        self.assertEqual("wal", p["journal_mode"])
+        self.assertEqual(1, p["synchronous"]) # NORMAL
+        self.assertEqual(-1000, p["cache_size"])
+        self.assertEqual(2, p["temp_store"]) # MEMORY
+
+        i = self.get_pragma_interface(synchronous="FULL")
+        self.assertEqual(2, i.get_pragmas(["synchronous"])["synchronous"])
+
+        with self.assertRaises(ValueError):
+            i.set_pragmas({"synchronous": "OFF; DROP TABLE foo"})
+
+        with self.assertRaises(ValueError):
+            self.get_pragma_interface(profile="foo").connect()
+
+    def test_bulk_load(self):
+        i = self.get_pragma_interface(profile="durable")
+        s = self.get_schema()
+        i.set_table(s)
+
+        with i.bulk_load() as connection:
+            self.assertEqual(0, i.get_pragmas(["synchronous"])["synchronous"])
+            self.insert(i, s, 10)
+
+        self.assertEqual(10, i.count(s))
+        self.assertEqual(2, i.get_pragmas(["synchronous"])["synchronous"])
+
+        with self.assertRaises(InterfaceError):
+            with i.bulk_load():
+                self.insert(i, s, 10)
+                raise InterfaceError(ValueError("rollback"))
+
+        self.assertEqual(10, i.count(s))
+        self.assertEqual(2, i.get_pragmas(["synchronous"])["synchronous"])
+
     def test_list_field(self):
         from prom import Field, Orm
         class ListFieldOrm(Orm):
@@ -224,6 +327,186 @@ class InterfaceSQLiteTest(BaseTestInterface):
 #         i.close()
 
 
+class InterfaceSQLiteThreadTest(InterfaceSQLiteTest):
+    @classmethod
+    def create_interface(cls, **options):
+        options.setdefault("per_thread", 1)
+        orig_url = os.environ["PROM_SQLITE_DSN"]
+        os.environ["PROM_SQLITE_DSN"] += "?" + "&".join(
+            "{}={}".format(k, v) for k, v in options.items()
+        )
+        try:
+            i = cls.create_sqlite_interface()
+
+        finally:
+            os.environ["PROM_SQLITE_DSN"] = orig_url
+
+        return i
+
+    def test_threads(self):
+        i, s = self.get_table()
+        self.insert(i, s, 5)
+        self.assertEqual("wal", i.query("PRAGMA journal_mode")[0]["journal_mode"])
+
+        started = threading.Event()
+        counted = threading.Event()
+        counts = []
+        connections = set()
+
+        def writer():
+            with i.transaction() as connection:
+                connections.add(id(connection))
+                self.insert(i, s, 1)
+                started.set()
+                # the reader has to finish while this transaction holds the write lock
+                counted.wait(5)
+
+        def reader():
+            started.wait(5)
+            with i.connection() as connection:
+                connections.add(id(connection))
+            counts.append(i.count(s))
+            counted.set()
+
+        ts = [threading.Thread(target=writer), threading.Thread(target=reader)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+
+        self.assertEqual([5], counts)
+        self.assertEqual(2, len(connections))
+        self.assertEqual(6, i.count(s))
+        self.assertLessEqual(1, i.stats()["connections"])
+
+    def test_lock_retry(self):
+        i, s = self.get_table()
+        self.insert(i, s, 1)
+
+        # busy_timeout=0 means the lock is never waited on so the retries are
+        # what get the insert through
+        i2 = self.create_interface(busy_timeout=0, lock_retries=4, lock_backoff=0.1)
+        i2.connect()
+
+        with i.transaction():
+            self.insert(i, s, 1)
+            with self.assertRaises(InterfaceError):
+                i3 = self.create_interface(busy_timeout=0, lock_retries=0)
+                i3.connect()
+                self.insert(i3, s, 1)
+
+            start = time.time()
+            ts = [threading.Thread(target=lambda: self.insert(i2, s, 1))]
+            for t in ts: t.start()
+            time.sleep(0.2)
+
+        for t in ts: t.join()
+        self.assertLess(0.2, time.time() - start)
+        self.assertEqual(3, i.count(s))
+
+    def test_lock_transaction(self):
+        i, s = self.get_table()
+        i2 = self.create_interface(busy_timeout=0, lock_retries=0)
+        i2.connect()
+
+        # the transaction takes the write lock when it starts, not at its first
+        # write, so it can read and then write no matter what other connections do
+        with i.transaction():
+            self.assertEqual(0, i.count(s))
+            with self.assertRaises(InterfaceError):
+                self.insert(i2, s, 1)
+            self.insert(i, s, 1)
+
+        with i.transaction():
+            with self.assertRaises(InterfaceError):
+                with i2.transaction():
+                    pass
+
+            # the transaction that couldn't start left nothing behind
+            self.assertIsNone(i2.get_pinned_connection())
+            with i2.connection() as connection:
+                self.assertFalse(connection.in_transaction())
+
+        self.insert(i2, s, 1)
+        self.assertEqual(2, i.count(s))
+
+    def test_db_disconnect(self):
+        i, s = self.get_table()
+        _id = self.insert(i, s, 1)[0]
+
+        with i.connection() as connection:
+            connection.close()
+
+        _id = self.insert(i, s, 1)[0]
+        d = i.get_one(s, query.Query().is__id(_id))
+        self.assertGreater(len(d), 0)
+
+    def test_in_memory_db(self):
+        config = DsnConnection("prom.interface.sqlite.SQLite://:memory:?per_thread=1")
+        with self.assertRaises(ValueError):
+            config.interface.connect()
+
+
+class InterfaceSQLiteGroupCommitTest(InterfaceSQLiteThreadTest):
+    @classmethod
+    def create_interface(cls, **options):
+        options.setdefault("group_commit", 1)
+        return super(InterfaceSQLiteGroupCommitTest, cls).create_interface(**options)
+
+    def test_group_commit(self):
+        i, s = self.get_table()
+        futures = [i.submit("insert", s, {"foo": n, "bar": "v{}".format(n)}) for n in range(100)]
+        pks = [f.result() for f in futures]
+        self.assertEqual(100, len(set(pks)))
+        self.assertEqual(100, i.count(s))
+
+        # the writes that queued up while a batch committed went in together
+        batches = i.stats()["writer"]["batch_size"]
+        self.assertEqual(100, batches["sum"])
+        self.assertLess(batches["count"], 100)
+
+    def test_group_commit_threads(self):
+        i, s = self.get_table()
+        errors = []
+
+        def target():
+            try:
+                for _ in range(10):
+                    self.insert(i, s, 1)
+            except Exception as e:
+                errors.append(e)
+
+        ts = [threading.Thread(target=target) for _ in range(8)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+        self.assertEqual([], errors)
+        self.assertEqual(80, i.count(s))
+
+    def test_group_commit_errors(self):
+        i, s = self.get_table()
+        pk = self.insert(i, s, 1)[0]
+
+        good = i.submit("insert", s, {"foo": 1, "bar": "one"})
+        bad = i.submit("insert", s, {"_id": pk, "foo": 2, "bar": "two"})
+
+        # a write that fails doesn't take the rest of its batch down with it
+        self.assertTrue(good.result())
+        self.assertTrue(isinstance(bad.exception(), UniqueError))
+        with self.assertRaises(UniqueError):
+            i.insert(s, {"_id": pk, "foo": 2, "bar": "two"})
+        self.assertEqual(2, i.count(s))
+
+    def test_group_commit_transaction(self):
+        i, s = self.get_table()
+        with self.assertRaises(ValueError):
+            with i.transaction():
+                # inside a transaction writes go to the transaction's connection
+                self.insert(i, s, 1)
+                self.assertEqual(1, i.count(s))
+                raise ValueError()
+
+        self.assertEqual(0, i.count(s))
+        self.assertFalse("writer" in i.stats())
+
+
 # not sure I'm a huge fan of this solution to remove common parent from testing queue
 # http://stackoverflow.com/questions/1323455/python-unit-test-with-base-and-sub-class
 del(BaseTestInterface)
@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, division, print_function, absolute_import
 import os
+import json
 
 from prom import query
 from prom.model import Orm
 import prom
 from captain.client import Captain
 
-from . import BaseTestCase as BTC, testdata
+from . import BaseTestCase as BTC, SkipTest, testdata
 
 from prom.cli.dump import get_orm_classes, get_table_map, get_subclasses
+from prom.cli.top import (
+    normalize_sql,
+    get_table_names,
+    get_orm_map,
+    get_pg_statements,
+    get_dump_statements,
+    get_report,
+    format_report,
+)
+from prom.metrics import Registry
 import prom.interface
 
 
@@ -259,4 +270,108 @@ class DumpTest(BaseTestCase):
         self.assertEqual(s, set([str(o.schema) for o in orms]))
 
 
+class TopTest(BaseTestCase):
+    command = "top"
+
+    def test_normalize_sql(self):
+        sql = normalize_sql(" ".join([
+            'SELECT * FROM "foo" WHERE "bar" = $1 AND "che" IN ($2, $3)',
+            "AND baz = 'it''s' LIMIT 10 OFFSET 0 /*caller='a%3Ab'*/",
+        ]))
+        self.assertEqual(
+            'SELECT * FROM "foo" WHERE "bar" = ? AND "che" IN (...) AND baz = ? LIMIT ? OFFSET ?',
+            sql
+        )
+        self.assertEqual(normalize_sql("SELECT 1 FROM foo WHERE bar IN (%s)"), normalize_sql("SELECT 2 FROM foo WHERE bar IN (?, ?)"))
+
+        sql = 'SELECT * FROM "public"."foo" JOIN bar ON 1 = 1 WHERE x IN (SELECT y FROM foo)'
+        self.assertEqual(["foo", "bar"], get_table_names(sql))
+        self.assertEqual(["foo"], get_table_names('UPDATE "foo" SET "bar" = ?'))
+        self.assertEqual(["foo"], get_table_names('INSERT INTO "foo" ("bar") VALUES (?)'))
+
+    def test_stats(self):
+        orm_class = self.get_orm_class()
+        orm_class.interface = self.create_sqlite_interface()
+        orm_class.install()
+
+        r = Registry()
+        r.add(orm_class.interface)
+        try:
+            orm_class.create(foo=1, bar="one")
+            for foo in range(3):
+                orm_class.query.is_foo(foo).get_one()
+        finally:
+            r.remove(orm_class.interface)
+
+        path = testdata.create_file("prom-stats.json")
+        r.dump(path)
+
+        statements = get_dump_statements(path)
+        report = get_report(statements)
+        orm_name = "{}.{}".format(orm_class.__module__, orm_class.__name__)
+        heaviest = format_report(report, sort="calls", limit=1)
+        self.assertEqual(3, len(heaviest))
+        self.assertTrue(orm_name in heaviest[1])
+        self.assertTrue(heaviest[1].split()[1] == "3")
+        self.assertTrue("SELECT" in heaviest[2])
+
+        r = [r for r in report if r["calls"] == 3][0]
+        self.assertEqual([orm_class.table_name], r["tables"])
+        self.assertEqual(r["total"] / 3, r["mean"])
+        self.assertEqual(1, r["rows"])
+
+    def test_orm_map(self):
+        testdata.create_modules({
+            "topobjects.foo": [
+                "import prom",
+                "class Foo(prom.Orm):",
+                "    table_name = 'top_foo'",
+                "    bar = prom.Field(int)",
+                ""
+            ],
+        })
+        orm_map = get_orm_map(["topobjects"])
+        self.assertEqual(set(["topobjects.foo.Foo"]), orm_map["top_foo"])
+
+        statements = [
+            {"sql": 'SELECT * FROM "top_foo" WHERE "bar" = $1', "orm": "", "calls": 4, "total": 2.0, "rows": 4},
+            {"sql": 'SELECT * FROM "top_foo" WHERE "bar" = %s', "orm": "", "calls": 1, "total": 3.0, "rows": 0},
+            {"sql": 'SELECT * FROM "top_bar"', "orm": "", "calls": 10, "total": 1.0, "rows": 100},
+        ]
+        report = get_report(statements, orm_map)
+        self.assertEqual(2, len(report))
 
+        lines = format_report(report)
+        self.assertTrue(lines[1].endswith("topobjects.foo.Foo"))
+        self.assertTrue(lines[1].split()[0] == "5.000")
+        self.assertTrue(lines[3].endswith("top_bar"))
+
+        lines = format_report(report, sort="rows", width=10)
+        self.assertTrue(lines[1].endswith("top_bar"))
+        self.assertEqual("    SELECT ...", lines[2])
+
+    def test_pg_statements(self):
+        with self.assertRaises(RuntimeError):
+            get_pg_statements(self.create_sqlite_interface())
+
+        i = self.get_interface()
+        try:
+            statements = get_pg_statements(i)
+        except RuntimeError:
+            raise SkipTest("pg_stat_statements is not installed")
+
+        self.assertTrue(all(set(["sql", "calls", "total", "rows"]) <= set(s) for s in statements))
+
+    def test_cli(self):
+        path = testdata.create_file("prom-stats.json", json.dumps({
+            "queries": [
+                {"sql": 'SELECT * FROM "top_che" WHERE "bar" = ?', "orm": "topcli.Che", "count": 7, "duration": 1.5, "rows": 7},
+                {"sql": 'SELECT * FROM "top_baz"', "orm": "topcli.Baz", "count": 2, "duration": 3.0, "rows": 20},
+            ]
+        }))
+
+        c = self.create_script()
+        r = c.run("--stats=\"{}\" --sort=calls --limit=1".format(path))
+        self.assertTrue("topcli.Che" in r)
+        self.assertFalse("topcli.Baz" in r)
+        self.assertTrue('SELECT * FROM "top_che" WHERE "bar" = ?' in r)
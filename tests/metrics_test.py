@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import time
+import threading
+
+from . import BaseTestCase, TestCase
+from prom import metrics
+from prom.config import DsnConnection
+from prom.metrics import Counter, Gauge, Histogram, Registry
+from prom.query import CacheQuery
+import prom
+
+
+class CounterTest(TestCase):
+    def test_threads(self):
+        c = Counter()
+        def target():
+            for _ in range(1000):
+                c.incr()
+
+        ts = [threading.Thread(target=target) for _ in range(4)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+        self.assertEqual(4000, c.stats())
+
+    def test_gauge(self):
+        g = Gauge()
+        g.incr(5)
+        g.decr(2)
+        self.assertEqual(3, g.stats())
+        g.set(10)
+        self.assertEqual(10, g.stats())
+
+
+class HistogramTest(TestCase):
+    def test_observe(self):
+        h = Histogram(buckets=[0.1, 1.0])
+        for v in [0.05, 0.05, 0.5, 5.0]:
+            h.observe(v)
+
+        s = h.stats()
+        self.assertEqual(4, s["count"])
+        self.assertEqual(5.0, s["max"])
+        self.assertEqual([(0.1, 2), (1.0, 3), (float("inf"), 4)], s["buckets"])
+        self.assertEqual(0.1, s["p50"])
+        self.assertEqual(5.0, s["p99"])
+
+    def test_time(self):
+        h = Histogram()
+        with h.time():
+            time.sleep(0.1)
+        self.assertLess(0.09, h.stats()["sum"])
+
+
+class InterfaceStatsTest(BaseTestCase):
+    def test_stats(self):
+        i = self.get_interface()
+        s = i.stats()
+        self.assertTrue(s["connected"])
+        self.assertEqual(0, s["reconnect_attempts"])
+        self.assertTrue("pool" in s)
+
+
+class RegistryTest(BaseTestCase):
+    def test_render(self):
+        r = Registry()
+        orm_class = self.get_orm_class()
+        i = orm_class.interface
+        r.add(i)
+        orm_class.install()
+
+        for x in range(3):
+            orm_class.create(foo=x, bar=str(x))
+        orm_class.query.is_foo(1).get_one()
+        orm_class.query.is_foo(2).get_one()
+        list(orm_class.query.gte_foo(0).get())
+        with self.assertRaises(prom.InterfaceError):
+            i.query("SELECT * FROM {}".format(self.get_table_name()))
+
+        orm = "{}.{}".format(orm_class.__module__, orm_class.__name__)
+        s = r.snapshot()
+        queries = [q for q in s["queries"] if q["orm"] == orm and q["method"] == "get_one"]
+        self.assertEqual(1, len(queries))
+        self.assertEqual(2, queries[0]["count"])
+        self.assertTrue(orm_class.table_name in queries[0]["sql"])
+
+        orms = dict(((o["orm"], o["method"]), o) for o in s["orms"])
+        self.assertEqual(3, orms[(orm, "insert")]["duration"]["count"])
+        self.assertEqual(3, orms[(orm, "get")]["rows"])
+        self.assertEqual(1, orms[("", "")]["errors"])
+
+        text = r.render()
+        self.assertTrue("# TYPE prom_queries_total counter" in text)
+        self.assertTrue('prom_queries_total{{fingerprint="{}",method="get_one",orm="{}"}} 2'.format(
+            queries[0]["fingerprint"],
+            orm
+        ) in text)
+        self.assertTrue('prom_query_duration_seconds_count{{method="insert",orm="{}"}} 3'.format(orm) in text)
+        self.assertTrue('prom_query_duration_seconds_bucket{{le="+Inf",method="insert",orm="{}"}} 3'.format(orm) in text)
+        self.assertTrue("prom_interface_reconnect_attempts_total" in text)
+        self.assertTrue("prom_interface_connected" in text)
+
+        r.reset()
+        self.assertEqual([], r.snapshot()["queries"])
+        self.assertEqual(1, len(r.snapshot()["interfaces"]))
+
+        r.remove(i)
+        self.assertFalse(i.hooks)
+        self.assertEqual([], r.snapshot()["interfaces"])
+
+    def test_cache(self):
+        r = Registry()
+        orm_class = self.get_orm_class()
+        orm_class.query_class = CacheQuery
+        r.add(orm_class.interface)
+        r.reset()
+        CacheQuery.cached = {}
+        CacheQuery.cache_activate(True)
+        try:
+            orm_class.create(foo=1, bar="one")
+            for x in range(4):
+                orm_class.query.is_foo(1).count()
+
+        finally:
+            CacheQuery.cache_activate(False)
+            r.remove(orm_class.interface)
+
+        cache = r.snapshot()["cache"][0]
+        self.assertEqual(3, cache["hits"])
+        self.assertEqual(1, cache["misses"])
+        self.assertEqual(0.75, cache["hit_ratio"])
+        self.assertTrue('prom_cache_requests_total{{orm="{}",result="hit"}} 3'.format(cache["orm"]) in r.render())
+
+    def test_errors_only(self):
+        r = Registry()
+        i = self.get_interface()
+        r.add(i)
+        with self.assertRaises(prom.InterfaceError):
+            i.query("SELECT * FROM {}".format(self.get_table_name()))
+
+        orms = r.snapshot()["orms"]
+        self.assertEqual(1, len(orms))
+        self.assertEqual(1, orms[0]["errors"])
+        self.assertEqual(0, orms[0]["duration"]["count"])
+        self.assertTrue('prom_query_errors_total{method="",orm=""} 1' in r.render())
+
+    def test_configure(self):
+        i = DsnConnection("sqlite://:memory:?metrics=1").interface
+        prom.set_interface(i, "metrics-configure")
+        try:
+            self.assertTrue(i in metrics.registry.interfaces)
+            self.assertTrue(i.hooks.has("after"))
+
+        finally:
+            prom.set_interface(self.get_interface(), "metrics-configure")
+
+        self.assertFalse(i in metrics.registry.interfaces)
+        self.assertFalse(i.hooks)
@@ -2,6 +2,7 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import datetime
 import time
+import multiprocessing
 from threading import Thread
 import sys
 
@@ -15,6 +16,7 @@ from prom.query import Query, \
     CacheQuery, \
     Iterator, \
     AllIterator
+from prom.utils import Rows
 from prom.compat import *
 import prom
 
@@ -44,6 +46,47 @@ class FieldsTest(TestCase):
         self.assertEqual(2, len(fs.get("foo")))
 
 
+class FingerprintTest(TestCase):
+    def test_shape_and_args(self):
+        q1 = Query().is_foo(1).in_bar([1, 2, 3]).desc_che()
+        q2 = Query().is_foo(2).in_bar([4, 5]).desc_che()
+        fp1 = q1.fingerprint("get")
+        fp2 = q2.fingerprint("get")
+        self.assertEqual(fp1.shape, fp2.shape)
+        self.assertNotEqual(fp1.args, fp2.args)
+        self.assertNotEqual(fp1.hash, fp2.hash)
+
+        # IS NULL is a different query than = %s
+        q3 = Query().is_foo(None).in_bar([1, 2, 3]).desc_che()
+        self.assertNotEqual(fp1.shape, q3.fingerprint("get").shape)
+
+        self.assertNotEqual(fp1.shape, q1.fingerprint("count").shape)
+        self.assertNotEqual(fp1.shape, q1.copy().limit(10).fingerprint("get").shape)
+
+    def test_types(self):
+        """str() of these values are equal but they are different queries"""
+        self.assertNotEqual(
+            Query().is_foo(1).fingerprint().hash,
+            Query().is_foo("1").fingerprint().hash,
+        )
+        self.assertNotEqual(
+            Query().is_foo(1).fingerprint().hash,
+            Query().is_foo(True).fingerprint().hash,
+        )
+
+    def test_incremental(self):
+        q1 = Query().is_foo(1).gt_bar(2).set_limit(5)
+        q2 = Query().is_foo(1).gt_bar(2).set_limit(5)
+        self.assertEqual(q1.fingerprint().hash, q2.fingerprint().hash)
+        self.assertEqual(q1.fingerprint().hash, q1.copy().fingerprint().hash)
+
+        q2.lt_bar(10)
+        self.assertNotEqual(q1.fingerprint().hash, q2.fingerprint().hash)
+
+        q1.reset()
+        self.assertEqual(Query().fingerprint().hash, q1.fingerprint().hash)
+
+
 class LimitTest(TestCase):
     def test___nonzero__(self):
         b = Limit()
@@ -160,6 +203,34 @@ class QueryTest(EnvironTestCase):
         #testdata.wait(lambda: qu.qsize() == 8)
         testdata.wait(check, [8])
 
+    def test_watch_updates(self):
+        _q = self.get_query()
+        orm_class = _q.orm_class
+        pks = [orm_class.create(foo=i, bar="v{}".format(i)).pk for i in range(2)]
+        qu = queue.Queue()
+
+        def target():
+            for o in _q.copy().watch(interval=0.1, timeout=5, batch_size=2):
+                qu.put((o.pk, o.foo))
+        t = Thread(target=target)
+        t.daemon = True
+        t.start()
+
+        testdata.wait(lambda: qu.qsize() == 2)
+        qu.get()
+        qu.get()
+
+        o = orm_class.query.get_pk(pks[0])
+        o.foo = 1000
+        o.save()
+        testdata.wait(lambda: qu.qsize() == 1)
+        self.assertEqual((pks[0], 1000), qu.get())
+
+        for i in range(3):
+            pks.append(orm_class.create(foo=i, bar="v{}".format(i)).pk)
+        testdata.wait(lambda: qu.qsize() == 3)
+        self.assertEqual(pks[2:], sorted(qu.get()[0] for _ in range(3)))
+
     def test_like(self):
         _q = self.get_query()
         self.insert(_q, 5)
@@ -247,6 +318,140 @@ class QueryTest(EnvironTestCase):
         q.reduce(target_map, target_reduce)
         self.assertEqual(40, len(pks))
 
+    def test_reduce_modes(self):
+        _q = self.get_query()
+        pks = self.insert(_q, 100)
+
+        for mode in ["process", "thread"]:
+            vals = []
+            def target_map(o):
+                # 0 isn't None so it should still be reduced
+                return o.pk % 2
+
+            # small ranges and a slow reduce so the workers have to wait on it
+            def target_reduce(v):
+                time.sleep(0.001)
+                vals.append(v)
+
+            _q.copy().reduce(target_map, target_reduce, threads=3, mode=mode, chunk_size=7)
+            self.assertEqual(100, len(vals))
+            self.assertEqual(50, sum(vals))
+
+        with self.assertRaises(ValueError):
+            _q.copy().reduce(target_map, target_reduce, mode="foo")
+
+    def test_reduce_pks(self):
+        _q = self.get_query()
+        pks = self.insert(_q, 10)
+
+        for mode in ["process", "thread"]:
+            vals = []
+            _q.copy().in_pk([pks[1], pks[2], pks[3]]).reduce(
+                lambda o: o.pk,
+                vals.append,
+                threads=2,
+                mode=mode,
+                chunk_size=2
+            )
+            self.assertEqual(set(pks[1:4]), set(vals))
+
+            vals = []
+            _q.copy().is_pk(pks[4]).reduce(lambda o: o.pk, vals.append, threads=2, mode=mode)
+            self.assertEqual([pks[4]], vals)
+
+            vals = []
+            _q.copy().nin_pk(pks[:8]).reduce(lambda o: o.pk, vals.append, threads=2, mode=mode)
+            self.assertEqual(set(pks[8:]), set(vals))
+
+        q = _q.copy().in_pk([pks[1], pks[2], pks[1], pks[3]])
+        self.assertEqual(
+            [(None, None, [pks[1], pks[2]]), (None, None, [pks[3]])],
+            list(q.reduce_ranges(q, 2))
+        )
+
+        q = _q.copy().in_pk([pks[1], pks[2], pks[3]]).limit(2)
+        self.assertEqual([(None, None)], list(q.reduce_ranges(q, 2)))
+        self.assertEqual(2, q.bounds.limit)
+
+        q = _q.copy().gt_pk(pks[2]).reduce_query(pks[5], pks[6])
+        self.assertEqual([pks[5], pks[6]], list(q.pks()))
+
+    def test_reduce_close(self):
+        _q = self.get_query()
+        self.insert(_q, 10)
+
+        spawned = []
+        spawn = _q.interface.spawn
+        def spawn_close():
+            inter = spawn()
+            spawned.append(inter)
+            return inter
+        _q.interface.spawn = spawn_close
+
+        vals = []
+        _q.copy().reduce(lambda o: o.pk, vals.append, threads=3, mode="thread", chunk_size=2)
+        self.assertEqual(10, len(vals))
+        self.assertLess(0, len(spawned))
+        if "sqlite" not in _q.interface.connection_config.interface_name.lower():
+            # a SQLite connection can only be closed by its own thread
+            for inter in spawned:
+                self.assertFalse(inter.connected)
+
+    def test_reduce_ranges(self):
+        _q = self.get_query()
+        pks = self.insert(_q, 10)
+
+        q = _q.copy().limit(5).offset(2)
+        self.assertEqual(
+            [(pks[2], pks[4]), (pks[5], pks[6])],
+            list(q.reduce_ranges(q, 3))
+        )
+        self.assertFalse(q.bounds)
+
+        q = _q.copy().gt_pk(pks[-1])
+        self.assertEqual([], list(q.reduce_ranges(q, 3)))
+
+        # ranges are by row count, so sparse pks don't make empty ranges
+        # the query's own pk conditions are kept
+        q = _q.copy().gt_pk(pks[5]).lt_pk(pks[8])
+        self.assertEqual([(pks[6], pks[7])], list(q.reduce_ranges(q, 2)))
+
+        _q.copy().nin_pk([pks[0], pks[5], pks[9]]).delete()
+        q = _q.copy()
+        self.assertEqual([(pks[0], pks[5]), (pks[9], pks[9])], list(q.reduce_ranges(q, 2)))
+
+        # the limit is in pk order so it can't be kept with another sort
+        q = _q.copy().desc_foo().limit(2)
+        with self.assertRaises(ValueError):
+            list(q.reduce_ranges(q, 2))
+
+        q = _q.copy().desc_foo()
+        self.assertEqual(2, len(list(q.reduce_ranges(q, 2))))
+
+    def test_reduce_timeout(self):
+        _q = self.get_query()
+        self.insert(_q, 2)
+
+        def target_map(o):
+            time.sleep(0.5)
+
+        with self.assertRaises(multiprocessing.TimeoutError):
+            _q.copy().reduce(target_map, lambda v: None, threads=1, mode="thread", timeout=0.1)
+
+    def test_reduce_error(self):
+        _q = self.get_query()
+        self.insert(_q, 10)
+
+        def target_map(o):
+            raise ValueError(o.pk)
+
+        def target_reduce(v):
+            pass
+
+        for mode in ["process", "thread"]:
+            with self.assertRaises(ValueError):
+                _q.copy().reduce(target_map, target_reduce, threads=2, mode=mode, chunk_size=3)
+
     def test_between(self):
         _q = self.get_query()
         self.insert(_q, 5)
@@ -577,6 +782,52 @@ class QueryTest(EnvironTestCase):
         vals = _q.copy().select_foo().values(limit=1)
         self.assertEqual(1, len(vals))
 
+    def test_tuple_rows(self):
+        orm_class = self.get_orm_class()
+        self.insert(orm_class, 3)
+
+        rows = orm_class.query.asc_pk()._interface_query("get")
+        self.assertTrue(isinstance(rows, Rows))
+
+        class DictQuery(orm_class.query_class):
+            tuple_rows = False
+
+        rows = DictQuery(orm_class).asc_pk()._interface_query("get")
+        self.assertFalse(isinstance(rows, Rows))
+
+        it = orm_class.query.asc_pk().get()
+        self.assertEqual(set(), it[0].modified_fields)
+        dit = DictQuery(orm_class).asc_pk().get()
+        self.assertEqual([o.fields for o in dit], [o.fields for o in it])
+
+        self.assertEqual(
+            list(DictQuery(orm_class).asc_pk().select_bar().select_pk().values()),
+            list(orm_class.query.asc_pk().select_bar().select_pk().values())
+        )
+
+        # raw queries still get dict rows
+        r = orm_class.query.raw("SELECT * FROM {}".format(orm_class.table_name))
+        self.assertEqual(it[0].pk, r[0]["_id"])
+
+        # rows are hydrated straight from the tuples, unless the class changes how
+        # it's hydrated
+        hydrate = orm_class.row_hydrator(["bar", "_id", "che"])
+        o = hydrate(("one", 5, "ignored"))
+        self.assertEqual(5, o.pk)
+        self.assertEqual("one", o.bar)
+        self.assertIsNone(o.foo)
+        self.assertEqual(set(), o.modified_fields)
+
+        populated = []
+        class PopulateOrm(orm_class):
+            def populate(self, fields=None, **fields_kwargs):
+                populated.append(fields)
+                return super(PopulateOrm, self).populate(fields, **fields_kwargs)
+
+        os = PopulateOrm.query.asc_pk().get()
+        self.assertEqual([o.fields for o in it], [o.fields for o in os])
+        self.assertEqual(3, len(populated))
+
     def test_pk(self):
         orm_class = self.get_orm_class()
         v = orm_class.query.pk()
@@ -1278,3 +1529,46 @@ class CacheQueryTest(QueryTest):
         #pout.v(orm_class.query.cache_namespace)
 
 
+class SingleFlightQueryTest(BaseTestCase):
+    def test_single_flight(self):
+        orm_class = self.get_orm_class()
+        self.insert(orm_class, 5)
+        calls = []
+
+        class SFQuery(orm_class.query_class):
+            single_flight = True
+            def _interface_query(self, method_name, **kwargs):
+                calls.append(method_name)
+                time.sleep(0.3)
+                return super(SFQuery, self)._interface_query(method_name, **kwargs)
+        orm_class.query_class = SFQuery
+
+        results = []
+        def target():
+            results.append(list(orm_class.query.set_limit(2).get().pk))
+
+        ts = [Thread(target=target) for _ in range(4)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(4, len(results))
+        for r in results:
+            self.assertEqual(2, len(r))
+
+    def test_single_flight_key(self):
+        orm_class = self.get_orm_class()
+        class SFQuery(orm_class.query_class):
+            single_flight = True
+        orm_class.query_class = SFQuery
+
+        q = orm_class.query
+        key = q.single_flight_key("foo")
+        self.assertTrue(key.startswith(orm_class.interface.connection_config.name))
+        self.assertTrue(key.endswith(":{}:foo".format(orm_class.schema)))
+
+        with orm_class.interface.transaction():
+            self.assertEqual("", q.single_flight_key("foo"))
+
+        q.single_flight = False
+        self.assertEqual("", q.single_flight_key("foo"))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import tempfile
+import time
+import threading
+from uuid import uuid4
+
+from . import BaseTestCase
+from prom.config import DsnConnection
+from prom.replica import Replicas
+import prom
+
+
+class ReplicasTest(BaseTestCase):
+    @classmethod
+    def create_sqlite_interface(cls, options=""):
+        path = os.path.join(tempfile.gettempdir(), "{}.sqlite".format(uuid4()))
+        config = DsnConnection("prom.interface.sqlite.SQLite://{}{}".format(path, options))
+        inter = config.interface
+        cls.connections.add(inter)
+        return inter
+
+    def get_replicated(self, count=2, **kwargs):
+        """return an orm class whose interface reads from count replicas, each db is
+        its own SQLite file so the tests can see where a read went"""
+        primary = self.create_sqlite_interface("?per_thread=1")
+        replicas = [self.create_sqlite_interface("?per_thread=1") for _ in range(count)]
+        primary.set_replicas(Replicas(primary, replicas, **kwargs))
+
+        orm_class = self.get_orm_class()
+        orm_class.interface = primary
+        for inter in [primary] + replicas:
+            inter.set_table(orm_class.schema)
+        return orm_class, primary, replicas
+
+    def test_routing(self):
+        orm_class, primary, replicas = self.get_replicated(window=0)
+        o = orm_class.create(foo=1, bar="one")
+        self.assertIsNone(orm_class.query.get_pk(o.pk))
+        self.assertEqual(1, orm_class.query.primary().count())
+        with primary.transaction():
+            self.assertEqual(1, orm_class.query.count())
+
+        for i, inter in enumerate(replicas, 2):
+            inter.insert(orm_class.schema, {"foo": i, "bar": "replica", "_created": o._created, "_updated": o._updated})
+
+        foos = [orm_class.query.get_one().foo for _ in range(4)]
+        self.assertEqual(set([2, 3]), set(foos))
+        self.assertNotEqual(foos[0], foos[1])
+        self.assertEqual(foos[:2], foos[2:])
+
+        s = primary.stats()["replicas"]
+        self.assertEqual(1, s["primary_reads"])
+        self.assertEqual(5, sum(r["reads"] for r in s["replicas"]))
+
+    def test_window(self):
+        orm_class, primary, replicas = self.get_replicated(window=0.2)
+        orm_class.create(foo=1, bar="one")
+        self.assertEqual(1, orm_class.query.count())
+
+        counts = []
+        t = threading.Thread(target=lambda: counts.append(orm_class.query.count()))
+        t.start()
+        t.join()
+        self.assertEqual([0], counts)
+
+        time.sleep(0.25)
+        self.assertEqual(0, orm_class.query.count())
+
+    def test_least_loaded(self):
+        orm_class, primary, replicas = self.get_replicated(count=3, strategy="least_loaded", window=0)
+        rs = primary.get_replicas()
+        rs.running[0].incr()
+        rs.running[2].incr()
+        for _ in range(3):
+            orm_class.query.count()
+        self.assertEqual([0, 3, 0], [r.stats() for r in rs.reads])
+
+        rs.running[0].decr()
+        rs.running[2].decr()
+        for _ in range(3):
+            orm_class.query.count()
+        self.assertEqual([1, 4, 1], [r.stats() for r in rs.reads])
+
+    def test_failure(self):
+        primary = self.create_sqlite_interface()
+        # a directory isn't a db file so every read fails
+        replica = DsnConnection("prom.interface.sqlite.SQLite://{}".format(tempfile.gettempdir())).interface
+        primary.set_replicas(Replicas(primary, [replica], window=0))
+
+        orm_class = self.get_orm_class()
+        orm_class.interface = primary
+        orm_class.create(foo=1, bar="one")
+        self.assertEqual(1, orm_class.query.count())
+        self.assertEqual(1, primary.get_replicas().failures.stats())
+
+    def test_configure(self):
+        names = [str(uuid4()) for _ in range(2)]
+        replicas = []
+        for name in names:
+            inter = self.create_sqlite_interface()
+            prom.set_interface(inter, name)
+            replicas.append(inter)
+
+        primary = self.create_sqlite_interface("?replicas={}&replica_strategy=least_loaded&replica_window=0".format(
+            ",".join(names)
+        ))
+        rs = primary.get_replicas()
+        self.assertEqual(replicas, rs.interfaces)
+        self.assertEqual("least_loaded", rs.strategy)
+        self.assertEqual(0.0, rs.window)
+        self.assertTrue(rs is primary.get_replicas())
+
+        self.assertIsNone(replicas[0].get_replicas())
+
+        primary.set_replicas(None)
+        self.assertIsNone(primary.get_replicas())
+
+        with self.assertRaises(ValueError):
+            Replicas(primary, replicas, strategy="random")
+
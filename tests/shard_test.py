@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import tempfile
+from uuid import uuid4
+
+from . import BaseTestCase
+from prom import Orm, Field
+from prom.config import DsnConnection
+from prom.shard import Shards
+import prom
+
+
+class ShardsTest(BaseTestCase):
+    def get_sharded(self, count=3, ranges=None):
+        """return an orm class split across count SQLite files, and the shard
+        interfaces so the tests can see where each row went"""
+        names = []
+        interfaces = []
+        for _ in range(count):
+            path = os.path.join(tempfile.gettempdir(), "{}.sqlite".format(uuid4()))
+            inter = DsnConnection("prom.interface.sqlite.SQLite://{}?per_thread=1".format(path)).interface
+            self.connections.add(inter)
+            name = str(uuid4())
+            prom.set_interface(inter, name)
+            names.append(name)
+            interfaces.append(inter)
+
+        class Torm(Orm):
+            table_name = self.get_table_name()
+            shard_connection_names = names
+            shard_field_name = "account"
+            shard_ranges = ranges
+            account = Field(int, True)
+            foo = Field(int, True)
+            bar = Field(str, False)
+
+        Torm.install()
+        return Torm, interfaces
+
+    def create(self, orm_class, count):
+        return [orm_class.create(account=i, foo=i % 5, bar=None if i % 4 else "bar") for i in range(count)]
+
+    def test_insert(self):
+        orm_class, interfaces = self.get_sharded()
+        instances = self.create(orm_class, 20)
+        counts = [inter.count(orm_class.schema) for inter in interfaces]
+        self.assertEqual(20, sum(counts))
+        self.assertTrue(all(counts))
+
+        shards = orm_class.shards
+        for o in instances:
+            inter = interfaces[shards.index(o.account)]
+            self.assertEqual(o.account, inter.get_one(orm_class.schema, orm_class.query.is_pk(o.pk).is_account(o.account))["account"])
+
+        with self.assertRaises(ValueError):
+            orm_class.query.set_foo(1).insert()
+
+    def test_point_query(self):
+        orm_class, interfaces = self.get_sharded()
+        instances = self.create(orm_class, 20)
+        shards = orm_class.shards
+
+        q = orm_class.query.is_account(7)
+        self.assertEqual([shards.index(7)], shards.indexes(q))
+        self.assertEqual(7, q.get_one().account)
+        self.assertEqual(instances[7].pk, orm_class.query.is_account(7).get_pk(instances[7].pk).pk)
+
+        q = orm_class.query.in_account([1, 7])
+        self.assertEqual(sorted(set([shards.index(1), shards.index(7)])), shards.indexes(q))
+        self.assertEqual([1, 7], list(q.select_account().asc_account().values()))
+
+        self.assertEqual([0, 1, 2], shards.indexes(orm_class.query.gt_account(7)))
+
+    def test_fan_out(self):
+        orm_class, interfaces = self.get_sharded()
+        self.create(orm_class, 20)
+
+        self.assertEqual(20, orm_class.query.count())
+        self.assertEqual(4, orm_class.query.is_foo(3).count())
+
+        accounts = orm_class.query.select_account().desc_account().values(limit=5, page=2)
+        self.assertEqual([14, 13, 12, 11, 10], list(accounts))
+        self.assertTrue(accounts.has_more)
+
+        instances = orm_class.query.asc_foo().desc_account().get()
+        self.assertEqual(20, len(instances))
+        self.assertEqual([15, 10, 5, 0, 16], [o.account for o in list(instances)[:5]])
+
+        # the sort field isn't selected so it is fetched just for the merge
+        self.assertEqual([4, 3, 2], list(orm_class.query.select_foo().desc_account().values(limit=3)))
+
+        # None sorts last like it does in Postgres
+        bars = list(orm_class.query.select_bar().asc_bar().values())
+        self.assertEqual(["bar"] * 5, bars[:5])
+        self.assertEqual([None] * 15, bars[5:])
+
+        self.assertEqual(19, orm_class.query.desc_account().get_one().account)
+        self.assertEqual(2, orm_class.query.asc_account().offset(2).get_one().account)
+        self.assertEqual(list(range(20)), [o.account for o in orm_class.query.asc_account().all()])
+
+        self.assertEqual([3, 1, 2], list(orm_class.query.select_account().in_account([1, 2, 3]).asc_account([3, 1, 2]).values()))
+
+    def test_update_delete(self):
+        orm_class, interfaces = self.get_sharded()
+        instances = self.create(orm_class, 20)
+
+        o = instances[7]
+        o.foo = 100
+        o.save()
+        self.assertEqual(100, orm_class.query.is_account(7).get_one().foo)
+        self.assertEqual(1, orm_class.query.is_foo(100).count())
+
+        o.account = 8
+        with self.assertRaises(ValueError):
+            o.save()
+
+        self.assertEqual(4, orm_class.query.is_foo(3).set_foo(30).update())
+        self.assertEqual(4, orm_class.query.is_foo(30).count())
+        with self.assertRaises(ValueError):
+            orm_class.query.is_foo(30).set_account(1).update()
+
+        instances[3].delete()
+        self.assertIsNone(orm_class.query.is_account(3).get_one())
+        self.assertEqual(19, orm_class.query.count())
+
+        self.assertEqual(4, orm_class.query.is_foo(4).delete())
+        self.assertEqual(15, orm_class.query.count())
+
+    def test_ranges(self):
+        orm_class, interfaces = self.get_sharded(ranges=[5, 10])
+        self.create(orm_class, 20)
+        self.assertEqual([5, 5, 10], [inter.count(orm_class.schema) for inter in interfaces])
+
+        shards = orm_class.shards
+        self.assertEqual([2], shards.indexes(orm_class.query.gte_account(12)))
+        self.assertEqual([0, 1], shards.indexes(orm_class.query.lt_account(7)))
+        self.assertEqual([1], shards.indexes(orm_class.query.gt_account(6).lte_account(8)))
+        self.assertEqual(3, orm_class.query.gt_account(6).lte_account(9).count())
+
+        with self.assertRaises(ValueError):
+            Shards(["one", "two"], "account", [2, 3])
+
+        with self.assertRaises(ValueError):
+            Shards(["one", "two", "three"], "account", [3, 2])
+
+    def test_transaction(self):
+        orm_class, interfaces = self.get_sharded()
+        self.create(orm_class, 10)
+        with interfaces[0].transaction():
+            self.assertTrue(orm_class.shards.in_transaction())
+            self.assertEqual(10, orm_class.query.count())
+        self.assertFalse(orm_class.shards.in_transaction())
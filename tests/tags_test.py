@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import tempfile
+from uuid import uuid4
+
+from . import BaseTestCase
+from prom.config import DsnConnection
+from prom.tags import QueryTags, request_id, get_request_id
+from prom import tags
+
+
+class QueryTagsTest(BaseTestCase):
+    def get_tagged(self):
+        """return an orm class whose interface tags its SQL, and the list every
+        statement the db runs is added to"""
+        path = os.path.join(tempfile.gettempdir(), "{}.sqlite".format(uuid4()))
+        inter = DsnConnection("prom.interface.sqlite.SQLite://{}?sql_comment=1".format(path)).interface
+        self.connections.add(inter)
+
+        orm_class = self.get_orm_class()
+        orm_class.interface = inter
+        orm_class.install()
+
+        statements = []
+        with inter.connection() as connection:
+            connection.set_trace_callback(statements.append)
+        return orm_class, statements
+
+    def test_comment(self):
+        orm_class, statements = self.get_tagged()
+        sqls = []
+        orm_class.interface.add_hook("after", lambda event: sqls.append(event.sql))
+
+        orm_class.create(foo=1, bar="one")
+        orm_class.query.is_foo(1).get_one()
+        orm_class.query.is_foo(1).set_bar("two").update()
+
+        orm_name = "{}.{}".format(orm_class.__module__, orm_class.__name__)
+        caller = "caller='{}%3Atest_comment'".format(__name__)
+        tagged = [sql for sql in statements if "/*" in sql]
+        for method_name, sql in zip(["insert", "get_one", "update"], tagged):
+            self.assertTrue(sql.endswith(" /*{},method='{}',orm='{}'*/".format(caller, method_name, orm_name)))
+
+        # the hooks see the same SQL no matter who called
+        self.assertFalse(any("/*" in sql for sql in sqls))
+
+        with request_id("abc 123"):
+            self.assertEqual("abc 123", get_request_id())
+            orm_class.query.count()
+        self.assertIsNone(get_request_id())
+        self.assertTrue(statements[-1].endswith(",request_id='abc%20123'*/"))
+
+        orm_class.query.count()
+        self.assertFalse("request_id" in statements[-1])
+
+    def test_comment_postgres(self):
+        dsn = os.environ["PROM_POSTGRES_DSN"]
+        dsn += "{}sql_comment=1".format("&" if "?" in dsn else "?")
+        inter = DsnConnection(dsn).interface
+        self.connections.add(inter)
+
+        orm_class = self.get_orm_class()
+        orm_class.interface = inter
+        orm_class.install()
+
+        # the quoted values have % in them, which psycopg2 reads as placeholders
+        # when the query has args
+        o = orm_class.create(foo=1, bar="one")
+        o2 = orm_class.query.is_pk(o.pk).get_one()
+        self.assertEqual("one", o2.bar)
+        self.assertEqual(1, orm_class.query.is_foo(1).count())
+
+    def test_format(self):
+        t = QueryTags()
+        self.assertEqual("", t.format({"orm": "", "caller": None}))
+        self.assertEqual("/*caller='a%27%2A%2F',method='get'*/", t.format({"method": "get", "caller": "a'*/"}))
+
+        self.assertTrue(t.comment(None, "get") is t.comment(None, "get"))
+        self.assertTrue("caller" not in QueryTags(caller=False).comment(None, "get"))
+
+        i = DsnConnection("sqlite://:memory:").interface
+        self.assertIsNone(i.query_tags)
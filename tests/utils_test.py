@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, division, print_function, absolute_import
 
+import time
+import copy
+import threading
+
 import testdata
 
-from . import BaseTestCase, TestCase
-from prom.utils import get_objects
+from . import BaseTestCase, TestCase, SkipTest
+from prom.utils import get_objects, SingleFlight, Future, Rows
 
 
 class GetObjectsTest(TestCase):
@@ -52,3 +56,101 @@ class GetObjectsTest(TestCase):
         self.assertEqual("relimp", module.__name__)
         self.assertEqual("Relimp", klass.__name__)
 
+
+
+class SingleFlightTest(TestCase):
+    def test_threads(self):
+        sf = SingleFlight()
+        calls = []
+        results = []
+
+        def callback(v):
+            calls.append(v)
+            time.sleep(0.5)
+            return v
+
+        def target():
+            results.append(sf.do("foo", callback, 1))
+
+        ts = [threading.Thread(target=target) for _ in range(5)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+
+        self.assertEqual([1], calls)
+        self.assertEqual(5, len(results))
+        self.assertEqual(1, len([r for r in results if not r[1]]))
+        self.assertEqual(set([1]), set(r[0] for r in results))
+        self.assertEqual({}, sf.calls)
+
+        # once the first call is done the next one runs again
+        self.assertEqual((1, False), sf.do("foo", callback, 1))
+
+    def test_error(self):
+        sf = SingleFlight()
+        errors = []
+
+        def callback():
+            time.sleep(0.5)
+            raise ValueError()
+
+        def target():
+            try:
+                sf.do("foo", callback)
+            except ValueError as e:
+                errors.append(e)
+
+        ts = [threading.Thread(target=target) for _ in range(3)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+        self.assertEqual(3, len(errors))
+
+    def test_gevent(self):
+        try:
+            import gevent
+            from gevent.event import Event
+        except ImportError:
+            raise SkipTest("gevent is not installed")
+
+        sf = SingleFlight()
+        sf.event_class = Event
+        calls = []
+
+        def callback():
+            calls.append(1)
+            gevent.sleep(0.2)
+            return 1
+
+        gs = [gevent.spawn(sf.do, "foo", callback) for _ in range(5)]
+        gevent.joinall(gs)
+        self.assertEqual(1, len(calls))
+        self.assertEqual([1] * 5, [g.value[0] for g in gs])
+
+
+class FutureTest(TestCase):
+    def test_result(self):
+        f = Future()
+        self.assertFalse(f.done())
+        t = threading.Timer(0.1, f.set_result, [5])
+        t.start()
+        self.assertEqual(5, f.result())
+        self.assertTrue(f.done())
+        self.assertIsNone(f.exception())
+
+    def test_exception(self):
+        f = Future()
+        f.set_exception(ValueError("foo"))
+        self.assertTrue(isinstance(f.exception(), ValueError))
+        with self.assertRaises(ValueError):
+            f.result()
+
+
+class RowsTest(TestCase):
+    def test_rows(self):
+        rows = Rows(["_id", "foo"], [(1, "one"), (2, "two")])
+        self.assertEqual(1, rows.index["foo"])
+        self.assertEqual([{"_id": 1, "foo": "one"}, {"_id": 2, "foo": "two"}], rows.dicts())
+
+        r = copy.copy(rows)
+        r.pop()
+        self.assertEqual(2, len(rows))
+        self.assertEqual(rows.columns, r.columns)